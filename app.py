@@ -1,9 +1,7 @@
 import os
-import StringIO
 import urlparse
 
 import bcrypt
-from twilio.rest import TwilioRestClient
 from flask.ext.login import LoginManager
 from flask import Flask
 from flask import Response
@@ -12,6 +10,7 @@ from flask import redirect
 from flask import url_for
 from flask import render_template
 from flask import session
+from flask import jsonify
 from flask.ext.login import login_user
 from flask.ext.login import logout_user
 from flask.ext.login import current_user
@@ -19,18 +18,64 @@ from flask.ext.login import login_required
 from pymongo import Connection
 
 from konfig import Konfig
+from lazy import LazyObject
+from replay import ReplayGuard
+from sms import FAILED, TWILIO_API, Coalescer, Outbox
+from sms import HttpTransport, TwilioTransport
 from totp_auth import TotpAuth
+from qrcode.cache import ImageCache
+from qrcode.stats import Stats, log_callback
+from qrcode.image.png import PngImage
 
 app = Flask(__name__)
 konf = Konfig()
 app.secret_key = konf.secret_key
 
-connection = Connection(konf.mongo_url)
+# MongoDB is connected to when the first request needs it.
+connection = LazyObject(lambda: Connection(konf.mongo_url))
 
 login_manager = LoginManager()
 login_manager.setup_app(app)
 
-twilio = TwilioRestClient()
+
+def make_twilio_client():
+    # Only sending an SMS needs twilio, which is slow to import.
+    from twilio.rest import TwilioRestClient
+    return TwilioRestClient()
+
+
+twilio = LazyObject(make_twilio_client)
+
+
+def make_sms_transport():
+    # Twilio's REST API over keep-alive connections, unless configured to
+    # go through the twilio client.
+    if konf.sms_transport == 'twilio':
+        return TwilioTransport(twilio)
+    return HttpTransport(konf.twilio_account_sid, konf.twilio_auth_token,
+                         base_url=konf.twilio_api_url or TWILIO_API,
+                         size=int(konf.sms_pool_size or 4),
+                         connect_timeout=float(konf.sms_connect_timeout or 5),
+                         read_timeout=float(konf.sms_read_timeout or 10))
+
+
+# SMS are sent by background threads, so requests don't wait for Twilio.
+sms_outbox = Outbox(make_sms_transport(),
+                    workers=int(konf.sms_workers or 2),
+                    max_queued=int(konf.sms_queue_size or 100))
+
+# Refreshing a page that sends an SMS doesn't text the same token again.
+sms_coalescer = Coalescer(sms_outbox)
+
+# Rendered enrollment QR codes, tagged with the uid of their owner.
+qr_cache = ImageCache(max_bytes=int(konf.qr_cache_bytes or 4 * 1024 * 1024),
+                      directory=konf.qr_cache_dir or None)
+
+# Time spent in each stage of making QR codes, logged as it is recorded.
+qr_stats = Stats(callback=log_callback(app.logger))
+
+# The (uid, time step) of every token accepted in the verification window.
+replay_guard = ReplayGuard()
 
 
 @login_manager.user_loader
@@ -47,6 +92,8 @@ class User:
             self.totp = TotpAuth(self.account['totp_secret'])
 
     def create(self):
+        # Images of a previous secret must not outlive it.
+        qr_cache.clear_tag(self.id)
         auth = TotpAuth()
         self.db.insert({'uid': self.id,
                         'totp_secret': auth.secret})
@@ -59,21 +106,30 @@ class User:
         pwd_hash = self.account['password_hash']
         return bcrypt.hashpw(pwd, pwd_hash) == pwd_hash
 
+    def token_valid(self, token):
+        """Accept a valid token once, refusing it if it is replayed"""
+        step = self.totp.verify(token)
+        return step is not None and replay_guard.claim(self.id, step)
+
     def send_sms(self, ok_to_send=False):
+        """Queue an SMS with the current token
+
+        Returns False if it can't be sent. Otherwise whether it was, which
+        /sms-status reports, is known once the outbox gets to it."""
         if 'totp_enabled_via_sms' in self.account:
             ok_to_send = True
         if ok_to_send:
-            token = self.totp.generate_token()
+            # The nearest step of the window is the current one.
+            step, token = self.totp.window()[0]
             msg = "Use this code to log in: %s" % token
-            try:
-                phone_number = self.account['phone_number']
-                rv = twilio.sms.messages.create(to=phone_number,
-                                                from_=konf.twilio_from_number,
-                                                body=msg)
-            except:
+            if 'phone_number' not in self.account:
                 return False
-            if rv:
-                return rv.status != 'failed'
+            phone_number = self.account['phone_number']
+            key = (self.id, phone_number, step)
+            message = sms_coalescer.send(key, phone_number,
+                                         konf.twilio_from_number, msg)
+            session['sms_id'] = message.id
+            return message.status != FAILED
         return False
 
     # The methods below are required by flask-login
@@ -147,7 +203,7 @@ def verify_tfa():
     if session['stage'] != 'password-validated':
         opts['error-unverified-password'] = True
         return render_template('verify_tfa.html', opts=opts)
-    if user.totp.valid(request.form['token']):
+    if user.token_valid(request.form['token']):
         login_user(user)
         session['stage'] = 'logged-in'
         return redirect(url_for('user'))
@@ -163,7 +219,7 @@ def enable_tfa_via_app():
     if request.method == 'GET':
         return render_template('enable_tfa_via_app.html', opts=opts)
     token = request.form['token']
-    if token and current_user.totp.valid(token):
+    if token and current_user.token_valid(token):
         current_user.account['totp_enabled_via_app'] = True
         current_user.save()
         return render_template('enable_tfa_via_app.html', opts=opts)
@@ -184,10 +240,10 @@ def auth_qr_code():
     if not domain:
         domain = 'example.com'
     username = "%s@%s" % (current_user.id, domain)
-    qrcode = current_user.totp.qrcode(username)
-    stream = StringIO.StringIO()
-    qrcode.save(stream)
-    image = stream.getvalue()
+    # PngImage writes the PNG itself, so PIL isn't loaded in web workers
+    uri = current_user.totp.provisioning_uri(username)
+    image = qr_cache.get_or_make(uri, tag=current_user.id,
+                                 image_factory=PngImage, stats=qr_stats)
     return Response(image, mimetype='image/png')
 
 
@@ -204,7 +260,7 @@ def enable_tfa_via_sms():
         opts['phone_number_updated'] = True
         return render_template('enable_tfa_via_sms.html', opts=opts)
     token = request.form['token']
-    if token and current_user.totp.valid(token):
+    if token and current_user.token_valid(token):
         current_user.account['totp_enabled_via_sms'] = True
         current_user.save()
         return render_template('enable_tfa_via_sms.html', opts=opts)
@@ -213,6 +269,17 @@ def enable_tfa_via_sms():
         return render_template('enable_tfa_via_sms.html', opts=opts)
 
 
+@app.route("/sms-status")
+def sms_status():
+    """Report what became of the last SMS sent to this session"""
+    status = sms_outbox.status(session.get('sms_id'))
+    if status is None:
+        rv = jsonify(status='unknown')
+        rv.status_code = 404
+        return rv
+    return jsonify(**status)
+
+
 @app.route("/user")
 @login_required
 def user():
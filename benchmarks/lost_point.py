@@ -0,0 +1,128 @@
+"""
+Time the mask penalty engines for every QR Code version.
+
+Compares the original module-by-module scoring loop (kept below for
+reference) with the bitboard and NumPy engines in ``qrcode.penalty``, and
+checks that all of them agree.
+
+    $ python benchmarks/lost_point.py [repeat]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import qrcode
+from qrcode import penalty
+
+
+def legacy_lost_point(modules):
+    """The scoring loop ``qrcode.util.lost_point`` used to run."""
+    modules_count = len(modules)
+
+    lost_point = 0
+
+    for row in range(modules_count):
+        for col in range(modules_count):
+            sameCount = 0
+            dark = modules[row][col]
+            for r in range(-1, 2):
+                if row + r < 0 or modules_count <= row + r:
+                    continue
+                for c in range(-1, 2):
+                    if col + c < 0 or modules_count <= col + c:
+                        continue
+                    if r == 0 and c == 0:
+                        continue
+                    if dark == modules[row + r][col + c]:
+                        sameCount += 1
+            if sameCount > 5:
+                lost_point += (3 + sameCount - 5)
+
+    for row in range(modules_count - 1):
+        for col in range(modules_count - 1):
+            count = 0
+            if modules[row][col]:
+                count += 1
+            if modules[row + 1][col]:
+                count += 1
+            if modules[row][col + 1]:
+                count += 1
+            if modules[row + 1][col + 1]:
+                count += 1
+            if count == 0 or count == 4:
+                lost_point += 3
+
+    for row in range(modules_count):
+        for col in range(modules_count - 6):
+            if (modules[row][col]
+                    and not modules[row][col + 1]
+                    and modules[row][col + 2]
+                    and modules[row][col + 3]
+                    and modules[row][col + 4]
+                    and not modules[row][col + 5]
+                    and modules[row][col + 6]):
+                lost_point += 40
+
+    for col in range(modules_count):
+        for row in range(modules_count - 6):
+            if (modules[row][col]
+                    and not modules[row + 1][col]
+                    and modules[row + 2][col]
+                    and modules[row + 3][col]
+                    and modules[row + 4][col]
+                    and not modules[row + 5][col]
+                    and modules[row + 6][col]):
+                lost_point += 40
+
+    darkCount = 0
+    for col in range(modules_count):
+        for row in range(modules_count):
+            if modules[row][col]:
+                darkCount += 1
+
+    ratio = abs(100 * darkCount // modules_count // modules_count - 50) // 5
+    lost_point += ratio * 10
+
+    return lost_point
+
+
+def symbol(version):
+    qr = qrcode.QRCode(version=version)
+    qr.add_data('x')
+    qr.makeImpl(True, 0)
+    return qr.modules
+
+
+def best(func, arg, repeat):
+    return min(timeit.repeat(lambda: func(arg), number=1, repeat=repeat))
+
+
+def main(repeat=3):
+    engines = [('bitboard', penalty.bitboard_lost_point)]
+    if penalty._numpy_available():
+        engines.append(('numpy', penalty.numpy_lost_point))
+
+    header = "%7s %10s" % ("version", "legacy ms")
+    for name, func in engines:
+        header += " %10s %8s" % (name + " ms", "speedup")
+    print(header)
+
+    for version in range(1, 41):
+        matrix = symbol(version)
+        modules = matrix.tolist()
+        expected = legacy_lost_point(modules)
+        legacy = best(legacy_lost_point, modules, repeat)
+        line = "%7d %10.3f" % (version, legacy * 1000)
+        for name, func in engines:
+            if func(matrix) != expected:
+                raise AssertionError("%s engine disagrees at version %d" %
+                                     (name, version))
+            elapsed = best(func, matrix, repeat)
+            line += " %10.3f %7.1fx" % (elapsed * 1000, legacy / elapsed)
+        print(line)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,59 @@
+"""
+Compare the throughput of the in-house TOTP core with pyotp's.
+
+Prints the tokens generated and verified per second by ``otp.TOTP`` and,
+when it is installed, ``pyotp.TOTP``.
+
+    $ python benchmarks/otp.py [number]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import otp
+
+try:
+    import pyotp
+except ImportError:
+    pyotp = None
+
+SECRET = 'JBSWY3DPEHPK3PXP'
+FOR_TIME = 1234567890
+
+
+def benchmarks(module):
+    totp = module.TOTP(SECRET)
+    token = totp.at(FOR_TIME)
+    step = FOR_TIME // 30
+    return [
+        ('generate', lambda: totp.generate_otp(step)),
+        ('verify', lambda: totp.verify(token, FOR_TIME)),
+    ]
+
+
+def main(number=20000):
+    modules = [otp]
+    if pyotp is None:
+        print('pyotp is not installed, skipping it')
+    else:
+        modules.append(pyotp)
+
+    print('%-8s %-8s %12s' % ('module', 'call', 'per second'))
+    rates = {}
+    for module in modules:
+        for name, func in benchmarks(module):
+            seconds = min(timeit.repeat(func, number=number, repeat=3))
+            rates[module, name] = number / seconds
+            print('%-8s %-8s %12.0f' % (
+                module.__name__, name, rates[module, name]))
+
+    if pyotp is not None:
+        for name in ('generate', 'verify'):
+            print('%s speedup: %.1fx' % (
+                name, rates[otp, name] / rates[pyotp, name]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,56 @@
+"""
+Measure the throughput of ReplayGuard under concurrent verification.
+
+Each thread verifies a token and claims it for its own users, as a login
+does. Prints the logins per second for a single lock, sharded locks, and
+sharded locks with a LocalStore backend standing in for a shared store.
+
+    $ python benchmarks/replay.py [logins per thread]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from replay import LocalStore, ReplayGuard
+from totp_auth import TotpAuth
+
+CONFIGS = [
+    ('1 shard', lambda: ReplayGuard(shards=1)),
+    ('16 shards', lambda: ReplayGuard(shards=16)),
+    ('16 + store', lambda: ReplayGuard(shards=16, backend=LocalStore())),
+]
+
+
+def login(guard, auth, uids):
+    for uid in uids:
+        step = auth.verify(auth.generate_token())
+        assert guard.claim(uid, step)
+
+
+def run(guard, threads, logins):
+    auth = TotpAuth('JBSWY3DPEHPK3PXP')
+    workers = [
+        threading.Thread(target=login, args=(
+            guard, auth, ['user%d.%d' % (n, i) for i in range(logins)]))
+        for n in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * logins / (time.time() - start)
+
+
+def main(logins=20000):
+    print('%7s' % 'threads' + ''.join('%12s' % name for name, _ in CONFIGS))
+    for threads in (1, 2, 4, 8):
+        print('%7d' % threads + ''.join(
+            '%12.0f' % run(make_guard(), threads, logins)
+            for name, make_guard in CONFIGS))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,267 @@
+"""
+Time every stage of the QR Code pipeline.
+
+Each stage is timed separately for every version and error correction
+level, with data filling the symbol to capacity:
+
+    create_data          util.create_data
+    best_fit             QRCode.best_fit
+    best_mask_pattern    QRCode.best_mask_pattern
+    lost_point           util.lost_point
+    map_data             QRCode.map_data
+    make_image_pil       QRCode.make_image with PilImage
+    make_image_svg       QRCode.make_image with SvgImage
+
+The best time of ``--repeat`` runs is kept. Results are written as JSON and
+compared with a baseline saved by an earlier run; the exit status is 1 if
+any stage got slower than the threshold allows.
+
+``benchmarks/baseline.json`` is committed, saved with the default options
+(the ``python`` and ``platform`` it records say where). Timings only
+compare on the same machine, so elsewhere save a baseline of the code
+before a change first:
+
+    $ python benchmarks/run.py --save-baseline     # before a change
+    $ python benchmarks/run.py                     # after it
+
+Commit a new baseline along with changes that are meant to speed up (or
+are allowed to slow down) a stage.
+"""
+import json
+import optparse
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import qrcode
+from qrcode import constants, template, util
+from qrcode.image.svg import SvgImage
+
+try:
+    from qrcode.image.pil import PilImage
+except ImportError:
+    PilImage = None
+
+LEVELS = {
+    'L': constants.ERROR_CORRECT_L,
+    'M': constants.ERROR_CORRECT_M,
+    'Q': constants.ERROR_CORRECT_Q,
+    'H': constants.ERROR_CORRECT_H,
+}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def payload(version, error_correction):
+    """
+    Return 8bit byte data filling a symbol of the given version.
+    """
+    bits = util.BIT_LIMIT_TABLE[error_correction][version]
+    bits -= 4 + util.length_in_bits(util.MODE_8BIT_BYTE, version)
+    rand = random.Random(version)
+    return ''.join(rand.choice('abcdefghijklmnopqrstuvwxyz')
+                   for i in range(bits // 8))
+
+
+def best_time(func, repeat, setup=None):
+    """
+    Return the best time of ``repeat`` calls of ``func``, calling ``setup``
+    (untimed) before each of them.
+    """
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def time_stages(version, error_correction, repeat):
+    """
+    Return a dict of stage names to best times (in seconds).
+    """
+    data = payload(version, error_correction)
+    qr = qrcode.QRCode(error_correction=error_correction)
+    qr.add_data(data)
+    data_list = qr.data_list
+    results = {}
+
+    results['best_fit'] = best_time(qr.best_fit, repeat)
+    if qr.version != version:
+        raise AssertionError("payload for version %d fits version %d" %
+                             (version, qr.version))
+
+    results['create_data'] = best_time(
+        lambda: util.create_data(version, error_correction, data_list),
+        repeat)
+
+    results['best_mask_pattern'] = best_time(qr.best_mask_pattern, repeat)
+    mask_pattern = qr.best_mask_pattern()
+    qr.makeImpl(False, mask_pattern)
+
+    modules = qr.modules
+    results['lost_point'] = best_time(lambda: util.lost_point(modules),
+                                      repeat)
+
+    def fresh_matrix():
+        qr.modules = template.get(version).matrix()
+    results['map_data'] = best_time(
+        lambda: qr.map_data(qr.data_cache, mask_pattern), repeat,
+        fresh_matrix)
+    qr.makeImpl(False, mask_pattern)
+
+    if PilImage is not None:
+        results['make_image_pil'] = best_time(
+            lambda: qr.make_image(PilImage), repeat)
+    results['make_image_svg'] = best_time(
+        lambda: qr.make_image(SvgImage), repeat)
+    return results
+
+
+def parse_versions(text):
+    """
+    Parse a version list such as ``1-10,20,40``.
+    """
+    versions = []
+    for part in text.split(','):
+        if '-' in part:
+            low, high = part.split('-')
+            versions.extend(range(int(low), int(high) + 1))
+        else:
+            versions.append(int(part))
+    for version in versions:
+        if not 1 <= version <= 40:
+            raise ValueError("Invalid version (was %s, expected 1 to 40)" %
+                             version)
+    return versions
+
+
+def run(versions, levels, repeat, out=sys.stdout):
+    results = {}
+    for level in levels:
+        for version in versions:
+            stages = time_stages(version, LEVELS[level], repeat)
+            out.write("%2d-%s %s\n" % (version, level, ' '.join(
+                "%s=%.2fms" % (name, stages[name] * 1000)
+                for name in sorted(stages))))
+            for name, elapsed in stages.items():
+                results['%s/%d-%s' % (name, version, level)] = elapsed
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold, noise):
+    """
+    Return the ``(name, baseline, current)`` times of the measurements
+    which are more than ``threshold`` (a fraction) slower than the baseline.
+    Differences under ``noise`` seconds are ignored.
+    """
+    regressions = []
+    for name, elapsed in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if elapsed > before * (1 + threshold) and elapsed - before > noise:
+            regressions.append((name, before, elapsed))
+    return regressions
+
+
+def summarize(current, baseline, out=sys.stdout):
+    """
+    Print the total time of each stage, against the baseline if given.
+    """
+    totals = {}
+    for name, elapsed in current['results'].items():
+        stage = name.split('/')[0]
+        before = baseline and baseline['results'].get(name)
+        total = totals.setdefault(stage, [0.0, 0.0])
+        total[0] += elapsed
+        if before is not None:
+            total[1] += before
+    for stage in sorted(totals):
+        elapsed, before = totals[stage]
+        line = "%-18s %10.2fms" % (stage, elapsed * 1000)
+        if before:
+            line += "  baseline %10.2fms  %+6.1f%%" % (
+                before * 1000, (elapsed / before - 1) * 100)
+        out.write(line + "\n")
+
+
+def main(args=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-v', '--versions', default='1-40',
+                      help="versions to time, e.g. 1-10,20 "
+                           "[default: %default]")
+    parser.add_option('-l', '--levels', default='LMQH',
+                      help="error correction levels [default: %default]")
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help="runs per measurement [default: %default]")
+    parser.add_option('-o', '--output',
+                      help="write the results to this JSON file")
+    parser.add_option('-b', '--baseline', default=DEFAULT_BASELINE,
+                      help="baseline JSON file [default: %default]")
+    parser.add_option('--save-baseline', action='store_true',
+                      help="save the results as the baseline")
+    parser.add_option('-t', '--threshold', type='float', default=0.2,
+                      help="allowed slowdown, as a fraction "
+                           "[default: %default]")
+    parser.add_option('--noise', type='float', default=0.0002,
+                      help="ignore differences under this many seconds "
+                           "[default: %default]")
+    options, args = parser.parse_args(args)
+    if args:
+        parser.error("unexpected arguments")
+    levels = options.levels.upper()
+    if not levels or set(levels) - set(LEVELS):
+        parser.error("levels must be made of L, M, Q and H")
+
+    current = run(parse_versions(options.versions), levels, options.repeat)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+        print("Saved baseline to %s" % options.baseline)
+        summarize(current, None)
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print("No baseline at %s (save one with --save-baseline)" %
+              options.baseline)
+        summarize(current, None)
+        return 0
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    summarize(current, baseline)
+    regressions = compare(current, baseline, options.threshold,
+                          options.noise)
+    for name, before, elapsed in regressions:
+        print("REGRESSION %s: %.3fms -> %.3fms (%+.1f%%)" % (
+            name, before * 1000, elapsed * 1000,
+            (elapsed / before - 1) * 100))
+    if regressions:
+        return 1
+    print("No regressions over %d%%" % (options.threshold * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
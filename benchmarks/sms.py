@@ -0,0 +1,65 @@
+"""
+Compare the latency of sending SMS over pooled and unpooled connections.
+
+Sends messages from several threads through an Outbox sending in the
+calling thread (the path ``User.send_sms`` takes, minus the queue) to a
+local stand-in for Twilio's API, and prints the p50 and p99 latency of a
+send and the connections made. The stand-in waits ``connect_latency``
+seconds for every new connection, standing in for the TCP and TLS
+handshakes.
+
+    $ python benchmarks/sms.py [sends per thread] [threads] [connect ms]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sms import HttpTransport, Outbox
+from sms_standin import StandInServer
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(server, pool_size, sends, threads):
+    transport = HttpTransport('AC123', 'secret', base_url=server.url,
+                              size=pool_size)
+    outbox = Outbox(transport, workers=0, retries=0)
+    latencies = []
+
+    def send():
+        for i in range(sends):
+            start = time.time()
+            outbox.send('+14155550000', '+14155551212', 'hi')
+            latencies.append(time.time() - start)
+
+    workers = [threading.Thread(target=send) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    transport.pool.close()
+    return latencies, transport.pool.created
+
+
+def main(sends=200, threads=4, connect_ms=20):
+    server = StandInServer(connect_latency=connect_ms / 1000.0).start()
+    try:
+        print('%-10s %9s %9s %12s' % ('transport', 'p50 ms', 'p99 ms',
+                                      'connections'))
+        for name, pool_size in (('unpooled', 0), ('pooled', threads)):
+            latencies, connections = run(server, pool_size, sends, threads)
+            print('%-10s %9.2f %9.2f %12d' % (
+                name, percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000, connections))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
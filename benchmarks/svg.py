@@ -0,0 +1,48 @@
+"""
+Compare the path based SVG factory with the ElementTree based one.
+
+Prints the document size and the time taken to make and save an image with
+``SvgImage`` and ``SvgPathImage`` for a range of versions.
+
+    $ python benchmarks/svg.py [repeat]
+"""
+import os
+import sys
+import timeit
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import qrcode
+from qrcode.image.svg import SvgImage, SvgPathImage
+
+
+def render(qr, image_factory):
+    stream = StringIO()
+    qr.make_image(image_factory).save(stream)
+    return stream.getvalue()
+
+
+def main(repeat=20):
+    print('%7s %10s %10s %9s %9s %7s' % (
+        'version', 'rect size', 'path size', 'rect ms', 'path ms', 'speedup'))
+    for version in (1, 5, 10, 20, 30, 40):
+        qr = qrcode.QRCode(version=version)
+        qr.add_data('x')
+        qr.make(fit=False)
+
+        sizes = []
+        times = []
+        for image_factory in (SvgImage, SvgPathImage):
+            sizes.append(len(render(qr, image_factory)))
+            times.append(min(timeit.repeat(
+                lambda: render(qr, image_factory),
+                number=1, repeat=repeat)) * 1000)
+
+        print('%7d %10d %10d %9.2f %9.2f %6.1fx' % (
+            version, sizes[0], sizes[1], times[0], times[1],
+            times[0] / times[1]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
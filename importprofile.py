@@ -0,0 +1,78 @@
+"""Print where the time goes when a module is imported.
+
+Example:
+$ python importprofile.py app
+
+Every import which loads new modules is timed. The breakdown lists them
+slowest first, with their cumulative time (including the imports they make)
+and their own time.
+"""
+import __builtin__
+import sys
+import time
+
+
+class ImportProfile(object):
+    """Time the imports made while it is installed."""
+
+    def __init__(self):
+        # (depth, name, cumulative seconds, own seconds), in the order the
+        # imports finished.
+        self.records = []
+        self._children = []
+        self._import = None
+
+    def install(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def uninstall(self):
+        __builtin__.__import__ = self._import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=None,
+                      level=-1):
+        loaded = len(sys.modules)
+        self._children.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            if len(sys.modules) != loaded:
+                if fromlist:
+                    name = "%s (%s)" % (name, ", ".join(fromlist))
+                self.records.append((len(self._children), name, elapsed,
+                                     elapsed - children))
+
+    def report(self, out=None, limit=25):
+        if out is None:
+            out = sys.stdout
+        total = sum(record[2] for record in self.records if record[0] == 0)
+        out.write("%d imports, %.1fms in total\n\n" % (len(self.records),
+                                                       total * 1000))
+        out.write("%10s %10s  %s\n" % ("cumul ms", "own ms", "module"))
+        slowest = sorted(self.records, key=lambda record: -record[2])
+        for depth, name, elapsed, own in slowest[:limit]:
+            out.write("%10.1f %10.1f  %s\n" % (elapsed * 1000, own * 1000,
+                                              name))
+
+
+def profile(module):
+    """Import a module (which mustn't be loaded yet) under a profile."""
+    profiler = ImportProfile()
+    profiler.install()
+    try:
+        __import__(module)
+    finally:
+        profiler.uninstall()
+    return profiler
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit("usage: %s module [limit]" % sys.argv[0])
+    limit = int(sys.argv[2]) if len(sys.argv) == 3 else 25
+    profile(sys.argv[1]).report(limit=limit)
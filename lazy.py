@@ -0,0 +1,36 @@
+import threading
+
+
+class LazyObject(object):
+    """Create an object the first time one of its attributes is used.
+
+    Example:
+    from lazy import LazyObject
+    twilio = LazyObject(make_twilio_client)
+    twilio.sms   # calls make_twilio_client() once, then uses its result
+
+    This keeps slow imports and connections out of start-up for objects
+    which most requests never touch.
+    """
+    def __init__(self, factory):
+        self.__dict__['_factory'] = factory
+        self.__dict__['_object'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _get_object(self):
+        obj = self._object
+        if obj is None:
+            with self._lock:
+                obj = self._object
+                if obj is None:
+                    obj = self.__dict__['_object'] = self._factory()
+        return obj
+
+    def __getattr__(self, name):
+        return getattr(self._get_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_object(), name, value)
+
+    def __getitem__(self, key):
+        return self._get_object()[key]
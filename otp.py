@@ -0,0 +1,172 @@
+"""One-time passwords: HOTP (RFC 4226) and TOTP (RFC 6238).
+
+Example:
+from otp import TOTP, random_base32
+totp = TOTP(random_base32())
+totp.now()                       # the current token, as an integer
+totp.match(token)                # the time step token is valid for, or None
+totp.provisioning_uri('alice@example.com')
+
+The secret is base32 decoded and keyed into the HMAC once per instance;
+each token then costs a copy of the keyed HMAC, one update with the
+packed counter and a digest.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import random
+import struct
+import time
+import urllib
+
+B32_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+
+# hmac.compare_digest is only in Python 2.7.7 and later.
+_compare_digest = getattr(hmac, 'compare_digest', lambda a, b: a == b)
+
+_system_random = random.SystemRandom()
+
+
+def random_base32(length=16, random=_system_random):
+    """Return a random base32 secret of ``length`` characters."""
+    return ''.join(random.choice(B32_ALPHABET) for i in xrange(length))
+
+
+class OTP(object):
+    """Tokens computed from a counter (the shared part of HOTP and TOTP)."""
+
+    def __init__(self, secret, digits=6, digest=hashlib.sha1):
+        """
+        @param [String] secret in the form of base32
+        @option options digits [Integer] (6) number of digits in the OTP
+        @option options digest [Callable] (hashlib.sha1) HMAC digest
+        """
+        self.secret = secret
+        self.digits = digits
+        self.digest = digest
+        self.byte_secret = base64.b32decode(secret, casefold=True)
+        self._hmac = hmac.new(self.byte_secret, digestmod=digest)
+        self._modulus = 10 ** digits
+
+    def generate_otp(self, counter):
+        """
+        @param [Integer] counter the HOTP counter or TOTP time step
+        @return [Integer] the OTP as an integer
+        """
+        mac = self._hmac.copy()
+        mac.update(struct.pack('>Q', counter))
+        hmac_hash = mac.digest()
+
+        # Dynamic truncation: 31 bits from the offset the last nibble gives.
+        offset = ord(hmac_hash[-1]) & 0xf
+        code = struct.unpack_from('>I', hmac_hash, offset)[0] & 0x7fffffff
+        return code % self._modulus
+
+    def format(self, otp):
+        """Return an OTP as a string, zero padded to ``digits``."""
+        return '%0*d' % (self.digits, otp)
+
+    def match_tokens(self, otp, expected):
+        """
+        Return the counter of the first ``(counter, token)`` pair of
+        ``expected`` whose token is ``otp``, or None. Every pair is
+        checked, so the time taken doesn't depend on which one matches.
+        """
+        try:
+            otp = self.format(int(otp))
+        except (TypeError, ValueError):
+            return None
+        matched = None
+        for counter, token in expected:
+            if _compare_digest(otp, self.format(token)) and matched is None:
+                matched = counter
+        return matched
+
+    def _matches(self, otp, counters):
+        """Return the first of ``counters`` whose OTP is ``otp``, or None."""
+        return self.match_tokens(otp, [(counter, self.generate_otp(counter))
+                                       for counter in counters])
+
+    def _uri(self, kind, name, issuer, parameters):
+        """Build an otpauth:// URI (as read by Google Authenticator)."""
+        label = urllib.quote(name, safe='@')
+        query = [('secret', self.secret)]
+        if issuer is not None:
+            label = urllib.quote(issuer, safe='@') + ':' + label
+            query.append(('issuer', issuer))
+        if self.digest is not hashlib.sha1:
+            query.append(('algorithm', self.digest().name.upper()))
+        if self.digits != 6:
+            query.append(('digits', self.digits))
+        query.extend(parameters)
+        return 'otpauth://%s/%s?%s' % (kind, label, '&'.join(
+            '%s=%s' % (key, urllib.quote(str(value), safe=''))
+            for key, value in query))
+
+
+class HOTP(OTP):
+    """Counter based one-time passwords (RFC 4226)."""
+
+    def at(self, count):
+        return self.generate_otp(count)
+
+    def verify(self, otp, count):
+        return self._matches(otp, [count]) is not None
+
+    def provisioning_uri(self, name, initial_count=0, issuer=None):
+        return self._uri('hotp', name, issuer,
+                         [('counter', initial_count)])
+
+
+class TOTP(OTP):
+    """Time based one-time passwords (RFC 6238)."""
+
+    def __init__(self, secret, digits=6, digest=hashlib.sha1, interval=30):
+        """
+        @option options interval [Integer] (30) the time step in seconds
+        """
+        super(TOTP, self).__init__(secret, digits, digest)
+        self.interval = interval
+
+    def timecode(self, for_time=None):
+        """
+        Return the time step of a datetime (in local time) or Unix
+        timestamp, by default now.
+        """
+        if for_time is None:
+            for_time = time.time()
+        elif isinstance(for_time, datetime.datetime):
+            for_time = time.mktime(for_time.timetuple())
+        return int(for_time) // self.interval
+
+    def at(self, for_time):
+        """
+        @param [Time/Integer] for_time a datetime or Unix timestamp
+        @return [Integer] the OTP as an integer
+        """
+        return self.generate_otp(self.timecode(for_time))
+
+    def now(self):
+        return self.generate_otp(self.timecode())
+
+    def match(self, otp, for_time=None, look_behind=0, look_ahead=0):
+        """
+        Return the time step ``otp`` is valid for, or None.
+
+        Steps from ``look_behind`` before the one of ``for_time`` (by
+        default, now) to ``look_ahead`` after it are accepted, the nearest
+        winning if the OTP is valid for several.
+        """
+        step = self.timecode(for_time)
+        offsets = sorted(range(-look_behind, look_ahead + 1), key=abs)
+        return self._matches(otp, [step + offset for offset in offsets])
+
+    def verify(self, otp, for_time=None):
+        return self.match(otp, for_time) is not None
+
+    def provisioning_uri(self, name, issuer=None):
+        parameters = []
+        if self.interval != 30:
+            parameters.append(('period', self.interval))
+        return self._uri('totp', name, issuer, parameters)
@@ -1,4 +1,5 @@
 from qrcode.main import QRCode, make
+from qrcode.batch import make_many
 from qrcode.constants import *
 from qrcode import image
 
@@ -18,4 +19,9 @@ def run_example(data="http://www.lincolnloop.com", *args, **kwargs):
 
 if __name__ == '__main__':
     import sys
-    run_example(*sys.argv[1:])
+    if sys.stdin.isatty():
+        run_example(*sys.argv[1:])
+    else:
+        # Payloads piped in: make a numbered image file for each line.
+        from qrcode.batch import main
+        main(sys.argv[1:])
@@ -0,0 +1,202 @@
+"""
+Generate many QR Codes in parallel.
+
+Encoding is pure Python and CPU bound, so ``make_many`` fans the work out
+over a pool of worker processes. Each worker warms the shared tables (Reed
+Solomon generators and function pattern templates) once when it starts, and
+only a bounded number of payloads is in flight at any time so memory use
+stays flat however long the input is.
+"""
+import collections
+import sys
+from StringIO import StringIO
+
+from qrcode import base, constants, rs, template
+from qrcode.main import make
+
+# The QRCode options of the current worker process, set by _init_worker.
+_worker_options = {}
+
+
+def make_many(iterable, processes=None, ordered=True, window=None,
+              **options):
+    """
+    Make a QR Code image for every payload in ``iterable``, returning an
+    iterator over the saved images (as byte strings).
+
+    :param processes: The number of worker processes, defaulting to the
+        number of CPUs. ``0`` makes the images in the calling process.
+    :param ordered: If ``True``, the images come back in input order.
+        Otherwise ``(index, image)`` pairs are yielded as soon as each image
+        is ready, ``index`` being the position of the payload in the input.
+    :param window: The most payloads handed to the workers but not yet
+        yielded back, defaulting to four per process.
+    :param options: Passed to ``QRCode`` (``version``, ``error_correction``,
+        ``box_size``, ``border`` and ``image_factory``). The image factory
+        has to be importable by the workers.
+    """
+    if processes == 0:
+        return _make_serial(iterable, ordered, options)
+    return _make_parallel(iterable, processes, ordered, window, options)
+
+
+def _make_serial(iterable, ordered, options):
+    # The options are passed along rather than set as the worker options,
+    # so generators running side by side don't use each other's.
+    _warm_tables(options)
+    for index, data in enumerate(iterable):
+        image = _unwrap(_render(data, options))
+        yield image if ordered else (index, image)
+
+
+def _make_parallel(iterable, processes, ordered, window, options):
+    import multiprocessing
+    import Queue
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if window is None:
+        window = processes * 4
+    if window < 1:
+        raise ValueError("window must be at least 1")
+
+    pool = multiprocessing.Pool(processes, _init_worker, (options,))
+    try:
+        payloads = enumerate(iterable)
+        if ordered:
+            pending = collections.deque()
+            for index, data in payloads:
+                pending.append(pool.apply_async(_render_in_worker, (data,)))
+                if len(pending) >= window:
+                    yield _unwrap(pending.popleft().get())
+            while pending:
+                yield _unwrap(pending.popleft().get())
+        else:
+            # _render never raises, so every task reaches the callback.
+            done = Queue.Queue()
+            in_flight = 0
+            for index, data in payloads:
+                pool.apply_async(_render_indexed, (index, data),
+                                 callback=done.put)
+                in_flight += 1
+                if in_flight >= window:
+                    yield _unwrap_indexed(done.get())
+                    in_flight -= 1
+            while in_flight:
+                yield _unwrap_indexed(done.get())
+                in_flight -= 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _init_worker(options):
+    """
+    Remember the QRCode options of a pool worker and warm the tables they
+    need.
+    """
+    global _worker_options
+    _worker_options = options
+    _warm_tables(options)
+
+
+def _warm_tables(options):
+    error_correction = options.get('error_correction',
+                                   constants.ERROR_CORRECT_M)
+    version = options.get('version')
+    for v in ([version] if version else range(1, 41)):
+        for block in base.rs_blocks(v, error_correction):
+            rs._product_rows(block.total_count - block.data_count)
+    if version:
+        template.get(version)
+
+
+def _render(data, options):
+    """
+    Make and save the image for ``data``, returning ``(True, image)`` or
+    ``(False, exception)`` if that failed.
+    """
+    try:
+        stream = StringIO()
+        make(data, **options).save(stream)
+        return True, stream.getvalue()
+    except Exception as e:
+        return False, e
+
+
+def _render_in_worker(data):
+    return _render(data, _worker_options)
+
+
+def _render_indexed(index, data):
+    return index, _render(data, _worker_options)
+
+
+def _unwrap(result):
+    ok, value = result
+    if not ok:
+        raise value
+    return value
+
+
+def _unwrap_indexed(result):
+    index, result = result
+    return index, _unwrap(result)
+
+
+# Image factories the command line can pick from.
+FACTORIES = {
+    'png': 'qrcode.image.png.PngImage',
+    'pil': 'qrcode.image.pil.PilImage',
+    'svg': 'qrcode.image.svg.SvgPathImage',
+}
+
+
+def _import_factory(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(__import__(module, fromlist=[name]), name)
+
+
+def main(args=None, stdin=None):
+    """
+    Command line entry point: make a numbered image file for each line read
+    from standard input.
+    """
+    import optparse
+
+    parser = optparse.OptionParser(
+        usage="%prog [options] < payloads.txt")
+    parser.add_option('-o', '--output', default='qrcode-%05d',
+                      help="file name pattern, numbered from 1 "
+                           "[default: %default]")
+    parser.add_option('-f', '--factory', default='png',
+                      choices=sorted(FACTORIES),
+                      help="image factory: %s [default: %%default]"
+                           % ', '.join(sorted(FACTORIES)))
+    parser.add_option('-j', '--processes', type='int',
+                      help="worker processes [default: CPU count]")
+    parser.add_option('-e', '--error-correction', default='M',
+                      choices=['L', 'M', 'Q', 'H'],
+                      help="error correction level [default: %default]")
+    parser.add_option('-b', '--box-size', type='int', default=10)
+    parser.add_option('--border', type='int', default=4)
+    options, args = parser.parse_args(args)
+    if args:
+        parser.error("unexpected arguments")
+
+    image_factory = _import_factory(FACTORIES[options.factory])
+    extension = '.svg' if options.factory == 'svg' else '.png'
+    if stdin is None:
+        stdin = sys.stdin
+
+    payloads = (line.rstrip('\r\n') for line in stdin)
+    images = make_many(
+        payloads, processes=options.processes, ordered=False,
+        image_factory=image_factory, box_size=options.box_size,
+        border=options.border,
+        error_correction=getattr(constants,
+                                 'ERROR_CORRECT_' + options.error_correction))
+    for index, image in images:
+        with open(options.output % (index + 1) + extension, 'wb') as f:
+            f.write(image)
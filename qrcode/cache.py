@@ -0,0 +1,324 @@
+"""
+A cache of rendered QR Code images.
+
+Images are stored as the bytes their factory saves and are keyed by a hash
+of everything the output depends on: the data, the ``QRCode`` options, the
+image factory and the format. Entries live in memory, evicted least
+recently used first once they take more than a byte budget, and optionally
+in a directory shared by several processes.
+
+Images of secret-bearing data (such as TOTP provisioning URIs) should be
+put under a tag naming their owner, so ``clear_tag`` can wipe them when the
+secret changes: the cached bytes are zeroed in memory and files are
+overwritten before being removed. Each tag's directory holds a random
+generation, which clearing the tag discards, so the memory of every other
+process sharing the directory drops the tag's images the next time it is
+asked for one.
+"""
+import binascii
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from StringIO import StringIO
+
+from qrcode import constants
+from qrcode.main import make
+
+# The default memory budget, in bytes.
+MAX_BYTES = 4 * 1024 * 1024
+
+# The QRCode options an image depends on, with their defaults.
+_KEY_OPTIONS = (
+    ('version', None),
+    ('error_correction', constants.ERROR_CORRECT_M),
+    ('box_size', 10),
+    ('border', 4),
+)
+
+
+def cache_key(data, kind=None, image_factory=None, **options):
+    """
+    Return the cache key (a hex digest) of the image ``qrcode.make`` makes
+    for ``data`` and ``options``, saved in format ``kind``.
+    """
+    unknown = set(options) - set(name for name, default in _KEY_OPTIONS)
+    if unknown:
+        raise TypeError("Unexpected options: %s" % ', '.join(sorted(unknown)))
+
+    if image_factory is None:
+        factory = 'qrcode.image.pil.PilImage'
+    else:
+        factory = '%s.%s' % (image_factory.__module__, image_factory.__name__)
+    parts = [str(options.get(name, default))
+             for name, default in _KEY_OPTIONS]
+    parts += [factory, str(kind), _to_bytes(data)]
+    return hashlib.sha256('\0'.join(parts)).hexdigest()
+
+
+class ImageCache(object):
+    """
+    A thread-safe LRU cache of image bytes, with an optional disk tier.
+
+    :param max_bytes: The most image bytes kept in memory.
+    :param directory: If given, images are also written to (and looked up
+        in) this directory, which processes can share. Files are written
+        atomically, so a reader never sees a partial image.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        # The generation of each tag's directory its images were read or
+        # written under.
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Return the counters and current usage as a dict.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self._entries),
+                    'bytes': self.size}
+
+    def get(self, key, tag=None):
+        """
+        Return the image stored under ``key`` and ``tag``, or None.
+        """
+        generation = self._generation(tag)
+        with self._lock:
+            self._check_generation(tag, generation)
+            image = self._entries.pop((tag, key), None)
+            if image is not None:
+                self._entries[(tag, key)] = image
+                self.hits += 1
+                return bytes(image)
+
+        image = self._read(key, tag)
+        with self._lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, tag, image, generation)
+        return image
+
+    def put(self, key, image, tag=None):
+        """
+        Store ``image`` (a byte string) under ``key`` and ``tag``.
+        """
+        generation = self._write(key, tag, image)
+        with self._lock:
+            self._check_generation(tag, generation)
+            self._store(key, tag, image, generation)
+
+    def get_or_make(self, data, tag=None, kind=None, stats=None, **options):
+        """
+        Return the saved image ``qrcode.make(data, **options)`` makes,
+        making and storing it if it isn't cached (recording the stages in
+        ``stats``, see ``qrcode.stats``).
+        """
+        key = cache_key(data, kind=kind, **options)
+        image = self.get(key, tag)
+        if image is None:
+            stream = StringIO()
+            make(data, stats=stats, **options).save(stream, kind)
+            image = stream.getvalue()
+            self.put(key, image, tag)
+        return image
+
+    def clear_tag(self, tag):
+        """
+        Wipe every image stored under ``tag``, from memory and disk.
+        """
+        with self._lock:
+            self._forget(tag)
+
+        directory = self._tag_directory(tag)
+        if directory is None:
+            return
+        # Moving the directory away discards its generation at once, even
+        # if another process is writing to it, and the files are wiped at
+        # leisure.
+        cleared = '%s.cleared-%s' % (directory,
+                                     binascii.hexlify(os.urandom(8)))
+        try:
+            os.rename(directory, cleared)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        for name in os.listdir(cleared):
+            _wipe_file(os.path.join(cleared, name))
+        os.rmdir(cleared)
+
+    def clear(self):
+        """
+        Wipe every image held in memory (the disk tier is left alone).
+        """
+        with self._lock:
+            for entry in list(self._entries):
+                self._discard(entry)
+            self._tags.clear()
+            self._generations.clear()
+
+    def _forget(self, tag):
+        for key in self._tags.pop(tag, ()):
+            self._discard((tag, key))
+        self._generations.pop(tag, None)
+
+    def _check_generation(self, tag, generation):
+        # Another process cleared the tag since its images were stored.
+        if (generation is not None and
+                self._generations.get(tag, generation) != generation):
+            self._forget(tag)
+
+    def _store(self, key, tag, image, generation=None):
+        if len(image) > self.max_bytes:
+            return
+        entry = (tag, key)
+        self._discard(entry)
+        self._entries[entry] = bytearray(image)
+        self._tags.setdefault(tag, set()).add(key)
+        if generation is not None:
+            self._generations[tag] = generation
+        self.size += len(image)
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            keys = self._tags.get(oldest[0])
+            keys.discard(oldest[1])
+            if not keys:
+                del self._tags[oldest[0]]
+                self._generations.pop(oldest[0], None)
+            self.evictions += 1
+
+    def _discard(self, entry):
+        image = self._entries.pop(entry, None)
+        if image is not None:
+            self.size -= len(image)
+            image[:] = bytearray(len(image))
+
+    def _tag_directory(self, tag):
+        if self.directory is None:
+            return None
+        # Tags are hashed so file names don't reveal who an image is for.
+        if tag is None:
+            name = '_'
+        else:
+            name = hashlib.sha256(_to_bytes(tag)).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _generation(self, tag):
+        """
+        Return the generation of the tag's directory ('' if there is none),
+        or None without a disk tier.
+        """
+        directory = self._tag_directory(tag)
+        if directory is None:
+            return None
+        try:
+            with open(os.path.join(directory, '.generation'), 'rb') as f:
+                return f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return ''
+
+    def _read(self, key, tag):
+        directory = self._tag_directory(tag)
+        if directory is None:
+            return None
+        try:
+            with open(os.path.join(directory, key), 'rb') as f:
+                return f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def _write(self, key, tag, image):
+        directory = self._tag_directory(tag)
+        if directory is None:
+            return
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        generation = os.path.join(directory, '.generation')
+        try:
+            if not os.path.exists(generation):
+                # Linking fails if another process gave the new directory
+                # its generation first.
+                path = _write_temporary(directory, binascii.hexlify(
+                    os.urandom(16)))
+                try:
+                    os.link(path, generation)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                finally:
+                    os.unlink(path)
+
+            path = _write_temporary(directory, image)
+            try:
+                os.rename(path, os.path.join(directory, key))
+            except:
+                _wipe_file(path)
+                raise
+        except OSError as e:
+            # The tag was cleared meanwhile, so the image isn't kept.
+            if e.errno != errno.ENOENT:
+                raise
+            return ''
+        return self._generation(tag)
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _write_temporary(directory, data):
+    """
+    Write data to a new temporary file in ``directory``, returning its path.
+    """
+    # mkstemp creates the file readable by its owner only.
+    fd, path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+    except:
+        _wipe_file(path)
+        raise
+    return path
+
+
+def _wipe_file(path):
+    """
+    Overwrite a file with zeros, then remove it.
+    """
+    try:
+        with open(path, 'r+b') as f:
+            f.write(b'\0' * os.fstat(f.fileno()).st_size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.unlink(path)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
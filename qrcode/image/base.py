@@ -8,5 +8,18 @@ class BaseImage(object):
     def drawrect(self, row, col):
         raise NotImplementedError("BaseImage.drawrect")
 
+    def drawrows(self, rows):
+        """
+        Draw a whole symbol from its rows of modules (``bytearray`` rows
+        of 0/1 bytes where 1 is dark, see ``ModuleMatrix.rows``).
+
+        This calls ``drawrect`` for each dark module; image factories can
+        override it to render the symbol in one go.
+        """
+        for r, row in enumerate(rows):
+            for c, dark in enumerate(row):
+                if dark:
+                    self.drawrect(r, c)
+
     def save(self, stream, kind=None):
         raise NotImplementedError("BaseImage.save")
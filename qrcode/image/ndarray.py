@@ -0,0 +1,61 @@
+# This module isn't named numpy.py, which would shadow NumPy itself through
+# an implicit relative import.
+import numpy
+
+import qrcode.image.base
+
+
+class NdarrayImage(qrcode.image.base.BaseImage):
+    """NumPy array image builder.
+
+    ``modules`` is the symbol as a ``bool`` array (``True`` is dark) and
+    ``array`` the raster, border included, as a ``uint8`` array of 0 (black)
+    and 255 (white) pixels, one row per scanline. The image also exposes the
+    raster through ``__array_interface__``, so ``numpy.asarray(image)``
+    wraps it without copying, and ``memoryview(image.array)`` gives buffer
+    protocol access. Saving writes the raster in NumPy's ``.npy`` format.
+
+    NumPy is only imported when this module is."""
+
+    def __init__(self, border, width, box_size):
+        super(NdarrayImage, self).__init__(border, width, box_size)
+        self.kind = "NPY"
+        self.modules = numpy.zeros((width, width), dtype=bool)
+        self._array = None
+
+    def drawrect(self, row, col):
+        self.modules[row, col] = True
+        self._array = None
+
+    def drawrows(self, rows):
+        dark = numpy.frombuffer(b''.join(bytes(row) for row in rows),
+                                dtype=numpy.uint8)
+        self.modules = dark.reshape(self.width, self.width).astype(bool)
+        self._array = None
+
+    @property
+    def array(self):
+        if self._array is None:
+            # Light modules are 255, then every module becomes a box_size
+            # square and the border is added around them.
+            pixels = numpy.where(self.modules, numpy.uint8(0),
+                                 numpy.uint8(255))
+            box_size = self.box_size
+            if box_size != 1:
+                pixels = pixels.repeat(box_size, axis=0).repeat(box_size,
+                                                               axis=1)
+            margin = self.border * box_size
+            if margin:
+                pixels = numpy.pad(pixels, margin, 'constant',
+                                   constant_values=255)
+            self._array = pixels
+        return self._array
+
+    @property
+    def __array_interface__(self):
+        return self.array.__array_interface__
+
+    def save(self, stream, kind=None):
+        if kind is not None and kind != self.kind:
+            raise ValueError("Cannot set NumPy image type to " + kind)
+        numpy.save(stream, self.array)
@@ -4,8 +4,20 @@ try:
 except ImportError:
     import Image, ImageDraw
 
+import binascii
+
 import qrcode.image.base
 
+# PIL 1.1.7 only has the older name.
+frombytes = getattr(Image, 'frombytes', None) or Image.fromstring
+
+# Translation table from 0/1 module bytes to the bits of a mode "1" image,
+# where a set bit is white.
+_PIXEL_BITS = bytearray(range(256))
+_PIXEL_BITS[0] = ord('1')
+_PIXEL_BITS[1] = ord('0')
+_PIXEL_BITS = bytes(_PIXEL_BITS)
+
 
 class PilImage(qrcode.image.base.BaseImage):
     """PIL image builder, default format is PNG."""
@@ -28,6 +40,26 @@ class PilImage(qrcode.image.base.BaseImage):
                 y + self.box_size - 1)]
         self._idr.rectangle(box, fill="black")
 
+    def drawrows(self, rows):
+        """
+        Render the symbol as a bitmap with one pixel per module, then scale
+        it up by ``box_size`` and paste it inside the border.
+        """
+        width = self.width
+        stride = (width + 7) // 8
+        padding = b'1' * (stride * 8 - width)
+        bits = b''.join(bytes(row.translate(_PIXEL_BITS)) + padding
+                        for row in rows)
+        packed = binascii.unhexlify('%0*x' % (2 * stride * width,
+                                             int(bits, 2)))
+        symbol = frombytes("1", (width, width), packed)
+
+        size = width * self.box_size
+        if size != width:
+            symbol = symbol.resize((size, size), Image.NEAREST)
+        offset = self.border * self.box_size
+        self._img.paste(symbol, (offset, offset))
+
     def show(self):
         self._img.show()
 
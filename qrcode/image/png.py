@@ -0,0 +1,103 @@
+import binascii
+import struct
+import zlib
+
+import qrcode.image.base
+
+# Translation table from 0/1 module bytes to pixel bits (a set bit is white).
+_PIXEL_BITS = bytearray(range(256))
+_PIXEL_BITS[0] = ord('1')
+_PIXEL_BITS[1] = ord('0')
+_PIXEL_BITS = bytes(_PIXEL_BITS)
+
+
+class PngImage(qrcode.image.base.BaseImage):
+    """Dependency-free black and white PNG image builder.
+
+    Only needs the standard library (``zlib`` for compression). The
+    scanlines are generated and compressed one at a time while saving, so
+    memory use stays proportional to a single scanline rather than to the
+    whole bitmap."""
+
+    # Compressed data is written out in IDAT chunks of about this size.
+    chunk_size = 8192
+
+    def __init__(self, border, width, box_size):
+        super(PngImage, self).__init__(border, width, box_size)
+        self.kind = "PNG"
+        self._rows = None
+
+    def drawrect(self, row, col):
+        if self._rows is None:
+            self._rows = [bytearray(self.width) for i in range(self.width)]
+        self._rows[row][col] = 1
+
+    def drawrows(self, rows):
+        self._rows = rows
+
+    def save(self, stream, kind=None):
+        if kind is not None and kind != self.kind:
+            raise ValueError("Cannot set PNG image type to " + kind)
+
+        size = (self.width + self.border * 2) * self.box_size
+        stream.write(b'\x89PNG\r\n\x1a\n')
+        # 1 bit greyscale, no interlacing.
+        self._write_chunk(stream, b'IHDR',
+                          struct.pack('>IIBBBBB', size, size, 1, 0, 0, 0, 0))
+
+        compressor = zlib.compressobj()
+        pending = []
+        pending_size = 0
+        for line in self._scanlines():
+            data = compressor.compress(line)
+            if data:
+                pending.append(data)
+                pending_size += len(data)
+                if pending_size >= self.chunk_size:
+                    self._write_chunk(stream, b'IDAT', b''.join(pending))
+                    pending = []
+                    pending_size = 0
+        pending.append(compressor.flush())
+        self._write_chunk(stream, b'IDAT', b''.join(pending))
+        self._write_chunk(stream, b'IEND', b'')
+
+    def _scanlines(self):
+        """
+        Yield every scanline of the image, each prefixed with its filter
+        type byte (0, no filtering).
+        """
+        box_size = self.box_size
+        size = (self.width + self.border * 2) * box_size
+        stride = (size + 7) // 8
+        margin = b'1' * (self.border * box_size)
+        padding = b'1' * (stride * 8 - size)
+
+        blank = b'\x00' + b'\xff' * stride
+        for i in range(self.border * box_size):
+            yield blank
+
+        rows = self._rows or [bytearray(self.width)] * self.width
+        for row in rows:
+            bits = b''.join(bit * box_size
+                            for bit in bytes(row.translate(_PIXEL_BITS)))
+            bits = margin + bits + margin + padding
+            line = b'\x00' + _pack_bits(bits, stride)
+            for i in range(box_size):
+                yield line
+
+        for i in range(self.border * box_size):
+            yield blank
+
+    def _write_chunk(self, stream, kind, data):
+        stream.write(struct.pack('>I', len(data)))
+        stream.write(kind)
+        stream.write(data)
+        crc = zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff
+        stream.write(struct.pack('>I', crc))
+
+
+def _pack_bits(bits, length):
+    """
+    Pack an ASCII binary string into ``length`` bytes.
+    """
+    return binascii.unhexlify('%0*x' % (2 * length, int(bits, 2)))
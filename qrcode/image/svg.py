@@ -1,5 +1,22 @@
-import xml.etree.ElementTree as ET
+import re
 import qrcode.image.base
+from qrcode.matrix import _BINARY
+
+_DARK_RUN = re.compile('1+')
+
+# ElementTree, imported by the first image which builds a tree (the path
+# based images write their document directly).
+ET = None
+
+
+def _load_element_tree():
+    global ET
+    if ET is None:
+        import xml.etree.ElementTree
+        xml.etree.ElementTree.register_namespace(
+            "svg", SvgFragmentImage._SVG_namespace)
+        ET = xml.etree.ElementTree
+    return ET
 
 
 class SvgFragmentImage(qrcode.image.base.BaseImage):
@@ -14,7 +31,8 @@ class SvgFragmentImage(qrcode.image.base.BaseImage):
     def __init__(self, border, width, box_size):
         super(SvgFragmentImage, self).__init__(border, width, box_size)
         self.kind = "SVG"
-        ET.register_namespace("svg", self._SVG_namespace)
+        _load_element_tree()
+        self._rect_tag = ET.QName(self._SVG_namespace, "rect")
         self._img = self._svg()
 
     def drawrect(self, row, col):
@@ -25,13 +43,15 @@ class SvgFragmentImage(qrcode.image.base.BaseImage):
             raise ValueError("Cannot set SVG image type to " + kind)
         self._write(stream)
 
-    def _svg(self, tag = ET.QName(_SVG_namespace, "svg")):
+    def _svg(self, tag=None):
+        if tag is None:
+            tag = ET.QName(self._SVG_namespace, "svg")
         dimension = "%dmm" % (2 * self.border + self.width)
         return ET.Element(tag, version="1.1",
                           width=dimension, height=dimension)
 
-    def _rect(self, row, col, tag=ET.QName(_SVG_namespace, "rect")):
-        return ET.Element(tag,
+    def _rect(self, row, col, tag=None):
+        return ET.Element(tag or self._rect_tag,
                           x="%dmm" % (self.border + col),
                           y="%dmm" % (self.border + row),
                           width="1mm", height="1mm")
@@ -59,3 +79,74 @@ class SvgImage(SvgFragmentImage):
     def _write(self, stream):
         ET.ElementTree(self._img).write(stream, encoding="UTF-8",
                                         xml_declaration=True)
+
+
+class SvgPathFragmentImage(qrcode.image.base.BaseImage):
+    """SVG path image builder
+
+    Creates a QR-code image as a SVG document fragment holding a single
+    path, with each horizontal run of dark modules merged into one
+    rectangle. The document is written out directly as text rather than
+    built with ElementTree.
+    Ignores the {box_size} parameter, making the QR-code boxes
+    1mm square."""
+
+    _SVG_namespace = "http://www.w3.org/2000/svg"
+    _prefix = "svg:"
+
+    def __init__(self, border, width, box_size):
+        super(SvgPathFragmentImage, self).__init__(border, width, box_size)
+        self.kind = "SVG"
+        self._subpaths = []
+
+    def drawrect(self, row, col):
+        self._subpaths.append(self._subpath(row, col, 1))
+
+    def drawrows(self, rows):
+        subpaths = self._subpaths
+        for r, row in enumerate(rows):
+            for run in _DARK_RUN.finditer(bytes(row.translate(_BINARY))):
+                subpaths.append(
+                    self._subpath(r, run.start(), run.end() - run.start()))
+
+    def save(self, stream, kind=None):
+        if kind is not None and kind != self.kind:
+            raise ValueError("Cannot set SVG image type to " + kind)
+        self._write(stream)
+
+    def _subpath(self, row, col, length):
+        return "M%d %dh%dv1h-%dz" % (self.border + col, self.border + row,
+                                     length, length)
+
+    def _svg_attributes(self):
+        dimension = 2 * self.border + self.width
+        return ('version="1.1" width="%dmm" height="%dmm" '
+                'viewBox="0 0 %d %d"' % (dimension, dimension,
+                                         dimension, dimension))
+
+    def _write(self, stream):
+        stream.write('<svg:svg xmlns:svg="%s" %s>' % (
+            self._SVG_namespace, self._svg_attributes()))
+        self._write_path(stream)
+        stream.write('</svg:svg>')
+
+    def _write_path(self, stream):
+        stream.write('<%spath d="' % self._prefix)
+        stream.write(''.join(self._subpaths))
+        stream.write('" />')
+
+
+class SvgPathImage(SvgPathFragmentImage):
+    """Standalone SVG path image builder
+
+    Creates a QR-code image as a standalone SVG document holding a single
+    path."""
+
+    _prefix = ""
+
+    def _write(self, stream):
+        stream.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        stream.write('<svg xmlns="%s" %s>' % (
+            self._SVG_namespace, self._svg_attributes()))
+        self._write_path(stream)
+        stream.write('</svg>')
@@ -1,5 +1,14 @@
-from qrcode import constants, exceptions, util
+import bisect
+import functools
+import re
+
+from qrcode import constants, exceptions, template, util
 from qrcode.image.base import BaseImage
+from qrcode.matrix import _BINARY
+from qrcode.stats import measure, timed
+
+# A run of dark (group 1) or light modules in a row made binary by _BINARY.
+_RUN = re.compile('(1+)|0+')
 
 def make(data=None, **kwargs):
     qr = QRCode(**kwargs)
@@ -12,7 +21,7 @@ class QRCode:
     def __init__(self, version=None,
                  error_correction=constants.ERROR_CORRECT_M,
                  box_size=10, border=4,
-                 image_factory=None):
+                 image_factory=None, stats=None):
         self.version = version and int(version)
         self.error_correction = int(error_correction)
         self.box_size = int(box_size)
@@ -22,6 +31,8 @@ class QRCode:
         self.image_factory = image_factory
         if image_factory is not None:
             assert issubclass(image_factory, BaseImage)
+        # An optional qrcode.stats.Stats collector timing each stage.
+        self.stats = stats
         self.clear()
 
     def clear(self):
@@ -32,16 +43,46 @@ class QRCode:
         self.modules_count = 0
         self.data_cache = None
         self.data_list = []
+        # What was added, with data to segment optimally kept as a byte
+        # string until the version (and so the count field sizes) is known.
+        self._added = []
+        self._mask_candidate = None
 
-    def add_data(self, data):
+    def add_data(self, data, optimize=True):
         """
         Add data to this QR Code.
+
+        :param optimize: If ``True``, the data is split into the numeric,
+            alphanumeric and 8bit byte segments which encode it in the fewest
+            bits (see ``util.optimal_data_chunks``). Otherwise it is kept in a
+            single segment. Ignored for ``QRData`` instances.
         """
-        if not isinstance(data, util.QRData):
-            data = util.QRData(data)
-        self.data_list.append(data)
+        if isinstance(data, util.QRData):
+            self._added.append(data)
+        elif optimize:
+            self._added.append(util.to_bytestring(data))
+        else:
+            self._added.append(util.QRData(data))
+        self.data_list = self._segment(self.version or 1)
         self.data_cache = None
 
+    def _segment(self, version):
+        """
+        Return the data list, with the data added with ``optimize`` split
+        into the segments which are shortest at ``version``.
+        """
+        data_list = []
+        for data in self._added:
+            if isinstance(data, util.QRData):
+                data_list.append(data)
+            else:
+                data_list.extend(util.optimal_data_chunks(data, version))
+        return data_list
+
+    def _segmented(self):
+        # Whether some data has to be split again for another version.
+        return any(not isinstance(data, util.QRData) for data in self._added)
+
     def make(self, fit=True):
         """
         Compile the data into a QR Code array.
@@ -53,81 +94,109 @@ class QRCode:
             self.best_fit(start=self.version)
         self.makeImpl(False, self.best_mask_pattern())
 
+    @timed('makeImpl')
     def makeImpl(self, test, mask_pattern):
         self.modules_count = self.version * 4 + 17
-        self.modules = [None] * self.modules_count
 
-        for row in range(self.modules_count):
-
-            self.modules[row] = [None] * self.modules_count
-
-            for col in range(self.modules_count):
-                self.modules[row][col] = None   # (col + row) % 3
-
-        self.setup_position_probe_pattern(0, 0)
-        self.setup_position_probe_pattern(self.modules_count - 7, 0)
-        self.setup_position_probe_pattern(0, self.modules_count - 7)
-        self.sutup_position_adjust_pattern()
-        self.setup_timing_pattern()
-        self.setup_type_info(test, mask_pattern)
-
-        if self.version >= 7:
-            self.setup_type_number(test)
+        candidate = self._mask_candidate
+        self._mask_candidate = None
+        if (not test and candidate is not None
+                and candidate[0] == mask_pattern
+                and candidate[1] is self.data_cache
+                and candidate[2].size == self.modules_count):
+            # Reuse the symbol scored by best_mask_pattern, only the format
+            # and version information still has to be written.
+            self.modules = candidate[2]
+            self.setup_type_info(test, mask_pattern)
+            if self.version >= 7:
+                self.setup_type_number(test)
+            return
+
+        # The template already has the format and version information areas
+        # cleared, as wanted for a test layout.
+        self.modules = template.get(self.version).matrix()
+        if not test:
+            self.setup_type_info(test, mask_pattern)
+            if self.version >= 7:
+                self.setup_type_number(test)
 
         if self.data_cache is None:
-            self.data_cache = util.create_data(self.version,
-                self.error_correction, self.data_list)
+            if self._segmented():
+                self.data_list = self._segment(self.version)
+            self.data_cache = measure(self.stats, 'create_data',
+                util.create_data, self.version, self.error_correction,
+                self.data_list)
         self.map_data(self.data_cache, mask_pattern)
 
     def setup_position_probe_pattern(self, row, col):
-        for r in range(-1, 8):
-
-            if row + r <= -1 or self.modules_count <= row + r:
-                continue
-
-            for c in range(-1, 8):
-
-                if col + c <= -1 or self.modules_count <= col + c:
-                    continue
-
-                if (0 <= r and r <= 6 and (c == 0 or c == 6)
-                        or (0 <= c and c <= 6 and (r == 0 or r == 6))
-                        or (2 <= r and r <= 4 and 2 <= c and c <= 4)):
-                    self.modules[row + r][col + c] = True
-                else:
-                    self.modules[row + r][col + c] = False
+        template.setup_position_probe_pattern(self.modules, row, col)
 
+    @timed('best_fit')
     def best_fit(self, start=None):
         """
         Find the minimum size required to fit in the data.
+
+        The exact bit length of the data is worked out once per range of
+        versions sharing the same character count field sizes, and looked up
+        in the capacity table, so the data is only encoded for the chosen
+        version. Optimized data is split into segments for each range, as
+        the sizes of the count fields decide which splits pay off.
         """
-        size = start or 1
-        while True:
-            try:
-                self.data_cache = util.create_data(size,
-                    self.error_correction, self.data_list)
-            except exceptions.DataOverflowError:
-                size += 1
-            else:
-                self.version = size
-                return size
+        start = start or 1
+        limits = util.BIT_LIMIT_TABLE[self.error_correction]
+        segmented = self._segmented()
+        data_list = self.data_list
+        needed = 0
+        for low, high in util.VERSION_RANGES:
+            if high <= start:
+                continue
+            low = max(low, start)
+            if segmented:
+                data_list = self._segment(low)
+            needed = util.data_bit_length(data_list, low)
+            size = bisect.bisect_left(limits, needed, low, high)
+            if size < high:
+                break
+        else:
+            raise exceptions.DataOverflowError("Code length overflow. Data "
+                "size (%s) > size available (%s)" % (needed, limits[40]))
+
+        self.data_list = data_list
+        self.data_cache = measure(self.stats, 'create_data',
+            util.create_data, size, self.error_correction, self.data_list)
+        self.version = size
+        return size
 
     def best_mask_pattern(self):
         """
         Find the most efficient mask pattern.
+
+        The data is laid out once without a mask, and each candidate is made
+        by XORing that layout with the cached plane of a mask pattern. The
+        winning candidate is kept for the following ``makeImpl`` call.
         """
+        self.makeImpl(True, None)
+        layout = self.modules
+        data_cells = layout.data_cells()
+
         min_lost_point = 0
         pattern = 0
+        best = None
 
         for i in range(8):
-            self.makeImpl(True, i)
+            candidate = layout.masked(
+                util.mask_plane(i, self.modules_count), data_cells)
 
-            lost_point = util.lost_point(self.modules)
+            lost_point = measure(self.stats, 'lost_point',
+                                 util.lost_point, candidate)
 
             if i == 0 or min_lost_point > lost_point:
                 min_lost_point = lost_point
                 pattern = i
+                best = candidate
 
+        self.modules = best
+        self._mask_candidate = (pattern, self.data_cache, best)
         return pattern
 
     def print_tty(self, out=None):
@@ -146,19 +215,81 @@ class QRCode:
         if self.data_cache is None:
             self.make()
 
-        modcount = self.modules_count
-        out.write("\x1b[1;47m" + (" " * (modcount * 2 + 4)) + "\x1b[0m\n")
-        for r in range(modcount):
-            out.write("\x1b[1;47m  \x1b[40m")
-            for c in range(modcount):
-                if self.modules[r][c]:
-                    out.write("  ")
-                else:
-                    out.write("\x1b[1;47m  \x1b[40m")
-            out.write("\x1b[1;47m  \x1b[0m\n")
-        out.write("\x1b[1;47m" + (" " * (modcount * 2 + 4)) + "\x1b[0m\n")
+        # Each module is two spaces on a black (dark) or white (light)
+        # background; the colour only changes between runs of modules.
+        light = "\x1b[1;47m"
+        edge = light + (" " * (self.modules_count * 2 + 4)) + "\x1b[0m\n"
+        lines = [edge]
+        for row in self.modules.rows():
+            line = [light, "  "]
+            for run in _RUN.finditer(bytes(row.translate(_BINARY))):
+                line.append("\x1b[40m" if run.group(1) else light)
+                line.append("  " * (run.end() - run.start()))
+            line.append(light + "  \x1b[0m\n")
+            lines.append("".join(line))
+        lines.append(edge)
+        out.write("".join(lines))
         out.flush()
 
+    def print_ascii(self, out=None, tty=False, invert=False,
+                    ascii_only=False):
+        """
+        Output the QR Code as text, including the border, to any stream.
+
+        Two rows of modules are packed into each line of Unicode half block
+        characters, dark modules being drawn with the blocks. The whole text
+        is built first and written at once.
+
+        :param tty: Draw light modules white on a black background with
+            ANSI colour codes, so the code scans on a dark terminal. Implies
+            ``invert``.
+        :param invert: Draw the light modules with the blocks instead.
+        :param ascii_only: Use ``#`` characters (two per module, one line
+            per row) rather than half blocks.
+
+        If the data has not been compiled yet, make it first.
+        """
+        if out is None:
+            import sys
+            out = sys.stdout
+
+        if self.data_cache is None:
+            self.make()
+
+        if tty:
+            invert = True
+        size = self.modules_count + 2 * self.border
+        blank = bytearray(size)
+        margin = bytearray(self.border)
+        rows = [blank] * self.border
+        rows.extend(margin + row + margin for row in self.modules.rows())
+        rows.extend([blank] * self.border)
+
+        if ascii_only:
+            glyphs = ("  ", "##")
+            if invert:
+                glyphs = glyphs[::-1]
+            lines = ["".join(glyphs[dark] for dark in row) for row in rows]
+        else:
+            # Indexed by top module + 2 * bottom module.
+            glyphs = (u" ", u"\u2580", u"\u2584", u"\u2588")
+            if invert:
+                glyphs = glyphs[::-1]
+            if len(rows) % 2:
+                rows.append(blank)
+            lines = [u"".join(glyphs[top + 2 * bottom]
+                              for top, bottom in zip(rows[i], rows[i + 1]))
+                     for i in range(0, len(rows), 2)]
+
+        if tty:
+            lines = [u"\x1b[40;97m" + line + u"\x1b[0m" for line in lines]
+        text = u"\n".join(lines) + u"\n"
+        if not getattr(out, 'encoding', None):
+            text = text.encode('utf-8')
+        out.write(text)
+        out.flush()
+
+    @timed('make_image')
     def make_image(self, image_factory=None):
         """
         Make an image from the QR Code data.
@@ -178,97 +309,39 @@ class QRCode:
                 image_factory = PilImage
 
         im = image_factory(self.border, self.modules_count, self.box_size)
-        for r in range(self.modules_count):
-            for c in range(self.modules_count):
-                if self.modules[r][c]:
-                    im.drawrect(r, c)
+        im.drawrows(self.modules.rows())
+        if self.stats is not None:
+            im.save = functools.partial(measure, self.stats, 'save', im.save)
         return im
 
     def setup_timing_pattern(self):
-        for r in range(8, self.modules_count - 8):
-            if self.modules[r][6] != None:
-                continue
-            self.modules[r][6] = (r % 2 == 0)
-
-        for c in range(8, self.modules_count - 8):
-            if self.modules[6][c] != None:
-                continue
-            self.modules[6][c] = (c % 2 == 0)
+        template.setup_timing_pattern(self.modules)
 
     def sutup_position_adjust_pattern(self):
-        pos = util.pattern_position(self.version)
-
-        for i in range(len(pos)):
-
-            for j in range(len(pos)):
-
-                row = pos[i]
-                col = pos[j]
-
-                if self.modules[row][col] != None:
-                    continue
-
-                for r in range(-2, 3):
-
-                    for c in range(-2, 3):
-
-                        if (r == -2 or r == 2 or c == -2 or c == 2 or
-                                (r == 0 and c == 0)):
-                            self.modules[row + r][col + c] = True
-                        else:
-                            self.modules[row + r][col + c] = False
+        template.setup_position_adjust_pattern(self.modules, self.version)
 
     def setup_type_number(self, test):
-        bits = util.BCH_type_number(self.version)
-
-        for i in range(18):
-            mod = (not test and ((bits >> i) & 1) == 1)
-            self.modules[i // 3][i % 3 + self.modules_count - 8 - 3] = mod
-
-        for i in range(18):
-            mod = (not test and ((bits >> i) & 1) == 1)
-            self.modules[i % 3 + self.modules_count - 8 - 3][i // 3] = mod
+        template.setup_type_number(self.modules,
+                                   None if test else self.version)
 
     def setup_type_info(self, test, mask_pattern):
-        data = (self.error_correction << 3) | mask_pattern
-        bits = util.BCH_type_info(data)
-
-        # vertical
-        for i in range(15):
-
-            mod = (not test and ((bits >> i) & 1) == 1)
-
-            if i < 6:
-                self.modules[i][8] = mod
-            elif i < 8:
-                self.modules[i + 1][8] = mod
-            else:
-                self.modules[self.modules_count - 15 + i][8] = mod
-
-        # horizontal
-        for i in range(15):
-
-            mod = (not test and ((bits >> i) & 1) == 1)
-
-            if i < 8:
-                self.modules[8][self.modules_count - i - 1] = mod
-            elif i < 9:
-                self.modules[8][15 - i - 1 + 1] = mod
-            else:
-                self.modules[8][15 - i - 1] = mod
-
-        # fixed module
-        self.modules[self.modules_count - 8][8] = (not test)
+        data = None
+        if not test:
+            data = (self.error_correction << 3) | mask_pattern
+        template.setup_type_info(self.modules, data)
 
     def map_data(self, data, mask_pattern):
+        modules_count = self.modules_count
+        dark = self.modules.dark
+        filled = self.modules.filled
+        data_len = len(data)
+
         inc = -1
-        row = self.modules_count - 1
+        row = modules_count - 1
         bitIndex = 7
         byteIndex = 0
 
-        mask_func = util.mask_func(mask_pattern)
-
-        for col in range(self.modules_count - 1, 0, -2):
+        for col in range(modules_count - 1, 0, -2):
 
             if col == 6:
                 col -= 1
@@ -277,17 +350,17 @@ class QRCode:
 
                 for c in range(2):
 
-                    if self.modules[row][col - c] == None:
+                    i = row * modules_count + col - c
 
-                        dark = False
+                    if not filled[i]:
 
-                        if byteIndex < len(data):
-                            dark = (((data[byteIndex] >> bitIndex) & 1) == 1)
+                        bit = 0
 
-                        if mask_func(row, col - c):
-                            dark = not dark
+                        if byteIndex < data_len:
+                            bit = (data[byteIndex] >> bitIndex) & 1
 
-                        self.modules[row][col - c] = dark
+                        dark[i] = bit
+                        filled[i] = 1
                         bitIndex -= 1
 
                         if bitIndex == -1:
@@ -296,7 +369,11 @@ class QRCode:
 
                 row += inc
 
-                if row < 0 or self.modules_count <= row:
+                if row < 0 or modules_count <= row:
                     row -= inc
                     inc = -inc
                     break
+
+        if mask_pattern is not None:
+            self.modules = self.modules.masked(
+                util.mask_plane(mask_pattern, modules_count))
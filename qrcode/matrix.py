@@ -0,0 +1,162 @@
+# Translation tables between 0/1 byte planes and ASCII binary strings.
+_BINARY = bytearray(range(256))
+_BINARY[0] = ord('0')
+_BINARY[1] = ord('1')
+_BINARY = bytes(_BINARY)
+
+_UNBINARY = bytearray(range(256))
+_UNBINARY[ord('0')] = 0
+_UNBINARY[ord('1')] = 1
+_UNBINARY = bytes(_UNBINARY)
+
+
+def pack(plane):
+    """
+    Pack a plane of 0/1 bytes into an integer, first cell most significant.
+    """
+    return int(bytes(plane.translate(_BINARY)), 2)
+
+
+def unpack(value, length):
+    """
+    Unpack an integer made by ``pack`` into a plane of ``length`` 0/1 bytes.
+    """
+    return bytearray(bin(value)[2:].zfill(length)).translate(_UNBINARY)
+
+
+class ModuleMatrix(object):
+    """
+    A square matrix of QR Code modules.
+
+    The modules are kept in flat ``bytearray`` planes of ``size * size``
+    cells (row-major): ``dark`` holds the colour of each module, ``reserved``
+    marks the function patterns (finder, alignment and timing patterns plus
+    the format and version information areas) and ``filled`` marks every
+    module which has been given a colour.
+
+    Modules which haven't been filled read back as ``None`` through the
+    ``matrix[row][col]`` accessor, which is kept so code written against the
+    old list of lists representation continues to work. Note that
+    ``map_data`` never reaches the data modules of the leftmost column, so
+    those stay unfilled in a finished symbol.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.dark = bytearray(size * size)
+        self.reserved = bytearray(size * size)
+        self.filled = bytearray(size * size)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.size
+        if not 0 <= row < self.size:
+            raise IndexError("row index out of range")
+        return _Row(self, row)
+
+    def __iter__(self):
+        for row in range(self.size):
+            yield _Row(self, row)
+
+    def get(self, row, col):
+        """
+        Return ``True`` or ``False`` for a filled module, otherwise ``None``.
+        """
+        i = row * self.size + col
+        if self.filled[i]:
+            return self.dark[i] == 1
+        return None
+
+    def set(self, row, col, dark):
+        """
+        Set a function pattern module (``None`` releases it again).
+        """
+        i = row * self.size + col
+        if dark is None:
+            self.reserved[i] = self.filled[i] = 0
+            self.dark[i] = 0
+        else:
+            self.reserved[i] = self.filled[i] = 1
+            self.dark[i] = 1 if dark else 0
+
+    def is_reserved(self, row, col):
+        return self.reserved[row * self.size + col] == 1
+
+    def rows(self):
+        """
+        Return the dark plane as a list of ``bytearray`` rows (1 is dark).
+        """
+        size = self.size
+        dark = self.dark
+        return [dark[i:i + size] for i in range(0, size * size, size)]
+
+    def tolist(self):
+        """
+        Return the matrix as a list of lists of ``True``/``False``/``None``.
+        """
+        return [list(row) for row in self]
+
+    def copy(self, dark=None):
+        """
+        Return a copy of the matrix, optionally with a different dark plane.
+        """
+        other = ModuleMatrix.__new__(ModuleMatrix)
+        other.size = self.size
+        other.dark = bytearray(self.dark) if dark is None else dark
+        other.reserved = bytearray(self.reserved)
+        other.filled = bytearray(self.filled)
+        return other
+
+    def data_cells(self):
+        """
+        Return the filled modules which aren't reserved, packed.
+        """
+        return pack(self.filled) ^ pack(self.reserved)
+
+    def masked(self, mask, data_cells=None):
+        """
+        Return a copy of the matrix with a packed mask plane (see
+        ``qrcode.util.mask_plane``) XORed into its data modules.
+        """
+        if data_cells is None:
+            data_cells = self.data_cells()
+        dark = pack(self.dark) ^ (mask & data_cells)
+        return self.copy(unpack(dark, len(self.dark)))
+
+
+class _Row(object):
+    """
+    A view of a single matrix row, for ``matrix[row][col]`` access.
+    """
+
+    __slots__ = ('_matrix', '_row')
+
+    def __init__(self, matrix, row):
+        self._matrix = matrix
+        self._row = row
+
+    def __len__(self):
+        return self._matrix.size
+
+    def _col(self, col):
+        if col < 0:
+            col += self._matrix.size
+        if not 0 <= col < self._matrix.size:
+            raise IndexError("column index out of range")
+        return col
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return [self._matrix.get(self._row, c)
+                    for c in range(*col.indices(self._matrix.size))]
+        return self._matrix.get(self._row, self._col(col))
+
+    def __setitem__(self, col, value):
+        self._matrix.set(self._row, self._col(col), value)
+
+    def __iter__(self):
+        for col in range(self._matrix.size):
+            yield self._matrix.get(self._row, col)
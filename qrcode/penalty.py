@@ -0,0 +1,194 @@
+"""
+Mask penalty scoring.
+
+Two engines compute the same score as the original module-by-module loops:
+one uses NumPy array comparisons (when NumPy is installed) and the other is
+a pure-Python fallback working on rows packed into integer bitboards.
+
+Each module is in one of three states: dark, light, or unset (a module that
+``map_data`` never reached). Unset modules count as light for the block,
+finder-like and balance rules, but as a colour of their own when counting
+same-coloured neighbours.
+"""
+from qrcode.matrix import ModuleMatrix, _BINARY
+
+# Translation table turning a 0/1 byte plane into the inverse binary string.
+_INVERSE_BINARY = bytearray(range(256))
+_INVERSE_BINARY[0] = ord('1')
+_INVERSE_BINARY[1] = ord('0')
+_INVERSE_BINARY = bytes(_INVERSE_BINARY)
+
+_numpy = None
+
+
+def lost_point(modules):
+    """
+    Return the penalty score of a symbol (lower is better).
+
+    ``modules`` may be a ``ModuleMatrix`` or a list of lists of
+    ``True``/``False``/``None``.
+    """
+    if not isinstance(modules, ModuleMatrix):
+        modules = _from_list(modules)
+    if _numpy_available():
+        return numpy_lost_point(modules)
+    return bitboard_lost_point(modules)
+
+
+def _numpy_available():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy is not False
+
+
+def _from_list(modules):
+    matrix = ModuleMatrix(len(modules))
+    for r, row in enumerate(modules):
+        for c, value in enumerate(row):
+            if value is not None:
+                matrix.set(r, c, value)
+    return matrix
+
+
+def _popcount(n):
+    return bin(n).count('1')
+
+
+def _row_ints(plane, size, table=_BINARY):
+    return [int(bytes(plane[i:i + size].translate(table)), 2)
+            for i in range(0, size * size, size)]
+
+
+def _col_ints(plane, size, table=_BINARY):
+    return [int(bytes(plane[i::size].translate(table)), 2)
+            for i in range(size)]
+
+
+def _finder_like(lines, size):
+    """
+    Count the 1:1:3:1:1 dark-light-dark-light-dark runs in packed lines.
+    """
+    valid = ((1 << size) - 1) ^ 0x3f
+    count = 0
+    for x in lines:
+        count += _popcount(x & ~(x << 1) & (x << 2) & (x << 3) & (x << 4) &
+                           ~(x << 5) & (x << 6) & valid)
+    return count
+
+
+def _balance(dark_count, size):
+    ratio = abs(100 * dark_count // size // size - 50) // 5
+    return ratio * 10
+
+
+def bitboard_lost_point(matrix):
+    """
+    Pure-Python penalty scoring on integer bitboards.
+
+    Each row is packed into an integer with column 0 as the most significant
+    bit, so ``x << k`` lines up every module with its neighbour ``k`` columns
+    to the right.
+    """
+    size = matrix.size
+    full = (1 << size) - 1
+    dark = _row_ints(matrix.dark, size)
+    unset = _row_ints(matrix.filled, size, _INVERSE_BINARY)
+
+    lost_point = 0
+
+    # LEVEL1: modules with more than five same-coloured neighbours. The
+    # neighbour matches are summed per column in a four bit-plane counter.
+    not_right = full & ~1
+    not_left = full >> 1
+    for row in range(size):
+        d = dark[row]
+        u = unset[row]
+        b0 = b1 = b2 = b3 = 0
+        for r in (row - 1, row, row + 1):
+            if r < 0 or r >= size:
+                continue
+            nd = dark[r]
+            nu = unset[r]
+            neighbours = [((nd << 1) & full, (nu << 1) & full, not_right),
+                          (nd >> 1, nu >> 1, not_left)]
+            if r != row:
+                neighbours.append((nd, nu, full))
+            for shifted_d, shifted_u, valid in neighbours:
+                carry = ~((d ^ shifted_d) | (u ^ shifted_u)) & valid
+                b0, carry = b0 ^ carry, b0 & carry
+                b1, carry = b1 ^ carry, b1 & carry
+                b2, carry = b2 ^ carry, b2 & carry
+                b3 |= carry
+        six_or_seven = ~b3 & b2 & b1
+        lost_point += (4 * _popcount(six_or_seven & ~b0) +
+                       5 * _popcount(six_or_seven & b0) +
+                       6 * _popcount(b3))
+
+    # LEVEL2: 2x2 blocks of the same colour.
+    for row in range(size - 1):
+        a = dark[row]
+        b = dark[row + 1]
+        na = full ^ a
+        nb = full ^ b
+        same = ((a & (a << 1) & b & (b << 1)) |
+                (na & (na << 1) & nb & (nb << 1)))
+        lost_point += 3 * _popcount(same & not_right)
+
+    # LEVEL3: finder-like patterns in rows and columns.
+    lost_point += 40 * _finder_like(dark, size)
+    lost_point += 40 * _finder_like(_col_ints(matrix.dark, size), size)
+
+    # LEVEL4: dark/light balance.
+    lost_point += _balance(matrix.dark.count(b'\x01'), size)
+
+    return lost_point
+
+
+def numpy_lost_point(matrix):
+    """
+    Penalty scoring using NumPy array comparisons.
+    """
+    _numpy_available()
+    np = _numpy
+    size = matrix.size
+    dark = np.frombuffer(matrix.dark, dtype=np.uint8).reshape(size, size)
+    filled = np.frombuffer(matrix.filled, dtype=np.uint8).reshape(size, size)
+
+    lost_point = 0
+
+    # LEVEL1: state 0 is light, 1 is dark and 2 unset; the padding (3) never
+    # matches a module.
+    state = np.full((size + 2, size + 2), 3, dtype=np.uint8)
+    state[1:-1, 1:-1] = dark + 2 * (1 - filled)
+    centre = state[1:-1, 1:-1]
+    same = np.zeros((size, size), dtype=np.uint8)
+    for r in (0, 1, 2):
+        for c in (0, 1, 2):
+            if r == 1 and c == 1:
+                continue
+            same += state[r:r + size, c:c + size] == centre
+    over = same[same > 5]
+    lost_point += int(over.sum(dtype=np.int64)) - 2 * over.size
+
+    # LEVEL2: 2x2 blocks of the same colour.
+    blocks = dark[:-1, :-1] + dark[1:, :-1] + dark[:-1, 1:] + dark[1:, 1:]
+    lost_point += 3 * int(np.count_nonzero((blocks == 0) | (blocks == 4)))
+
+    # LEVEL3: finder-like patterns in rows and columns.
+    lit = dark.astype(bool)
+    for grid in (lit, lit.T):
+        n = size - 6
+        run = (grid[:, 0:n] & ~grid[:, 1:n + 1] & grid[:, 2:n + 2] &
+               grid[:, 3:n + 3] & grid[:, 4:n + 4] & ~grid[:, 5:n + 5] &
+               grid[:, 6:n + 6])
+        lost_point += 40 * int(np.count_nonzero(run))
+
+    # LEVEL4: dark/light balance.
+    lost_point += _balance(int(np.count_nonzero(dark)), size)
+
+    return lost_point
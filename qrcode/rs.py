@@ -0,0 +1,89 @@
+"""
+Table-driven Reed-Solomon encoding over GF(256).
+
+The remainder of the data polynomial by the generator polynomial is
+computed with a shift register held in a single integer: for each data byte
+the register is shifted left by one byte and XORed with a precomputed row of
+``factor * generator``. Generators and their product rows are cached per
+number of error correction codewords.
+"""
+import binascii
+
+from qrcode import base
+
+# Antilogarithms, doubled so the sum of two logarithms indexes it directly.
+EXP = bytearray(base.EXP_TABLE[:255] * 2)
+
+# Logarithms (LOG[0] is undefined and left as 0).
+LOG = bytearray(base.LOG_TABLE)
+
+_generators = {}
+_products = {}
+
+
+def generator(ec_count):
+    """
+    Return the coefficients of the generator polynomial for ``ec_count``
+    error correction codewords, highest power first (the leading 1
+    included).
+    """
+    poly = _generators.get(ec_count)
+    if poly is None:
+        poly = bytearray([1])
+        for i in range(ec_count):
+            # Multiply by (x + a^i).
+            product = poly + bytearray(1)
+            for j, coefficient in enumerate(poly):
+                if coefficient:
+                    product[j + 1] ^= EXP[LOG[coefficient] + i]
+            poly = product
+        _generators[ec_count] = poly
+    return poly
+
+
+def _product_rows(ec_count):
+    """
+    Return, for every byte ``factor``, ``factor`` times the generator
+    (without its leading 1) packed into an integer.
+    """
+    rows = _products.get(ec_count)
+    if rows is None:
+        logs = [LOG[c] if c else None for c in generator(ec_count)[1:]]
+        rows = [0] * 256
+        for factor in range(1, 256):
+            log = LOG[factor]
+            row = bytearray(0 if g is None else EXP[log + g] for g in logs)
+            rows[factor] = int(binascii.hexlify(row), 16)
+        _products[ec_count] = rows
+    return rows
+
+
+def encode(data, ec_count):
+    """
+    Return the ``ec_count`` error correction codewords for ``data`` as a
+    ``bytearray``.
+    """
+    rows = _product_rows(ec_count)
+    shift = 8 * (ec_count - 1)
+    mask = (1 << (8 * ec_count)) - 1
+    register = 0
+    for byte in data:
+        factor = (register >> shift) ^ byte
+        register = ((register << 8) & mask) ^ rows[factor]
+    return bytearray(binascii.unhexlify('%0*x' % (2 * ec_count, register)))
+
+
+def interleave(blocks):
+    """
+    Interleave codeword blocks: the first codeword of every block, then the
+    second, and so on. QR Code blocks of a symbol differ in length by one
+    codeword at most, which the slices below rely on.
+    """
+    count = len(blocks)
+    shortest = min(len(block) for block in blocks)
+    result = bytearray(sum(len(block) for block in blocks))
+    for i, block in enumerate(blocks):
+        result[i:shortest * count:count] = block[:shortest]
+    result[shortest * count:] = b''.join(
+        bytes(block[shortest:]) for block in blocks)
+    return result
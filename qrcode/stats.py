@@ -0,0 +1,151 @@
+"""
+Per-stage instrumentation of QR Code generation.
+
+A ``Stats`` collector given to ``QRCode(stats=...)`` records the wall time
+and number of calls of each stage of making an image: ``best_fit``,
+``create_data``, ``makeImpl``, ``lost_point``, ``make_image`` and the
+image's ``save``. Nested stages are recorded on their own as well as being
+part of the enclosing stage's time (``makeImpl`` includes ``create_data``,
+for example).
+
+Without a collector, the stages only pay for an attribute check.
+"""
+import functools
+import logging
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Stats(object):
+    """
+    A thread-safe collector of stage timings.
+
+    :param memory: Also record by how many bytes each stage raised the
+        process's peak resident set size, from ``resource.getrusage``
+        (which isn't available on Windows). The peak only rises when a
+        stage needs more memory than the process ever has, so this shows
+        the stages that grow it rather than every allocation, and it counts
+        the memory of other threads too.
+    :param callback: Called as ``callback(stage, seconds, peak)`` for every
+        measurement, ``peak`` being None unless ``memory`` is set.
+    """
+
+    def __init__(self, memory=False, callback=None):
+        if memory and resource is None:
+            raise NotImplementedError("resource not available")
+        self.memory = memory
+        self.callback = callback
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def start(self, stage):
+        """
+        Start measuring a stage, returning a token to pass to ``stop``.
+        """
+        peak = _max_rss() if self.memory else None
+        return stage, time.time(), peak
+
+    def stop(self, token):
+        """
+        Stop measuring the stage ``start`` returned ``token`` for.
+        """
+        stage, started, peak = token
+        elapsed = time.time() - started
+        if peak is not None:
+            peak = _max_rss() - peak
+        self.record(stage, elapsed, peak)
+
+    def record(self, stage, elapsed, peak=None):
+        """
+        Add a measurement of ``elapsed`` seconds (and ``peak`` bytes).
+        """
+        with self._lock:
+            totals = self._stages.get(stage)
+            if totals is None:
+                totals = self._stages[stage] = {
+                    'calls': 0, 'time': 0.0, 'max_time': 0.0, 'peak': None}
+            totals['calls'] += 1
+            totals['time'] += elapsed
+            totals['max_time'] = max(totals['max_time'], elapsed)
+            if peak is not None and (totals['peak'] is None or
+                                     peak > totals['peak']):
+                totals['peak'] = peak
+        if self.callback is not None:
+            self.callback(stage, elapsed, peak)
+
+    def snapshot(self):
+        """
+        Return the totals so far: a dict of stage names to dicts of
+        ``calls``, ``time`` and ``max_time`` (in seconds) and ``peak`` (in
+        bytes, or None).
+        """
+        with self._lock:
+            return dict((stage, dict(totals))
+                        for stage, totals in self._stages.items())
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+def _max_rss():
+    """
+    Return the peak resident set size of the process, in bytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # It is in bytes on macOS, kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+
+def measure(stats, stage, func, *args, **kwargs):
+    """
+    Call ``func``, recording it as ``stage`` if ``stats`` isn't None.
+    """
+    if stats is None:
+        return func(*args, **kwargs)
+    token = stats.start(stage)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats.stop(token)
+
+
+def timed(stage):
+    """
+    Decorate a method to be recorded as ``stage`` in ``self.stats``.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self.stats
+            if stats is None:
+                return method(self, *args, **kwargs)
+            token = stats.start(stage)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stats.stop(token)
+        return wrapper
+    return decorator
+
+
+def log_callback(logger, level=logging.DEBUG):
+    """
+    Return a ``Stats`` callback logging every measurement to ``logger``
+    (such as a Flask application's ``app.logger``).
+    """
+    def callback(stage, elapsed, peak):
+        if peak is None:
+            logger.log(level, "qrcode %s %.3fms", stage, elapsed * 1000)
+        else:
+            logger.log(level, "qrcode %s %.3fms peak %d bytes", stage,
+                       elapsed * 1000, peak)
+    return callback
@@ -0,0 +1,195 @@
+"""
+Function pattern templates.
+
+The finder, alignment and timing patterns, and the position of the format
+and version information, only depend on the version of a symbol. They are
+drawn once per version into an immutable ``Template`` which new symbols
+start from, and the most recently used templates are kept in a bounded
+cache shared by all threads.
+"""
+import threading
+from collections import OrderedDict
+
+from qrcode import util
+from qrcode.matrix import ModuleMatrix
+
+# The number of templates kept in the cache.
+CACHE_SIZE = 8
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class Template(object):
+    """
+    The function patterns of a version, with the format and version
+    information areas reserved but cleared (as used for mask selection).
+    """
+
+    __slots__ = ('version', 'size', 'dark', 'reserved')
+
+    def __init__(self, version):
+        size = version * 4 + 17
+        modules = ModuleMatrix(size)
+
+        setup_position_probe_pattern(modules, 0, 0)
+        setup_position_probe_pattern(modules, size - 7, 0)
+        setup_position_probe_pattern(modules, 0, size - 7)
+        setup_position_adjust_pattern(modules, version)
+        setup_timing_pattern(modules)
+        setup_type_info(modules, None)
+        if version >= 7:
+            setup_type_number(modules, None)
+
+        self.version = version
+        self.size = size
+        self.dark = bytes(modules.dark)
+        self.reserved = bytes(modules.reserved)
+
+    def matrix(self):
+        """
+        Return a new ``ModuleMatrix`` holding the function patterns.
+        """
+        modules = ModuleMatrix.__new__(ModuleMatrix)
+        modules.size = self.size
+        modules.dark = bytearray(self.dark)
+        modules.reserved = bytearray(self.reserved)
+        modules.filled = bytearray(self.reserved)
+        return modules
+
+
+def get(version):
+    """
+    Return the ``Template`` for a version, building it if it isn't cached.
+    """
+    with _cache_lock:
+        template = _cache.pop(version, None)
+        if template is not None:
+            _cache[version] = template
+            return template
+
+    # Build outside the lock; a concurrent build of the same version just
+    # produces an identical template.
+    template = Template(version)
+
+    with _cache_lock:
+        _cache[version] = template
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return template
+
+
+def clear():
+    """
+    Empty the template cache.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def setup_position_probe_pattern(modules, row, col):
+    modules_count = modules.size
+
+    for r in range(-1, 8):
+
+        if row + r <= -1 or modules_count <= row + r:
+            continue
+
+        for c in range(-1, 8):
+
+            if col + c <= -1 or modules_count <= col + c:
+                continue
+
+            modules.set(row + r, col + c,
+                (0 <= r and r <= 6 and (c == 0 or c == 6)
+                    or (0 <= c and c <= 6 and (r == 0 or r == 6))
+                    or (2 <= r and r <= 4 and 2 <= c and c <= 4)))
+
+
+def setup_timing_pattern(modules):
+    modules_count = modules.size
+
+    for r in range(8, modules_count - 8):
+        if modules.is_reserved(r, 6):
+            continue
+        modules.set(r, 6, r % 2 == 0)
+
+    for c in range(8, modules_count - 8):
+        if modules.is_reserved(6, c):
+            continue
+        modules.set(6, c, c % 2 == 0)
+
+
+def setup_position_adjust_pattern(modules, version):
+    pos = util.pattern_position(version)
+
+    for i in range(len(pos)):
+
+        for j in range(len(pos)):
+
+            row = pos[i]
+            col = pos[j]
+
+            if modules.is_reserved(row, col):
+                continue
+
+            for r in range(-2, 3):
+
+                for c in range(-2, 3):
+
+                    modules.set(row + r, col + c,
+                        (r == -2 or r == 2 or c == -2 or c == 2 or
+                            (r == 0 and c == 0)))
+
+
+def setup_type_number(modules, version):
+    """
+    Draw the version information, or clear its area if ``version`` is None.
+    """
+    modules_count = modules.size
+    bits = 0 if version is None else util.BCH_type_number(version)
+
+    for i in range(18):
+        mod = ((bits >> i) & 1) == 1
+        modules.set(i // 3, i % 3 + modules_count - 8 - 3, mod)
+
+    for i in range(18):
+        mod = ((bits >> i) & 1) == 1
+        modules.set(i % 3 + modules_count - 8 - 3, i // 3, mod)
+
+
+def setup_type_info(modules, data):
+    """
+    Draw the format information for ``data`` (the error correction level and
+    mask pattern bits), or clear its area and the fixed dark module if
+    ``data`` is None.
+    """
+    modules_count = modules.size
+    bits = 0 if data is None else util.BCH_type_info(data)
+
+    # vertical
+    for i in range(15):
+
+        mod = ((bits >> i) & 1) == 1
+
+        if i < 6:
+            modules.set(i, 8, mod)
+        elif i < 8:
+            modules.set(i + 1, 8, mod)
+        else:
+            modules.set(modules_count - 15 + i, 8, mod)
+
+    # horizontal
+    for i in range(15):
+
+        mod = ((bits >> i) & 1) == 1
+
+        if i < 8:
+            modules.set(8, modules_count - i - 1, mod)
+        elif i < 9:
+            modules.set(8, 15 - i - 1 + 1, mod)
+        else:
+            modules.set(8, 15 - i - 1, mod)
+
+    # fixed module
+    modules.set(modules_count - 8, 8, data is not None)
@@ -1,7 +1,9 @@
 import re
 import math
+import binascii
 
-from qrcode import base, exceptions
+from qrcode import base, exceptions, penalty, rs
+from qrcode.matrix import pack
 
 # QR encoding modes.
 MODE_NUMBER = 1 << 0
@@ -86,6 +88,22 @@ G15_MASK = (1 << 14) | (1 << 12) | (1 << 10) | (1 << 4) | (1 << 1)
 PAD0 = 0xEC
 PAD1 = 0x11
 
+# The ranges of versions sharing the same character count field sizes.
+VERSION_RANGES = ((1, 10), (10, 27), (27, 41))
+
+
+def _data_count(version, error_correction):
+    return sum(block.data_count
+               for block in base.rs_blocks(version, error_correction))
+
+# The number of data bits each version can hold, indexed by error correction
+# level then by version (index 0 is unused).
+BIT_LIMIT_TABLE = dict(
+    (error_correction,
+     [0] + [_data_count(version, error_correction) * 8
+            for version in range(1, 41)])
+    for error_correction in base.RS_BLOCK_OFFSET)
+
 
 def BCH_type_info(data):
         d = data << 10
@@ -137,6 +155,30 @@ def mask_func(pattern):
     raise TypeError("Bad mask pattern: " + pattern)
 
 
+_mask_planes = {}
+
+
+def mask_plane(pattern, modules_count):
+    """
+    Return the mask pattern over a whole symbol of the given size, packed
+    into an integer by ``qrcode.matrix.pack``. Planes are cached, so masking
+    a symbol is a single XOR.
+    """
+    key = (pattern, modules_count)
+    plane = _mask_planes.get(key)
+    if plane is None:
+        func = mask_func(pattern)
+        cells = bytearray(modules_count * modules_count)
+        i = 0
+        for row in range(modules_count):
+            for col in range(modules_count):
+                if func(row, col):
+                    cells[i] = 1
+                i += 1
+        plane = _mask_planes[key] = pack(cells)
+    return plane
+
+
 def length_in_bits(mode, version):
     if mode not in (MODE_NUMBER, MODE_ALPHA_NUM, MODE_8BIT_BYTE,
             MODE_KANJI):
@@ -157,89 +199,105 @@ def length_in_bits(mode, version):
 
 
 def lost_point(modules):
-    modules_count = len(modules)
-
-    lost_point = 0
-
-    # LEVEL1
-
-    for row in range(modules_count):
-
-        for col in range(modules_count):
-
-            sameCount = 0
-            dark = modules[row][col]
+    return penalty.lost_point(modules)
 
-            for r in range(-1, 2):
 
-                if row + r < 0 or modules_count <= row + r:
-                    continue
-
-                for c in range(-1, 2):
-
-                    if col + c < 0 or modules_count <= col + c:
-                        continue
-                    if r == 0 and c == 0:
-                        continue
-
-                    if dark == modules[row + r][col + c]:
-                        sameCount += 1
-            if sameCount > 5:
-                lost_point += (3 + sameCount - 5)
-
-    # LEVEL2
-
-    for row in range(modules_count - 1):
-        for col in range(modules_count - 1):
-            count = 0
-            if modules[row][col]:
-                count += 1
-            if modules[row + 1][col]:
-                count += 1
-            if modules[row][col + 1]:
-                count += 1
-            if modules[row + 1][col + 1]:
-                count += 1
-            if count == 0 or count == 4:
-                lost_point += 3
-
-    # LEVEL3
+def to_bytestring(data):
+    """
+    Convert data to a (utf-8 encoded) byte-string.
+    """
+    if not isinstance(data, basestring):
+        try:
+            data = str(data)
+        except UnicodeEncodeError:
+            data = unicode(data)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return data
 
-    for row in range(modules_count):
-        for col in range(modules_count - 6):
-            if (modules[row][col]
-                    and not modules[row][col + 1]
-                    and modules[row][col + 2]
-                    and modules[row][col + 3]
-                    and modules[row][col + 4]
-                    and not modules[row][col + 5]
-                    and modules[row][col + 6]):
-                lost_point += 40
 
-    for col in range(modules_count):
-        for row in range(modules_count - 6):
-            if (modules[row][col]
-                    and not modules[row + 1][col]
-                    and modules[row + 2][col]
-                    and modules[row + 3][col]
-                    and modules[row + 4][col]
-                    and not modules[row + 5][col]
-                    and modules[row + 6][col]):
-                lost_point += 40
+# The cost of a character in each mode, in sixths of a bit (numeric mode
+# packs 3 digits in 10 bits, alphanumeric mode 2 characters in 11 bits).
+_CHAR_COST = {
+    MODE_NUMBER: 20,
+    MODE_ALPHA_NUM: 33,
+    MODE_8BIT_BYTE: 48,
+}
 
-    # LEVEL4
+_SEGMENT_MODES = (MODE_NUMBER, MODE_ALPHA_NUM, MODE_8BIT_BYTE)
 
-    darkCount = 0
 
-    for col in range(modules_count):
-        for row in range(modules_count):
-            if modules[row][col]:
-                darkCount += 1
+def _round_up_bits(cost):
+    """
+    Round a cost in sixths of a bit up to a whole number of bits.
+    """
+    return (cost + 5) // 6 * 6
 
-    ratio = abs(100 * darkCount / modules_count / modules_count - 50) / 5
-    lost_point += ratio * 10
 
-    return lost_point
+def optimal_data_chunks(data, version=1):
+    """
+    Split data into the numeric, alphanumeric and 8bit byte segments which
+    encode it in the fewest bits, returning a list of ``QRData``.
+
+    Each segment costs a mode indicator and a character count field (sized
+    for the given version) on top of its characters, so short runs are left
+    in the surrounding segment when switching modes wouldn't pay off. The
+    minimum is found with dynamic programming over the characters, keeping
+    the cheapest encoding of the data so far for each mode of the segment
+    the last character is in.
+    """
+    data = to_bytestring(data)
+    if not data:
+        return [QRData(data)]
+
+    header = dict((mode, (4 + length_in_bits(mode, version)) * 6)
+                  for mode in _SEGMENT_MODES)
+    alpha_num = frozenset(ALPHA_NUM)
+    infinity = float('inf')
+
+    # costs[mode] is the cheapest encoding of the data so far ending with a
+    # (possibly still empty) segment in ``mode``; char_modes[i][mode] is the
+    # mode character ``i`` is encoded in on that path.
+    costs = dict(header)
+    char_modes = []
+    for char in data:
+        if char.isdigit():
+            allowed = _SEGMENT_MODES
+        elif char in alpha_num:
+            allowed = _SEGMENT_MODES[1:]
+        else:
+            allowed = _SEGMENT_MODES[2:]
+
+        new_costs = dict.fromkeys(_SEGMENT_MODES, infinity)
+        modes = {}
+        for mode in allowed:
+            new_costs[mode] = costs[mode] + _CHAR_COST[mode]
+            modes[mode] = mode
+
+        # Alternatively start a new segment after this character.
+        for mode in _SEGMENT_MODES:
+            for previous in allowed:
+                cost = _round_up_bits(new_costs[previous]) + header[mode]
+                if cost < new_costs[mode]:
+                    new_costs[mode] = cost
+                    modes[mode] = previous
+
+        costs = new_costs
+        char_modes.append(modes)
+
+    mode = min(_SEGMENT_MODES, key=lambda m: _round_up_bits(costs[m]))
+    segments = []
+    end = len(data)
+    for i in range(len(data) - 1, -1, -1):
+        char_mode = char_modes[i][mode]
+        if char_mode != mode:
+            # Reached the start of the following segment.
+            segments.append(QRData(data[i + 1:end], mode))
+            end = i + 1
+            mode = char_mode
+    segments.append(QRData(data[:end], mode))
+    segments.reverse()
+    return segments
 
 
 class QRData:
@@ -254,14 +312,7 @@ class QRData:
         If ``mode`` isn't provided, the most compact QR data type possible is
         chosen.
         """
-        # Convert data to a (utf-8 encoded) byte-string.
-        if not isinstance(data, basestring):
-            try:
-                data = str(data)
-            except UnicodeEncodeError:
-                data = unicode(data)
-        if isinstance(data, unicode):
-            data = data.encode('utf-8')
+        data = to_bytestring(data)
 
         if data.isdigit():
             auto_mode = MODE_NUMBER
@@ -285,6 +336,19 @@ class QRData:
     def __len__(self):
         return len(self.data)
 
+    def bit_length(self):
+        """
+        Return the number of bits ``write`` produces.
+        """
+        if self.mode == MODE_NUMBER:
+            groups, rest = divmod(len(self.data), 3)
+            return groups * 10 + (rest and NUMBER_LENGTH[rest])
+        elif self.mode == MODE_ALPHA_NUM:
+            pairs, rest = divmod(len(self.data), 2)
+            return pairs * 11 + rest * 6
+        else:
+            return len(self.data) * 8
+
     def write(self, buffer):
         if self.mode == MODE_NUMBER:
             for i in xrange(0, len(self.data), 3):
@@ -300,29 +364,85 @@ class QRData:
                 else:
                     buffer.put(ALPHA_NUM.find(chars), 6)
         else:
-            for c in self.data:
-                buffer.put(ord(c), 8)
+            buffer.put_bytes(self.data)
 
     def __repr__(self):
         return self.data
 
 
 class BitBuffer:
+    """
+    A big-endian bit writer backed by a ``bytearray``.
+
+    ``buffer`` always holds every written bit, the last byte being padded
+    with zero bits while it is incomplete.
+    """
 
     def __init__(self):
-        self.buffer = []
+        self.buffer = bytearray()
         self.length = 0
 
     def __repr__(self):
         return ".".join([str(n) for n in self.buffer])
 
     def get(self, index):
-        buf_index = math.floor(index / 8)
+        buf_index = index // 8
         return ((self.buffer[buf_index] >> (7 - index % 8)) & 1) == 1
 
     def put(self, num, length):
-        for i in range(length):
-            self.put_bit(((num >> (length - i - 1)) & 1) == 1)
+        """
+        Write the lowest ``length`` bits of ``num``.
+        """
+        if length <= 0:
+            return
+        num &= (1 << length) - 1
+
+        used = self.length % 8
+        if used:
+            # Top up the incomplete last byte first.
+            free = 8 - used
+            if length <= free:
+                self.buffer[-1] |= num << (free - length)
+                self.length += length
+                return
+            length -= free
+            self.buffer[-1] |= num >> length
+            self.length += free
+            num &= (1 << length) - 1
+
+        whole, rest = divmod(length, 8)
+        if whole == 1:
+            self.buffer.append(num >> rest)
+        elif whole:
+            self.buffer.extend(binascii.unhexlify(
+                '%0*x' % (2 * whole, num >> rest)))
+        if rest:
+            self.buffer.append((num << (8 - rest)) & 0xff)
+        self.length += length
+
+    def put_bytes(self, data):
+        """
+        Write whole bytes, copying them straight in when byte aligned.
+        """
+        if not data:
+            return
+        if self.length % 8:
+            self.put(int(binascii.hexlify(data), 16), 8 * len(data))
+        else:
+            self.buffer.extend(data)
+            self.length += 8 * len(data)
+
+    def pad(self, byte_count):
+        """
+        Pad with zero bits up to a byte boundary, then with the alternating
+        pad codewords up to ``byte_count`` bytes.
+        """
+        self.length = 8 * len(self.buffer)
+        remaining = byte_count - len(self.buffer)
+        if remaining > 0:
+            pads = bytearray([PAD0, PAD1]) * ((remaining + 1) // 2)
+            self.buffer.extend(pads[:remaining])
+            self.length += 8 * remaining
 
     def __len__(self):
         return self.length
@@ -339,62 +459,29 @@ class BitBuffer:
 def create_bytes(buffer, rs_blocks):
     offset = 0
 
-    maxDcCount = 0
-    maxEcCount = 0
-
-    dcdata = [0] * len(rs_blocks)
-    ecdata = [0] * len(rs_blocks)
-
-    for r in range(len(rs_blocks)):
-
-        dcCount = rs_blocks[r].data_count
-        ecCount = rs_blocks[r].total_count - dcCount
+    dcdata = []
+    ecdata = []
 
-        maxDcCount = max(maxDcCount, dcCount)
-        maxEcCount = max(maxEcCount, ecCount)
-
-        dcdata[r] = [0] * dcCount
+    for rs_block in rs_blocks:
+        dcCount = rs_block.data_count
+        ecCount = rs_block.total_count - dcCount
 
-        for i in range(len(dcdata[r])):
-            dcdata[r][i] = 0xff & buffer.buffer[i + offset]
+        dc = buffer.buffer[offset:offset + dcCount]
         offset += dcCount
 
-        # Get error correction polynomial.
-        rsPoly = base.Polynomial([1], 0)
-        for i in range(ecCount):
-            rsPoly = rsPoly * base.Polynomial([1, base.gexp(i)], 0)
-
-        rawPoly = base.Polynomial(dcdata[r], len(rsPoly) - 1)
-
-        modPoly = rawPoly % rsPoly
-        ecdata[r] = [0] * (len(rsPoly) - 1)
-        for i in range(len(ecdata[r])):
-            modIndex = i + len(modPoly) - len(ecdata[r])
-            if (modIndex >= 0):
-                ecdata[r][i] = modPoly[modIndex]
-            else:
-                ecdata[r][i] = 0
+        dcdata.append(dc)
+        ecdata.append(rs.encode(dc, ecCount))
 
-    totalCodeCount = 0
-    for rs_block in rs_blocks:
-        totalCodeCount += rs_block.total_count
-
-    data = [None] * totalCodeCount
-    index = 0
+    return rs.interleave(dcdata) + rs.interleave(ecdata)
 
-    for i in range(maxDcCount):
-        for r in range(len(rs_blocks)):
-            if i < len(dcdata[r]):
-                data[index] = dcdata[r][i]
-                index += 1
 
-    for i in range(maxEcCount):
-        for r in range(len(rs_blocks)):
-            if i < len(ecdata[r]):
-                data[index] = ecdata[r][i]
-                index += 1
-
-    return data
+def data_bit_length(data_list, version):
+    """
+    Return the number of bits the data list is encoded to (before the end
+    code and padding) in a symbol of the given version.
+    """
+    return sum(4 + length_in_bits(data.mode, version) + data.bit_length()
+               for data in data_list)
 
 
 def create_data(version, error_correction, data_list):
@@ -423,17 +510,6 @@ def create_data(version, error_correction, data_list):
         buffer.put(0, 4)
 
     # padding
-    while len(buffer) % 8:
-        buffer.put_bit(False)
-
-    # padding
-    while True:
-        if len(buffer) >= total_data_count * 8:
-            break
-        buffer.put(PAD0, 8)
-
-        if len(buffer) >= total_data_count * 8:
-            break
-        buffer.put(PAD1, 8)
+    buffer.pad(total_data_count)
 
     return create_bytes(buffer, rs_blocks)
@@ -0,0 +1,139 @@
+import hashlib
+import threading
+import time
+
+
+class LocalStore(object):
+    """An in-process stand-in for a shared store with expiring keys.
+
+    ``add`` has the semantics of memcached's ``add`` or Redis's ``SET key
+    value NX EX ttl``: it sets a key only if it isn't already set, and says
+    whether it did, and ``delete`` removes a key. A ReplayGuard given a
+    client with the same methods as its backend refuses a token replayed in
+    any process sharing the store.
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._expiries = {}
+        self._lock = threading.Lock()
+        self._sweep_at = 1024
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def add(self, key, ttl):
+        now = self.clock()
+        with self._lock:
+            if self._expiries.get(key, 0) > now:
+                return False
+            self._expiries[key] = now + ttl
+            if len(self._expiries) >= self._sweep_at:
+                self._sweep(now)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._expiries.pop(key, None)
+
+    def _sweep(self, now):
+        for key, expiry in self._expiries.items():
+            if expiry <= now:
+                del self._expiries[key]
+        # Sweeping once the store doubles in size keeps adds O(1) amortized.
+        self._sweep_at = max(1024, 2 * len(self._expiries))
+
+
+class _Shard(object):
+    """A ring of buckets, one per time step, of the uids that claimed it."""
+    __slots__ = ('lock', 'steps', 'uids')
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.steps = [None] * size
+        self.uids = [set() for i in range(size)]
+
+
+class ReplayGuard(object):
+    """Refuse TOTP tokens that were already accepted.
+
+    Example:
+    from replay import ReplayGuard
+    guard = ReplayGuard()
+    step = totp_auth.verify(token)
+    if step is not None and guard.claim(uid, step):
+        ...                      # first use of this token
+
+    A token is claimed by ``(uid, time step)``. The claims of each step go
+    in a bucket of a ring with a slot per step of the verification window
+    (``look_behind`` and ``look_ahead`` as in TotpAuth, plus one step for
+    verifications straddling a step boundary). Once a step ages out of the
+    window its bucket is reused, dropping its claims, so memory is bounded
+    by the most users logging in during a window.
+
+    Uids are spread over ``shards`` rings, each with its own lock, so
+    concurrent claims rarely wait for each other. If ``backend`` is given
+    (see LocalStore), a claim also has to be added to it, which extends the
+    guard to every process sharing the backend.
+    """
+    def __init__(self, look_behind=1, look_ahead=0, interval=30, shards=16,
+                 backend=None, clock=time.time):
+        self.look_behind = look_behind
+        self.look_ahead = look_ahead
+        self.interval = interval
+        self.backend = backend
+        self.clock = clock
+        # The steps claims are accepted for, relative to the current one.
+        self._behind = look_behind + 1
+        self._size = self._behind + look_ahead + 1
+        self._shards = [_Shard(self._size) for i in range(shards)]
+
+    def __len__(self):
+        oldest = self._step() - self._behind
+        count = 0
+        for shard in self._shards:
+            with shard.lock:
+                for step, uids in zip(shard.steps, shard.uids):
+                    if step is not None and step >= oldest:
+                        count += len(uids)
+        return count
+
+    def _step(self):
+        return int(self.clock()) // self.interval
+
+    def claim(self, uid, step):
+        """Return True if ``uid`` hadn't claimed ``step`` yet, and claim it.
+
+        Steps outside the window can't have a valid token and are refused.
+        """
+        now = self._step()
+        if not now - self._behind <= step <= now + self.look_ahead:
+            return False
+
+        shard = self._shards[hash(uid) % len(self._shards)]
+        slot = step % self._size
+        with shard.lock:
+            current = shard.steps[slot]
+            if current is not None and current > step:
+                # The clock moved on before the lock was taken, and the
+                # step aged out of the window.
+                return False
+            if current != step:
+                shard.steps[slot] = step
+                shard.uids[slot] = set()
+            uids = shard.uids[slot]
+            if uid in uids:
+                return False
+            uids.add(uid)
+
+        if self.backend is not None:
+            name = uid.encode('utf-8') if isinstance(uid, unicode) else uid
+            key = 'totp-replay:%s' % hashlib.sha1(
+                '%s\0%d' % (name, step)).hexdigest()
+            try:
+                return self.backend.add(key, self._size * self.interval)
+            except:
+                # The token wasn't claimed, so it can be tried again.
+                with shard.lock:
+                    uids.discard(uid)
+                raise
+        return True
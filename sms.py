@@ -0,0 +1,502 @@
+import base64
+import binascii
+import collections
+import errno
+import hashlib
+import httplib
+import json
+import os
+import Queue
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+# The states of a message. Sent, failed and coalesced (sent by another
+# process) are final.
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+COALESCED = 'coalesced'
+
+TWILIO_API = 'https://api.twilio.com'
+
+
+class TransportError(Exception):
+    """The SMS provider didn't take a message, which may be retried."""
+
+
+class OutcomeUnknown(Exception):
+    """The SMS provider may or may not have taken a message, which
+    mustn't be sent again."""
+
+
+class TwilioTransport(object):
+    """Send SMS through a twilio TwilioRestClient (or anything like it)."""
+    def __init__(self, client):
+        self.client = client
+
+    def send(self, to, from_, body):
+        """Send a message, returning its status (FAILED if refused).
+
+        Twilio refusing the message (a TwilioRestException with a 4xx
+        status, for an invalid number say) fails it. Server errors and
+        failures to connect raise TransportError, for the Outbox to retry;
+        any other error may come after Twilio took the message, and is
+        raised as it is.
+        """
+        try:
+            rv = self.client.sms.messages.create(to=to, from_=from_,
+                                                 body=body)
+        except socket.gaierror as e:
+            raise TransportError(str(e))
+        except socket.error as e:
+            if e.errno == errno.ECONNREFUSED:
+                raise TransportError(str(e))
+            raise
+        except Exception as e:
+            # Matched by its status rather than its class, since importing
+            # twilio is slow.
+            status = getattr(e, 'status', None)
+            if isinstance(status, int) and 400 <= status < 500:
+                return FAILED
+            if isinstance(status, int) and status >= 500:
+                raise TransportError(str(e))
+            raise
+        if not rv or rv.status == 'failed':
+            return FAILED
+        return SENT
+
+
+def _no_status_line(error):
+    """Whether a BadStatusLine is for a connection closed before any of
+    the response (the wording depends on the Python release)."""
+    return (error.line in ('', "''") or
+            error.line.startswith('No status line received'))
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP(S) connections to a host, shared between threads.
+
+    Up to ``size`` idle connections are kept for reuse, so a request only
+    pays for the TCP and TLS handshakes when none is free; ``size=0``
+    makes a new connection for every request. Connecting times out after
+    ``connect_timeout`` seconds, and waiting for a response after
+    ``read_timeout``.
+
+    Failing to connect or to send the request raises TransportError, since
+    the server can't have acted on it. Errors after the request was sent
+    are raised as they are.
+    """
+    def __init__(self, url, size=4, connect_timeout=5, read_timeout=10):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.created = 0
+        self._idle = Queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        connection = connection_class(self.host, self.port,
+                                      timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        # Requests are written whole, so don't wait to coalesce them.
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self.created += 1
+        return connection
+
+    def _get(self):
+        """Return an idle connection, or a new one, and whether it is
+        reused."""
+        try:
+            return self._idle.get_nowait(), True
+        except Queue.Empty:
+            return self._connect(), False
+
+    def _put(self, connection):
+        with self._lock:
+            keep = self._idle.qsize() < self.size
+            if keep:
+                self._idle.put_nowait(connection)
+        if not keep:
+            connection.close()
+
+    def request(self, method, path, body=None, headers={}):
+        """Make a request, returning the response status and body."""
+        try:
+            connection, reused = self._get()
+        except (httplib.HTTPException, socket.error) as e:
+            raise TransportError("couldn't connect: %s" % (str(e) or
+                                                           repr(e)))
+        try:
+            connection.request(method, path, body, headers)
+        except (httplib.HTTPException, socket.error) as e:
+            connection.close()
+            if not reused or isinstance(e, socket.timeout):
+                raise TransportError("couldn't send the request: %s" % (
+                    str(e) or repr(e)))
+            # The server closed the idle connection, so the request wasn't
+            # sent and can be made again on a new one.
+            return self.request(method, path, body, headers)
+
+        try:
+            response = connection.getresponse()
+            data = response.read()
+        except httplib.BadStatusLine as e:
+            connection.close()
+            # Nothing at all came back on a reused connection: the server
+            # closed it while idle, without reading the request. Any other
+            # error may come after the request was acted on, and making it
+            # again could send an SMS twice.
+            if not reused or not _no_status_line(e):
+                raise
+            return self.request(method, path, body, headers)
+        except:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._put(connection)
+        return response.status, data
+
+    def close(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                return
+
+
+class HttpTransport(object):
+    """Send SMS with Twilio's REST API over a ConnectionPool.
+
+    Unlike TwilioTransport, which goes through the twilio client and makes
+    a connection per message, connections are kept alive and reused, and
+    the transport can be used from several threads at once. The pool
+    options are passed on to ConnectionPool.
+
+    Server errors (5xx responses) and requests that couldn't be sent raise
+    TransportError, so the outbox retries them, while refused messages
+    (4xx responses) are FAILED. Losing the response to a request that was
+    sent, to a read timeout say, raises OutcomeUnknown: the message may
+    have been taken, so it mustn't be sent again.
+    """
+    def __init__(self, account_sid, auth_token, base_url=TWILIO_API,
+                 **pool_options):
+        self.pool = ConnectionPool(base_url, **pool_options)
+        prefix = urlparse.urlsplit(base_url).path.rstrip('/')
+        self.path = '%s/2010-04-01/Accounts/%s/SMS/Messages.json' % (
+            prefix, account_sid)
+        credentials = base64.b64encode('%s:%s' % (account_sid, auth_token))
+        self.headers = {
+            'Authorization': 'Basic ' + credentials,
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json',
+        }
+
+    def send(self, to, from_, body):
+        """Send a message, returning its status (FAILED if refused)."""
+        form = [('To', to), ('From', from_), ('Body', body)]
+        form = urllib.urlencode([
+            (key, value.encode('utf-8') if isinstance(value, unicode)
+             else value) for key, value in form])
+        try:
+            status, data = self.pool.request('POST', self.path, form,
+                                             self.headers)
+        except (httplib.HTTPException, socket.error) as e:
+            raise OutcomeUnknown("outcome unknown: %s" % (str(e) or
+                                                          repr(e)))
+        if status >= 500:
+            raise TransportError("HTTP %d from the SMS API" % status)
+        if status >= 400:
+            return FAILED
+        try:
+            failed = json.loads(data).get('status') == 'failed'
+        except (ValueError, AttributeError):
+            # Accepted all the same, so sending it again would duplicate it.
+            failed = False
+        return FAILED if failed else SENT
+
+
+class FakeTransport(object):
+    """A transport for tests, which keeps the messages it is given.
+
+    Sending raises ``error`` ``failures`` times before succeeding, after
+    waiting ``delay`` seconds, and numbers in ``invalid`` are refused.
+    """
+    def __init__(self, failures=0, error=TransportError, delay=0,
+                 invalid=()):
+        self.failures = failures
+        self.error = error
+        self.delay = delay
+        self.invalid = invalid
+        self.calls = 0
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to, from_, body):
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.calls += 1
+            if self.failures:
+                self.failures -= 1
+                raise self.error("fake transport failure")
+            if to in self.invalid:
+                return FAILED
+            self.sent.append((to, from_, body))
+            return SENT
+
+
+class Message(object):
+    """An SMS in the outbox and what became of it.
+
+    ``callback``, if given, is called with the message once it is sent or
+    failed."""
+    def __init__(self, to, from_, body, callback=None):
+        self.id = binascii.hexlify(os.urandom(16))
+        self.to = to
+        self.from_ = from_
+        self.body = body
+        self.status = QUEUED
+        self.attempts = 0
+        self.error = None
+        self.callback = callback
+        self.done = threading.Event()
+
+    def to_dict(self):
+        """The status of the message, without its (secret) body."""
+        return {'id': self.id, 'status': self.status,
+                'attempts': self.attempts, 'error': self.error}
+
+
+class Outbox(object):
+    """Send SMS from a pool of threads, so requests don't wait for them.
+
+    Example:
+    from sms import Outbox, TwilioTransport
+    outbox = Outbox(TwilioTransport(client))
+    message = outbox.send(to, from_, body)   # returns immediately
+    outbox.status(message.id)                # poll until sent or failed
+
+    At most ``max_queued`` messages wait for one of the ``workers`` sender
+    threads; beyond that ``send`` fails the message straight away rather
+    than let a slow provider pile up work. A TransportError, raised when
+    the provider didn't take the message, is retried ``retries`` times,
+    waiting ``backoff`` seconds and doubling the wait each time (up to
+    ``max_backoff``). Any other error fails the message at once, since
+    the provider may have taken it. The status of the last
+    ``max_tracked`` messages is kept for polling.
+
+    The threads are started by the first ``send``. With ``workers=0``
+    messages are sent (and retried) by ``send`` itself, blocking the
+    caller, which is only meant for tests. There is no asyncio mode:
+    asyncio needs Python 3 and the app runs on Python 2, so messages are
+    sent from threads.
+    """
+    def __init__(self, transport, workers=2, max_queued=100, retries=3,
+                 backoff=0.5, max_backoff=8, max_tracked=10000):
+        self.transport = transport
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_tracked = max_tracked
+        self._queue = Queue.Queue(max_queued)
+        self._messages = collections.OrderedDict()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def send(self, to, from_, body, callback=None):
+        """Queue an SMS, returning its Message."""
+        message = Message(to, from_, body, callback)
+        self.submit(message)
+        return message
+
+    def submit(self, message):
+        """Queue a Message."""
+        with self._lock:
+            self._messages[message.id] = message
+            while len(self._messages) > self.max_tracked:
+                self._messages.popitem(last=False)
+            if self.workers and not self._threads:
+                self._start()
+
+        if not self.workers:
+            self._deliver(message)
+            return
+        try:
+            self._queue.put_nowait(message)
+        except Queue.Full:
+            self._finish(message, FAILED, "outbox full")
+
+    def status(self, message_id):
+        """Return the status of a message as a dict, or None if unknown."""
+        message = self._messages.get(message_id)
+        return message.to_dict() if message is not None else None
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name='sms-outbox-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self, timeout=None):
+        """Send the queued messages, then stop the threads."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _work(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            self._deliver(message)
+
+    def _deliver(self, message):
+        delay = self.backoff
+        while True:
+            message.status = SENDING
+            message.attempts += 1
+            try:
+                status = self.transport.send(message.to, message.from_,
+                                             message.body)
+            except TransportError as e:
+                if message.attempts > self.retries:
+                    self._finish(message, FAILED, str(e) or repr(e))
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+            except Exception as e:
+                # The provider may have taken the message, so sending it
+                # again could send it twice.
+                self._finish(message, FAILED, str(e) or repr(e))
+                return
+            else:
+                self._finish(message, status)
+                return
+
+    def _finish(self, message, status, error=None):
+        # The body holds a token, which shouldn't outlive its sending.
+        message.body = None
+        message.status = status
+        message.error = error
+        message.done.set()
+        if message.callback is not None:
+            message.callback(message)
+
+
+class Coalescer(object):
+    """Send an SMS once per key, however many times it is asked for.
+
+    Example:
+    from sms import Coalescer
+    coalescer = Coalescer(outbox)
+    coalescer.send((uid, phone_number, step), to, from_, body)
+
+    Keyed by the uid, phone number and TOTP time step, a page refresh
+    that would text the same token again gets the Message of the first
+    send instead, unless that failed. Keys are kept for ``ttl`` seconds
+    and ``suppressed`` counts the sends saved.
+
+    If ``backend`` is given (see replay.LocalStore), keys are also added
+    to it so processes sharing it send once between them, and deleted from
+    it if the send fails so any of them can try again. A send another
+    process made is returned as a Message in the COALESCED state, since
+    this process can't know what became of it.
+
+    The lock is only held to look keys up and reserve them: the backend
+    and the outbox (which may send in the calling thread) are called
+    outside it.
+    """
+    def __init__(self, outbox, ttl=60, backend=None, clock=time.time):
+        self.outbox = outbox
+        self.ttl = ttl
+        self.backend = backend
+        self.clock = clock
+        self.suppressed = 0
+        # key -> (expiry time, Message)
+        self._sends = {}
+        self._sweep_at = 1024
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sends)
+
+    def send(self, key, to, from_, body):
+        """Send an SMS unless one was sent for ``key``, returning its
+        Message."""
+        now = self.clock()
+        with self._lock:
+            expiry, message = self._sends.get(key, (0, None))
+            # A failed send is tried again.
+            if expiry > now and message.status != FAILED:
+                self.suppressed += 1
+                return message
+            # Reserve the key, so sends racing this one get its message.
+            message = Message(to, from_, body,
+                              lambda message: self._finished(key, message))
+            self._sends[key] = (now + self.ttl, message)
+            if len(self._sends) >= self._sweep_at:
+                self._sweep(now)
+
+        if self.backend is not None:
+            try:
+                added = self.backend.add(self._backend_key(key), self.ttl)
+            except Exception:
+                self._release(key, message)
+                raise
+            if not added:
+                with self._lock:
+                    self.suppressed += 1
+                message.body = None
+                message.status = COALESCED
+                message.done.set()
+                return message
+        self.outbox.submit(message)
+        return message
+
+    def _release(self, key, message):
+        with self._lock:
+            if self._sends.get(key, (0, None))[1] is message:
+                del self._sends[key]
+
+    def _finished(self, key, message):
+        if message.status == FAILED and self.backend is not None:
+            try:
+                self.backend.delete(self._backend_key(key))
+            except Exception:
+                # The key expires after ttl seconds anyway.
+                pass
+
+    def _backend_key(self, key):
+        parts = [part.encode('utf-8') if isinstance(part, unicode)
+                 else str(part) for part in key]
+        return 'sms-send:%s' % hashlib.sha1('\0'.join(parts)).hexdigest()
+
+    def _sweep(self, now):
+        for key, (expiry, message) in self._sends.items():
+            if expiry <= now:
+                del self._sends[key]
+        # Sweeping once the map doubles in size keeps sends O(1) amortized.
+        self._sweep_at = max(1024, 2 * len(self._sends))
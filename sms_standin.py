@@ -0,0 +1,121 @@
+import BaseHTTPServer
+import json
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1, so connections are kept alive between requests.
+    protocol_version = 'HTTP/1.1'
+    # Buffered, so a response goes out in one write rather than one per
+    # header, which Nagle's algorithm would delay on a kept-alive socket.
+    wbufsize = -1
+
+    def setup(self):
+        server = self.server
+        # Idle keep-alive connections are closed after this long.
+        self.timeout = server.idle_timeout
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with server.lock:
+            server.connections += 1
+        if server.connect_latency:
+            time.sleep(server.connect_latency)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.getheader('Content-Length') or 0)
+        form = dict((key, values[0]) for key, values in
+                    urlparse.parse_qs(self.rfile.read(length)).items())
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            if server.responses:
+                code, status = server.responses.pop(0)
+            else:
+                code, status = 201, 'queued'
+            server.messages.append((self.path, form))
+            sid = 'SM%032d' % len(server.messages)
+
+        if code is None:
+            # Cut off in the middle of the response, after taking the
+            # message.
+            self.close_connection = 1
+            self.wfile.write('HTTP/1.1 201 Created\r\n'
+                             'Content-Length: 100\r\n\r\n{')
+            return
+        if status is None:
+            body = 'Created'
+        else:
+            body = json.dumps({'sid': sid, 'status': status,
+                               'to': form.get('To'),
+                               'from': form.get('From')})
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local stand-in for Twilio's SMS API, for tests and benchmarks.
+
+    Example:
+    from sms_standin import StandInServer
+    server = StandInServer(connect_latency=0.05).start()
+    transport = HttpTransport('AC123', 'token', base_url=server.url)
+    ...
+    server.stop()
+
+    Every POST is answered like Twilio's ``SMS/Messages.json`` (201 and a
+    queued message) unless ``responses`` holds ``(HTTP status, message
+    status)`` pairs to answer with first: a status of None answers with a
+    body which isn't JSON, and an HTTP status of None cuts the response
+    off after taking the message. ``messages`` keeps the path and
+    form of each request and ``connections`` counts the connections made.
+    Each new connection waits ``connect_latency`` seconds, standing in for
+    the TCP and TLS handshakes, and each request ``latency`` seconds.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_latency=0, latency=0, idle_timeout=30,
+                 port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           _Handler)
+        self.connect_latency = connect_latency
+        self.latency = latency
+        self.idle_timeout = idle_timeout
+        self.responses = []
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def handle_error(self, request, client_address):
+        # Clients going away (after a read timeout, say) are expected.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+    def start(self):
+        """Serve from a background thread, returning the server."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
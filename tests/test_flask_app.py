@@ -8,6 +8,8 @@ from mock import MagicMock
 from mock import ANY
 import mongomock
 import app as flask_app
+from replay import ReplayGuard
+from sms import Coalescer, Outbox, TwilioTransport
 from totp_auth import TotpAuth
 
 
@@ -65,6 +67,7 @@ class TestFlaskApp(unittest.TestCase):
                        'twilio_from_number': '+14155551212'}
         flask_app.konf.use_dict(test_config)
         flask_app.connection = connection
+        flask_app.replay_guard = ReplayGuard()
 
         flask_app.twilio = MagicMock(name='mock_twilio')
         create_sms_mock = MagicMock(name='mock_twilio.sms.messages.create')
@@ -73,11 +76,15 @@ class TestFlaskApp(unittest.TestCase):
             """Simulate errors on bad inputs"""
             for num in ['Fake', '+14155551212']:
                 if kwargs['to'] == num:
-                    raise TwilioRestException
+                    raise TwilioRestException(
+                        400, '/SMS/Messages.json', 'Invalid number', 21211)
 
         create_sms_mock.side_effect = side_effect
         flask_app.twilio.sms.messages.create = create_sms_mock
         self.create_sms_mock = create_sms_mock
+        flask_app.sms_outbox = Outbox(TwilioTransport(flask_app.twilio),
+                                      workers=0, backoff=0)
+        flask_app.sms_coalescer = Coalescer(flask_app.sms_outbox)
 
         self.app = flask_app.app.test_client()
 
@@ -336,3 +343,44 @@ class TestFlaskApp(unittest.TestCase):
             token=bad_token
         ), follow_redirects=True)
         self.assertIn('There was an error verifying your token', rv.data)
+
+    def test_replayed_token_is_refused(self):
+        self.login('user', 'password')
+        token = self.make_token('user')
+        rv = self.app.post('/enable-tfa-via-app', data=dict(
+            token=token
+        ), follow_redirects=True)
+        self.assertIn('You are set up', rv.data)
+
+        rv = self.app.post('/enable-tfa-via-app', data=dict(
+            token=token
+        ), follow_redirects=True)
+        self.assertIn('There was an error verifying your token', rv.data)
+
+    def test_sms_status(self):
+        rv = self.app.get('/sms-status')
+        self.assertEqual(404, rv.status_code)
+
+        self.login('user', 'password')
+        create = flask_app.twilio.sms.messages.create
+        flask_app.twilio.sms.messages.create = MagicMock()
+        self.enable_sms_auth('+14158675309')
+        flask_app.twilio.sms.messages.create = create
+        rv = self.app.get('/sms-status')
+        self.assertEqual(200, rv.status_code)
+        self.assertIn('"status": "sent"', rv.data)
+        self.assertNotIn('log in', rv.data)
+
+        self.enable_sms_auth('Fake')
+        rv = self.app.get('/sms-status')
+        self.assertIn('"status": "failed"', rv.data)
+
+    def test_refresh_does_not_send_again(self):
+        create = flask_app.twilio.sms.messages.create = MagicMock()
+        self.login('user.app_no.sms_yes', 'password')
+        self.app.get('/verify-tfa')
+        self.app.get('/verify-tfa')
+        # The login sent one, which the two refreshes reused (unless the
+        # time step changed in between).
+        self.assertTrue(create.call_count <= 2)
+        self.assertTrue(flask_app.sms_coalescer.suppressed >= 1)
@@ -0,0 +1,125 @@
+import base64
+import datetime
+import hashlib
+import sys
+import urlparse
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import otp
+
+# The seeds of the RFC 6238 test vectors, one per digest.
+SEEDS = {
+    hashlib.sha1: '12345678901234567890',
+    hashlib.sha256: '12345678901234567890123456789012',
+    hashlib.sha512: '1234567890123456789012345678901234567890'
+                    '123456789012345678901234',
+}
+
+# RFC 6238, appendix B: Unix time and the 8 digit TOTP of each digest.
+RFC6238_VECTORS = [
+    (59, 94287082, 46119246, 90693936),
+    (1111111109, 7081804, 68084774, 25091201),
+    (1111111111, 14050471, 67062674, 99943326),
+    (1234567890, 89005924, 91819424, 93441116),
+    (2000000000, 69279037, 90698825, 38618901),
+    (20000000000, 65353130, 77737706, 47863826),
+]
+
+# RFC 4226, appendix D: the HOTP values of counters 0 to 9.
+RFC4226_VECTORS = [755224, 287082, 359152, 969429, 338314, 254676, 287922,
+                   162583, 399871, 520489]
+
+
+def totp(digest, **kwargs):
+    return otp.TOTP(base64.b32encode(SEEDS[digest]), digits=8,
+                    digest=digest, **kwargs)
+
+
+class TestHOTP(unittest.TestCase):
+
+    def setUp(self):
+        self.hotp = otp.HOTP(base64.b32encode(SEEDS[hashlib.sha1]))
+
+    def test_rfc4226_vectors(self):
+        self.assertEqual(RFC4226_VECTORS,
+                         [self.hotp.at(count) for count in range(10)])
+
+    def test_verify(self):
+        self.assertTrue(self.hotp.verify(359152, 2))
+        self.assertTrue(self.hotp.verify('359152', 2))
+        self.assertFalse(self.hotp.verify(359152, 3))
+        self.assertFalse(self.hotp.verify('not a token', 2))
+
+    def test_provisioning_uri(self):
+        self.assertEqual('otpauth://hotp/alice@example.com?secret=%s'
+                         '&counter=5' % self.hotp.secret,
+                         self.hotp.provisioning_uri('alice@example.com', 5))
+
+
+class TestTOTP(unittest.TestCase):
+
+    def test_rfc6238_vectors(self):
+        for digest, column in ((hashlib.sha1, 1), (hashlib.sha256, 2),
+                               (hashlib.sha512, 3)):
+            generator = totp(digest)
+            for vector in RFC6238_VECTORS:
+                self.assertEqual(vector[column], generator.at(vector[0]))
+
+    def test_datetime(self):
+        generator = totp(hashlib.sha1)
+        for_time = datetime.datetime.fromtimestamp(1111111109)
+        self.assertEqual(7081804, generator.at(for_time))
+        self.assertEqual('07081804', generator.format(generator.at(for_time)))
+
+    def test_interval(self):
+        generator = totp(hashlib.sha1, interval=60)
+        self.assertEqual(1234567890 // 60, generator.timecode(1234567890))
+        self.assertEqual(generator.generate_otp(1234567890 // 60),
+                         generator.at(1234567890))
+
+    def test_match(self):
+        generator = totp(hashlib.sha1)
+        step = generator.timecode(1111111111)
+        previous = generator.generate_otp(step - 1)
+        self.assertEqual(None, generator.match(previous, 1111111111))
+        self.assertEqual(step - 1, generator.match(previous, 1111111111,
+                                                   look_behind=1))
+        self.assertEqual(step, generator.match('14050471', 1111111111,
+                                               look_behind=1, look_ahead=1))
+        self.assertTrue(generator.verify(14050471, 1111111111))
+        self.assertFalse(generator.verify(14050471, 1111111111 + 30))
+
+    def test_now(self):
+        generator = otp.TOTP(otp.random_base32())
+        self.assertEqual(generator.timecode(), generator.match(
+            generator.now(), look_behind=1))
+
+    def test_provisioning_uri(self):
+        generator = otp.TOTP('JBSWY3DPEHPK3PXP')
+        self.assertEqual('otpauth://totp/alice@example.com'
+                         '?secret=JBSWY3DPEHPK3PXP',
+                         generator.provisioning_uri('alice@example.com'))
+
+        generator = otp.TOTP('JBSWY3DPEHPK3PXP', digits=8,
+                             digest=hashlib.sha256, interval=60)
+        uri = urlparse.urlparse(generator.provisioning_uri(
+            'alice smith', issuer='Example Co'))
+        self.assertEqual('/Example%20Co:alice%20smith', uri.path)
+        self.assertEqual({'secret': ['JBSWY3DPEHPK3PXP'],
+                          'issuer': ['Example Co'],
+                          'algorithm': ['SHA256'], 'digits': ['8'],
+                          'period': ['60']},
+                         urlparse.parse_qs(uri.query))
+
+
+class TestRandomBase32(unittest.TestCase):
+
+    def test_random_base32(self):
+        secret = otp.random_base32()
+        self.assertEqual(16, len(secret))
+        self.assertEqual(10, len(base64.b32decode(secret)))
+        self.assertEqual(32, len(otp.random_base32(32)))
+        self.assertNotEqual(secret, otp.random_base32())
@@ -0,0 +1,843 @@
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import StringIO
+import xml.etree.ElementTree as ET
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import qrcode
+from qrcode import (base, cache, constants, exceptions, penalty, rs,
+                    stats, template, util)
+from qrcode.image.pil import Image, PilImage
+from qrcode.image.png import PngImage
+from qrcode.image.svg import SvgImage, SvgPathFragmentImage, SvgPathImage
+from qrcode.matrix import ModuleMatrix
+
+try:
+    import numpy
+    from qrcode.image.ndarray import NdarrayImage
+except ImportError:
+    numpy = None
+
+
+class TestModuleMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.data = 'otpauth://totp/test@example.com?secret=AAAAAAAAAAAAAAAA'
+
+    def tearDown(self):
+        pass
+
+    def make(self, **kwargs):
+        qr = qrcode.QRCode(**kwargs)
+        qr.add_data(self.data)
+        qr.make()
+        return qr
+
+    def test_modules_accessor(self):
+        qr = self.make()
+        self.assertTrue(isinstance(qr.modules, ModuleMatrix))
+        self.assertEqual(qr.modules_count, len(qr.modules))
+        # top left finder pattern and its separator
+        self.assertEqual([True] * 7 + [False], qr.modules[0][:8])
+        self.assertTrue(qr.modules[6][0])
+        self.assertFalse(qr.modules[7][7])
+        self.assertTrue(qr.modules[-1][0])
+        self.assertRaises(IndexError, lambda: qr.modules[qr.modules_count])
+
+    def test_unfilled_modules_read_as_none(self):
+        matrix = ModuleMatrix(21)
+        self.assertEqual(None, matrix[3][4])
+        matrix[3][4] = True
+        self.assertTrue(matrix.is_reserved(3, 4))
+        self.assertEqual(True, matrix[3][4])
+        matrix[3][4] = None
+        self.assertEqual(None, matrix[3][4])
+        self.assertFalse(matrix.is_reserved(3, 4))
+
+    def test_copy_is_independent(self):
+        qr = self.make()
+        other = qr.modules.copy()
+        other[0][0] = False
+        self.assertTrue(qr.modules[0][0])
+        self.assertEqual(qr.modules.rows()[1:], other.rows()[1:])
+
+
+class TestLostPoint(unittest.TestCase):
+
+    def setUp(self):
+        self.data = 'otpauth://totp/test@example.com?secret=AAAAAAAAAAAAAAAA'
+
+    def tearDown(self):
+        pass
+
+    def test_known_scores(self):
+        qr = qrcode.QRCode()
+        qr.add_data(self.data, optimize=False)
+        qr.best_fit()
+        scores = []
+        for mask_pattern in range(8):
+            qr.makeImpl(True, mask_pattern)
+            scores.append(penalty.bitboard_lost_point(qr.modules))
+        self.assertEqual([2666, 2041, 2153, 2150, 2098, 2076, 2218, 2299],
+                         scores)
+        self.assertEqual(scores[-1], util.lost_point(qr.modules.tolist()))
+
+    def test_engines_agree(self):
+        if not penalty._numpy_available():
+            raise unittest.SkipTest("NumPy not installed")
+        for version in (4, 6, 7, 14, 40):
+            qr = qrcode.QRCode(version=version)
+            qr.add_data(self.data)
+            for mask_pattern in range(8):
+                qr.makeImpl(True, mask_pattern)
+                self.assertEqual(penalty.bitboard_lost_point(qr.modules),
+                                 penalty.numpy_lost_point(qr.modules))
+
+
+class TestMaskSelection(unittest.TestCase):
+
+    def setUp(self):
+        self.data = 'otpauth://totp/test@example.com?secret=AAAAAAAAAAAAAAAA'
+
+    def tearDown(self):
+        pass
+
+    def test_reused_candidate_matches_rebuild(self):
+        for version in (4, 7):
+            qr = qrcode.QRCode(version=version)
+            qr.add_data(self.data)
+            qr.make(fit=False)
+            reused = qr.modules.tolist()
+
+            pattern = qr.best_mask_pattern()
+            qr._mask_candidate = None
+            qr.makeImpl(False, pattern)
+            self.assertEqual(reused, qr.modules.tolist())
+
+    def test_map_data_applies_mask(self):
+        qr = qrcode.QRCode(version=2)
+        qr.add_data(self.data[:20])
+        qr.makeImpl(True, None)
+        unmasked = qr.modules
+        qr.makeImpl(True, 5)
+        mask = util.mask_func(5)
+        for row in range(qr.modules_count):
+            for col in range(qr.modules_count):
+                expected = unmasked[row][col]
+                if expected is not None and not unmasked.is_reserved(row, col):
+                    expected = expected != bool(mask(row, col))
+                self.assertEqual(expected, qr.modules[row][col])
+
+
+class TestTemplate(unittest.TestCase):
+
+    def setUp(self):
+        template.clear()
+
+    def tearDown(self):
+        template.clear()
+
+    def test_cached_per_version(self):
+        self.assertTrue(template.get(5) is template.get(5))
+        self.assertFalse(template.get(5) is template.get(6))
+
+    def test_cache_is_bounded(self):
+        first = template.get(1)
+        for version in range(2, template.CACHE_SIZE + 2):
+            template.get(version)
+        self.assertFalse(first is template.get(1))
+
+    def test_matrix_is_a_copy(self):
+        tpl = template.get(7)
+        modules = tpl.matrix()
+        modules[0][0] = False
+        self.assertTrue(tpl.matrix()[0][0])
+        self.assertEqual(tpl.size, len(modules))
+        # version information area is reserved but cleared
+        self.assertTrue(modules.is_reserved(0, tpl.size - 11))
+        self.assertFalse(modules[0][tpl.size - 11])
+
+
+class TestReedSolomon(unittest.TestCase):
+
+    def test_encode(self):
+        # "HELLO WORLD" as a 1-M symbol
+        data = bytearray([32, 91, 11, 120, 209, 114, 220, 77, 67, 64, 236, 17,
+                          236, 17, 236, 17])
+        self.assertEqual(
+            bytearray([196, 35, 39, 119, 235, 215, 231, 226, 93, 23]),
+            rs.encode(data, 10))
+
+    def test_encode_zeros(self):
+        self.assertEqual(bytearray(7), rs.encode(bytearray(19), 7))
+
+    def test_interleave(self):
+        blocks = [bytearray([1, 2]), bytearray([3, 4]),
+                  bytearray([5, 6, 7]), bytearray([8, 9, 10])]
+        self.assertEqual(bytearray([1, 3, 5, 8, 2, 4, 6, 9, 7, 10]),
+                         rs.interleave(blocks))
+
+    def test_block_table(self):
+        # Every level fills all the codewords of a version.
+        levels = (constants.ERROR_CORRECT_L, constants.ERROR_CORRECT_M,
+                  constants.ERROR_CORRECT_Q, constants.ERROR_CORRECT_H)
+        for version in range(1, 41):
+            self.assertEqual(1, len(set(
+                sum(block.total_count
+                    for block in base.rs_blocks(version, level))
+                for level in levels)), version)
+
+
+class TestBitBuffer(unittest.TestCase):
+
+    def test_put(self):
+        buffer = util.BitBuffer()
+        buffer.put(0x4, 4)
+        buffer.put(0x3ff, 10)
+        buffer.put_bit(True)
+        self.assertEqual(15, len(buffer))
+        self.assertEqual(bytearray([0x4f, 0xfe]), buffer.buffer)
+        self.assertTrue(buffer.get(1))
+        self.assertFalse(buffer.get(15))
+
+    def test_put_bytes(self):
+        aligned = util.BitBuffer()
+        aligned.put_bytes('ab')
+        self.assertEqual(bytearray('ab'), aligned.buffer)
+
+        unaligned = util.BitBuffer()
+        unaligned.put(0x4, 4)
+        unaligned.put_bytes('ab')
+        self.assertEqual(20, len(unaligned))
+        self.assertEqual(bytearray([0x46, 0x16, 0x20]), unaligned.buffer)
+
+    def test_pad(self):
+        buffer = util.BitBuffer()
+        buffer.put(0x1, 3)
+        buffer.pad(5)
+        self.assertEqual(40, len(buffer))
+        self.assertEqual(bytearray([0x20, util.PAD0, util.PAD1, util.PAD0,
+                                    util.PAD1]), buffer.buffer)
+
+
+class TestBestFit(unittest.TestCase):
+
+    def fit(self, data, **kwargs):
+        qr = qrcode.QRCode(**kwargs)
+        qr.add_data(data)
+        return qr.best_fit(start=qr.version)
+
+    def test_capacity_table(self):
+        limits = util.BIT_LIMIT_TABLE[constants.ERROR_CORRECT_M]
+        self.assertEqual(16 * 8, limits[1])
+        self.assertEqual(2334 * 8, limits[40])
+
+    def test_version_boundaries(self):
+        # 1-M holds 14 bytes, 2-M holds 26 bytes
+        self.assertEqual(1, self.fit('a' * 14))
+        self.assertEqual(2, self.fit('a' * 15))
+        # 9-M holds 180 bytes; version 10 needs a longer count field
+        self.assertEqual(9, self.fit('a' * 180))
+        self.assertEqual(10, self.fit('a' * 181))
+        self.assertEqual(40, self.fit('a' * 2331))
+
+    def test_start(self):
+        self.assertEqual(12, self.fit('a', version=12))
+
+    def test_encodes_once(self):
+        calls = []
+        create_data = util.create_data
+
+        def counting_create_data(*args):
+            calls.append(args[0])
+            return create_data(*args)
+
+        util.create_data = counting_create_data
+        try:
+            self.assertEqual(10, self.fit('a' * 181))
+        finally:
+            util.create_data = create_data
+        self.assertEqual([10], calls)
+
+    def test_overflow(self):
+        self.assertRaises(exceptions.DataOverflowError, self.fit, 'a' * 2332)
+
+
+class TestPilImage(unittest.TestCase):
+
+    def test_drawrows_matches_drawrect(self):
+        for version, box_size, border in ((1, 1, 0), (3, 10, 4), (9, 3, 1)):
+            qr = qrcode.QRCode(version=version, box_size=box_size,
+                               border=border)
+            qr.add_data('x')
+            fast = qr.make_image()
+
+            slow = PilImage(border, qr.modules_count, box_size)
+            for r, row in enumerate(qr.modules.rows()):
+                for c, dark in enumerate(row):
+                    if dark:
+                        slow.drawrect(r, c)
+            self.assertEqual(list(slow._img.getdata()),
+                             list(fast._img.getdata()))
+
+
+class TestPngImage(unittest.TestCase):
+
+    def render(self, qr, image_factory):
+        stream = StringIO.StringIO()
+        qr.make_image(image_factory).save(stream)
+        return stream.getvalue()
+
+    def assertSamePixels(self, qr, png):
+        image = Image.open(StringIO.StringIO(png))
+        expected = qr.make_image(PilImage)._img
+        self.assertEqual(expected.size, image.size)
+        self.assertEqual(list(expected.getdata()),
+                         list(image.convert("1").getdata()))
+
+    def test_matches_pil(self):
+        for version, box_size, border in ((1, 1, 0), (4, 10, 4), (11, 3, 1)):
+            qr = qrcode.QRCode(version=version, box_size=box_size,
+                               border=border)
+            qr.add_data('x')
+            png = self.render(qr, PngImage)
+            self.assertTrue(png.startswith('\x89PNG\r\n\x1a\n'))
+            self.assertSamePixels(qr, png)
+
+    def test_small_chunks(self):
+        class SmallChunkPngImage(PngImage):
+            chunk_size = 16
+
+        qr = qrcode.QRCode(version=40, box_size=30)
+        qr.add_data('x')
+        png = self.render(qr, SmallChunkPngImage)
+        self.assertTrue(png.count('IDAT') > 1)
+        self.assertSamePixels(qr, png)
+
+    def test_drawrect(self):
+        qr = qrcode.QRCode(version=2, box_size=2)
+        qr.add_data('x')
+        qr.make()
+        image = PngImage(qr.border, qr.modules_count, qr.box_size)
+        for r, row in enumerate(qr.modules.rows()):
+            for c, dark in enumerate(row):
+                if dark:
+                    image.drawrect(r, c)
+        stream = StringIO.StringIO()
+        image.save(stream)
+        self.assertSamePixels(qr, stream.getvalue())
+
+
+class TestSvgPathImage(unittest.TestCase):
+
+    def render(self, qr, image_factory):
+        stream = StringIO.StringIO()
+        qr.make_image(image_factory).save(stream)
+        return stream.getvalue()
+
+    def dark_cells(self, svg, tag):
+        """Return the modules covered by the path, offset by the border."""
+        path = ET.fromstring(svg).find(tag)
+        cells = set()
+        for x, y, length in re.findall(r'M(\d+) (\d+)h(\d+)v1h-\3z',
+                                       path.get('d')):
+            for i in range(int(length)):
+                cells.add((int(y), int(x) + i))
+        return cells
+
+    def expected_cells(self, qr):
+        return set((r + qr.border, c + qr.border)
+                   for r, row in enumerate(qr.modules.rows())
+                   for c, dark in enumerate(row) if dark)
+
+    def test_standalone(self):
+        qr = qrcode.QRCode(version=10)
+        qr.add_data('x')
+        svg = self.render(qr, SvgPathImage)
+        self.assertTrue(svg.startswith("<?xml"))
+        root = ET.fromstring(svg)
+        self.assertEqual('{http://www.w3.org/2000/svg}svg', root.tag)
+        self.assertEqual('65mm', root.get('width'))
+        self.assertEqual('0 0 65 65', root.get('viewBox'))
+        self.assertEqual(
+            self.expected_cells(qr),
+            self.dark_cells(svg, '{http://www.w3.org/2000/svg}path'))
+
+    def test_fragment(self):
+        qr = qrcode.QRCode(version=2, border=1)
+        qr.add_data('x')
+        svg = self.render(qr, SvgPathFragmentImage)
+        self.assertTrue(svg.startswith("<svg:svg"))
+        self.assertEqual(
+            self.expected_cells(qr),
+            self.dark_cells(svg, '{http://www.w3.org/2000/svg}path'))
+
+    def test_smaller_than_rects(self):
+        qr = qrcode.QRCode(version=10)
+        qr.add_data('x')
+        self.assertTrue(len(self.render(qr, SvgPathImage)) * 4 <
+                        len(self.render(qr, SvgImage)))
+
+    def test_drawrect(self):
+        qr = qrcode.QRCode(version=1)
+        qr.add_data('x')
+        qr.make()
+        image = SvgPathImage(qr.border, qr.modules_count, qr.box_size)
+        for r, row in enumerate(qr.modules.rows()):
+            for c, dark in enumerate(row):
+                if dark:
+                    image.drawrect(r, c)
+        stream = StringIO.StringIO()
+        image.save(stream)
+        self.assertEqual(
+            self.expected_cells(qr),
+            self.dark_cells(stream.getvalue(),
+                            '{http://www.w3.org/2000/svg}path'))
+
+
+class TestMakeMany(unittest.TestCase):
+
+    def setUp(self):
+        self.payloads = ['otpauth://totp/user%d@example.com?secret=AAAA' % i
+                         for i in range(12)]
+        self.options = dict(image_factory=PngImage, box_size=2)
+
+    def expected(self):
+        images = []
+        for data in self.payloads:
+            stream = StringIO.StringIO()
+            qrcode.make(data, **self.options).save(stream)
+            images.append(stream.getvalue())
+        return images
+
+    def test_ordered(self):
+        images = qrcode.make_many(iter(self.payloads), processes=2,
+                                  window=3, **self.options)
+        self.assertEqual(self.expected(), list(images))
+
+    def test_unordered(self):
+        images = qrcode.make_many(self.payloads, processes=2,
+                                  ordered=False, **self.options)
+        self.assertEqual(list(enumerate(self.expected())),
+                         sorted(images))
+
+    def test_in_process(self):
+        images = qrcode.make_many(self.payloads, processes=0,
+                                  **self.options)
+        self.assertEqual(self.expected(), list(images))
+
+    def test_in_process_interleaved(self):
+        # Each generator keeps its own options.
+        pngs = qrcode.make_many(self.payloads, processes=0, **self.options)
+        svgs = qrcode.make_many(self.payloads, processes=0,
+                                image_factory=SvgPathImage)
+        for png, svg in zip(pngs, svgs):
+            self.assertTrue(png.startswith('\x89PNG'))
+            self.assertTrue(svg.startswith('<?xml'))
+
+    def test_error(self):
+        images = qrcode.make_many(['x' * 3000], processes=1, version=40,
+                                  error_correction=constants.ERROR_CORRECT_H,
+                                  **self.options)
+        self.assertRaises(exceptions.DataOverflowError, list, images)
+
+
+class TestOptimalDataChunks(unittest.TestCase):
+
+    def chunks(self, data, version=1):
+        return [(chunk.mode, chunk.data)
+                for chunk in util.optimal_data_chunks(data, version)]
+
+    def test_single_mode(self):
+        self.assertEqual([(util.MODE_NUMBER, '0123456789')],
+                         self.chunks('0123456789'))
+        self.assertEqual([(util.MODE_ALPHA_NUM, 'HELLO WORLD')],
+                         self.chunks('HELLO WORLD'))
+        self.assertEqual([(util.MODE_8BIT_BYTE, 'hello')],
+                         self.chunks('hello'))
+
+    def test_provisioning_uri(self):
+        self.assertEqual(
+            [(util.MODE_8BIT_BYTE, 'otpauth://totp/test@example.com?secret='),
+             (util.MODE_ALPHA_NUM, 'JBSWY3DPEHPK3PXP')],
+            self.chunks('otpauth://totp/test@example.com'
+                        '?secret=JBSWY3DPEHPK3PXP'))
+
+    def test_short_runs_not_split(self):
+        # A segment header costs more than encoding "12" as bytes saves.
+        self.assertEqual([(util.MODE_8BIT_BYTE, 'ab12cd')],
+                         self.chunks('ab12cd'))
+        self.assertEqual([(util.MODE_ALPHA_NUM, 'AB12CD')],
+                         self.chunks('AB12CD'))
+
+    def test_digits_inside_alphanumeric(self):
+        self.assertEqual(
+            [(util.MODE_ALPHA_NUM, 'ABC'),
+             (util.MODE_NUMBER, '01234567890123456789'),
+             (util.MODE_ALPHA_NUM, 'DEF')],
+            self.chunks('ABC01234567890123456789DEF'))
+
+    def test_count_field_size(self):
+        # Longer count fields at higher versions make switching cost more.
+        data = 'a' + '1' * 7 + 'b'
+        self.assertEqual(3, len(self.chunks(data, 1)))
+        self.assertEqual(1, len(self.chunks(data, 27)))
+
+    def test_unicode(self):
+        self.assertEqual([(util.MODE_8BIT_BYTE, '\xc3\xa9t\xc3\xa9')],
+                         self.chunks(u'\xe9t\xe9'))
+
+    def test_add_data(self):
+        data = 'otpauth://totp/test@example.com?secret=AAAAAAAAAAAAAAAA'
+        optimized = qrcode.QRCode()
+        optimized.add_data(data)
+        single = qrcode.QRCode()
+        single.add_data(data, optimize=False)
+        self.assertEqual(2, len(optimized.data_list))
+        self.assertEqual(1, len(single.data_list))
+        self.assertTrue(util.data_bit_length(optimized.data_list, 1) <
+                        util.data_bit_length(single.data_list, 1))
+
+    def test_segmented_for_fitted_version(self):
+        # Splitting the digits off pays for version 1 count fields, but not
+        # for the longer ones of the version the data ends up at.
+        data = ('a' + '1' * 7 + 'b') * 40
+        qr = qrcode.QRCode()
+        qr.add_data(data)
+        qr.make()
+        self.assertTrue(qr.version >= 10)
+        self.assertEqual([(util.MODE_8BIT_BYTE, data)],
+                         [(chunk.mode, chunk.data) for chunk in qr.data_list])
+        self.assertTrue(
+            util.data_bit_length(qr.data_list, qr.version) <
+            util.data_bit_length(util.optimal_data_chunks(data, 1),
+                                 qr.version))
+
+    def test_segmented_for_set_version(self):
+        data = ('a' + '1' * 7 + 'b') * 10
+        qr = qrcode.QRCode()
+        qr.add_data(data)
+        qr.version = 27
+        qr.make(fit=False)
+        self.assertEqual(1, len(qr.data_list))
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.options = dict(image_factory=PngImage, box_size=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        self.assertEqual(cache.cache_key('x'),
+                         cache.cache_key('x', box_size=10, border=4))
+        self.assertNotEqual(cache.cache_key('x'), cache.cache_key('y'))
+        self.assertNotEqual(cache.cache_key('x'),
+                            cache.cache_key('x', image_factory=PngImage))
+        self.assertNotEqual(cache.cache_key('x'),
+                            cache.cache_key('x', kind='JPEG'))
+        self.assertRaises(TypeError, cache.cache_key, 'x', colour='red')
+
+    def test_get_or_make(self):
+        images = cache.ImageCache()
+        stream = StringIO.StringIO()
+        qrcode.make('x', **self.options).save(stream)
+        self.assertEqual(stream.getvalue(),
+                         images.get_or_make('x', **self.options))
+        self.assertEqual(stream.getvalue(),
+                         images.get_or_make('x', **self.options))
+        stats = images.stats()
+        self.assertEqual((1, 1, 1), (stats['hits'], stats['misses'],
+                                     stats['entries']))
+        self.assertEqual(len(stream.getvalue()), stats['bytes'])
+
+    def test_lru_eviction(self):
+        images = cache.ImageCache(max_bytes=25)
+        images.put('a', 'a' * 10)
+        images.put('b', 'b' * 10)
+        images.get('a')
+        images.put('c', 'c' * 10)
+        self.assertEqual(None, images.get('b'))
+        self.assertEqual('a' * 10, images.get('a'))
+        self.assertEqual('c' * 10, images.get('c'))
+        self.assertEqual(1, images.evictions)
+        self.assertEqual(20, images.size)
+
+        images.put('d', 'd' * 30)
+        self.assertEqual(None, images.get('d'))
+        self.assertEqual(2, len(images))
+
+    def test_disk_tier(self):
+        writer = cache.ImageCache(directory=self.directory)
+        image = writer.get_or_make('x', tag='alice', **self.options)
+        reader = cache.ImageCache(directory=self.directory)
+        self.assertEqual(image,
+                         reader.get_or_make('x', tag='alice', **self.options))
+        self.assertEqual(1, reader.hits)
+        self.assertEqual(1, len(reader))
+        # Images are filed under a hash of their tag, with no temporary
+        # files left behind.
+        names = os.listdir(self.directory)
+        self.assertEqual(1, len(names))
+        self.assertFalse('alice' in names[0])
+        self.assertEqual(
+            sorted([cache.cache_key('x', **self.options), '.generation']),
+            sorted(os.listdir(os.path.join(self.directory, names[0]))))
+
+    def test_clear_tag(self):
+        images = cache.ImageCache(directory=self.directory)
+        images.get_or_make('secret', tag='alice', **self.options)
+        images.get_or_make('other', tag='bob', **self.options)
+        stored = images._entries.values()[0]
+
+        images.clear_tag('alice')
+        self.assertEqual(bytearray(len(stored)), stored)
+        self.assertEqual(1, len(images))
+        self.assertEqual(1, len(os.listdir(self.directory)))
+        self.assertEqual(None, images.get(
+            cache.cache_key('secret', **self.options), 'alice'))
+        self.assertEqual(None, cache.ImageCache(
+            directory=self.directory).get(
+                cache.cache_key('secret', **self.options), 'alice'))
+
+    def test_clear_tag_shared(self):
+        key = cache.cache_key('secret', **self.options)
+        writer = cache.ImageCache(directory=self.directory)
+        image = writer.get_or_make('secret', tag='alice', **self.options)
+        reader = cache.ImageCache(directory=self.directory)
+        self.assertEqual(image, reader.get(key, 'alice'))
+        stored = reader._entries.values()[0]
+
+        # Clearing the tag in one process clears it from the memory of the
+        # others.
+        writer.clear_tag('alice')
+        self.assertEqual(None, reader.get(key, 'alice'))
+        self.assertEqual(bytearray(len(stored)), stored)
+        self.assertEqual(0, len(reader))
+
+        # Images stored under the tag again are cached as usual.
+        writer.put(key, 'new', 'alice')
+        self.assertEqual('new', reader.get(key, 'alice'))
+        self.assertEqual('new', reader.get(key, 'alice'))
+        self.assertEqual(1, len(reader))
+
+
+class TestStats(unittest.TestCase):
+
+    def test_stages(self):
+        collected = stats.Stats()
+        qr = qrcode.QRCode(stats=collected)
+        qr.add_data('x')
+        qr.make_image(PngImage).save(StringIO.StringIO())
+        calls = dict((stage, totals['calls'])
+                     for stage, totals in collected.snapshot().items())
+        self.assertEqual({'best_fit': 1, 'create_data': 1, 'makeImpl': 2,
+                          'lost_point': 8, 'make_image': 1, 'save': 1},
+                         calls)
+        for totals in collected.snapshot().values():
+            self.assertTrue(0 <= totals['max_time'] <= totals['time'])
+            self.assertEqual(None, totals['peak'])
+
+        collected.reset()
+        self.assertEqual({}, collected.snapshot())
+
+    def test_callback(self):
+        records = []
+        collected = stats.Stats(
+            callback=lambda *args: records.append(args))
+        qrcode.make('x', stats=collected, image_factory=PngImage)
+        self.assertEqual(['best_fit', 'create_data', 'lost_point', 'makeImpl',
+                          'make_image'],
+                         sorted(set(stage for stage, elapsed, peak
+                                    in records)))
+
+    def test_log_callback(self):
+        messages = []
+
+        class Logger(object):
+            def log(self, level, message, *args):
+                messages.append((level, message % args))
+
+        callback = stats.log_callback(Logger(), logging.INFO)
+        callback('lost_point', 0.0015, None)
+        self.assertEqual([(logging.INFO, 'qrcode lost_point 1.500ms')],
+                         messages)
+
+    def test_memory(self):
+        if stats.resource is None:
+            self.assertRaises(NotImplementedError, stats.Stats, memory=True)
+            return
+        collected = stats.Stats(memory=True)
+        qrcode.make('x', stats=collected, image_factory=PngImage)
+        for totals in collected.snapshot().values():
+            self.assertTrue(totals['peak'] >= 0)
+
+        # Each stage records how much the peak grew while it ran, nested
+        # stages included.
+        rss = iter([1000, 1000, 1500, 4000])
+        max_rss, stats._max_rss = stats._max_rss, lambda: next(rss)
+        try:
+            collected.reset()
+            stats.measure(collected, 'outer', stats.measure, collected,
+                          'inner', lambda: None)
+        finally:
+            stats._max_rss = max_rss
+        self.assertEqual({'outer': 3000, 'inner': 500},
+                         dict((stage, totals['peak']) for stage, totals
+                              in collected.snapshot().items()))
+
+    def test_cache(self):
+        collected = stats.Stats()
+        images = cache.ImageCache()
+        for i in range(2):
+            images.get_or_make('x', stats=collected, image_factory=PngImage)
+        self.assertEqual(1, collected.snapshot()['save']['calls'])
+
+
+class TestTextOutput(unittest.TestCase):
+
+    class Stream(object):
+        encoding = None
+
+        def __init__(self):
+            self.writes = []
+
+        def isatty(self):
+            return True
+
+        def write(self, text):
+            self.writes.append(text)
+
+        def flush(self):
+            pass
+
+    def setUp(self):
+        self.qr = qrcode.QRCode(version=2, border=2)
+        self.qr.add_data('x')
+        self.qr.make()
+        size = self.qr.modules_count + 4
+        self.rows = [[0] * size for i in range(2)]
+        self.rows.extend([0, 0] + list(row) + [0, 0]
+                         for row in self.qr.modules.rows())
+        self.rows.extend([0] * size for i in range(2))
+
+    def render(self, **kwargs):
+        stream = self.Stream()
+        self.qr.print_ascii(stream, **kwargs)
+        self.assertEqual(1, len(stream.writes))
+        return stream.writes[0].decode('utf-8')
+
+    def half_blocks(self, text, glyphs):
+        rows = []
+        for line in text.splitlines():
+            codes = [glyphs.index(char) for char in line]
+            rows.append([code & 1 for code in codes])
+            rows.append([code >> 1 for code in codes])
+        return rows[:len(self.rows)]
+
+    def test_half_blocks(self):
+        text = self.render()
+        self.assertEqual(self.rows, self.half_blocks(
+            text, u" \u2580\u2584\u2588"))
+
+    def test_invert(self):
+        text = self.render(invert=True)
+        self.assertEqual(self.rows, self.half_blocks(
+            text, u"\u2588\u2584\u2580 "))
+
+    def test_tty(self):
+        text = self.render(tty=True)
+        lines = text.splitlines()
+        for line in lines:
+            self.assertTrue(line.startswith(u"\x1b[40;97m"))
+            self.assertTrue(line.endswith(u"\x1b[0m"))
+        text = u"\n".join(line[8:-4] for line in lines)
+        self.assertEqual(self.rows, self.half_blocks(
+            text, u"\u2588\u2584\u2580 "))
+
+    def test_ascii_only(self):
+        text = self.render(ascii_only=True)
+        self.assertEqual(self.rows,
+                         [[int(line[i] == "#") for i in range(0, len(line), 2)]
+                          for line in text.splitlines()])
+
+    def test_print_tty(self):
+        stream = self.Stream()
+        self.qr.print_tty(stream)
+        self.assertEqual(1, len(stream.writes))
+        # Follow the background colour along each line, two characters per
+        # module; the first and last lines are the white edge.
+        rows = []
+        for line in stream.writes[0].splitlines()[1:-1]:
+            row = []
+            for code, spaces in re.findall(r'\x1b\[([0-9;]*)m( *)', line):
+                row.extend([int(code == '40')] * (len(spaces) // 2))
+            rows.append(row[1:-1])
+        self.assertEqual([list(row) for row in self.qr.modules.rows()], rows)
+
+    def test_print_tty_needs_tty(self):
+        self.assertRaises(OSError, self.qr.print_tty, StringIO.StringIO())
+
+
+class TestNdarrayImage(unittest.TestCase):
+
+    def setUp(self):
+        if numpy is None:
+            raise unittest.SkipTest("NumPy not installed")
+
+    def make(self, **kwargs):
+        qr = qrcode.QRCode(**kwargs)
+        qr.add_data('x')
+        return qr, qr.make_image(NdarrayImage)
+
+    def test_modules(self):
+        qr, image = self.make(version=2)
+        self.assertEqual(numpy.bool_, image.modules.dtype)
+        self.assertEqual([[bool(dark) for dark in row]
+                          for row in qr.modules.rows()],
+                         image.modules.tolist())
+
+    def test_matches_pil(self):
+        for version, box_size, border in ((1, 1, 0), (3, 10, 4), (5, 3, 1)):
+            qr, image = self.make(version=version, box_size=box_size,
+                                  border=border)
+            expected = qr.make_image(PilImage)._img.convert("L")
+            self.assertEqual(numpy.uint8, image.array.dtype)
+            self.assertEqual(expected.size, image.array.shape)
+            self.assertEqual(list(expected.getdata()),
+                             image.array.ravel().tolist())
+
+    def test_zero_copy(self):
+        qr, image = self.make(version=1, box_size=2)
+        array = numpy.asarray(image)
+        self.assertEqual(image.array.ctypes.data, array.ctypes.data)
+        self.assertEqual(image.array.shape, memoryview(image.array).shape)
+
+    def test_drawrect(self):
+        qr = qrcode.QRCode(version=1)
+        qr.add_data('x')
+        qr.make()
+        image = NdarrayImage(qr.border, qr.modules_count, qr.box_size)
+        for r, row in enumerate(qr.modules.rows()):
+            for c, dark in enumerate(row):
+                if dark:
+                    image.drawrect(r, c)
+        self.assertTrue(numpy.array_equal(qr.make_image(NdarrayImage).array,
+                                          image.array))
+
+    def test_save(self):
+        qr, image = self.make(version=1)
+        stream = StringIO.StringIO()
+        image.save(stream)
+        stream.seek(0)
+        self.assertTrue(numpy.array_equal(image.array, numpy.load(stream)))
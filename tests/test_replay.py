@@ -0,0 +1,134 @@
+import sys
+import threading
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from mock import MagicMock
+
+from replay import LocalStore, ReplayGuard
+
+
+class TestReplayGuard(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1234567890.0
+        self.guard = ReplayGuard(clock=lambda: self.now)
+        self.step = int(self.now) // 30
+
+    def test_claim_once(self):
+        self.assertTrue(self.guard.claim('alice', self.step))
+        self.assertFalse(self.guard.claim('alice', self.step))
+        self.assertTrue(self.guard.claim('bob', self.step))
+        self.assertTrue(self.guard.claim('alice', self.step - 1))
+        self.assertEqual(3, len(self.guard))
+
+    def test_unicode_uids(self):
+        self.assertTrue(self.guard.claim(u'alice', self.step))
+        self.assertFalse(self.guard.claim('alice', self.step))
+
+    def test_window(self):
+        # The previous step, and the one before for verifications that
+        # straddled a step boundary.
+        self.assertTrue(self.guard.claim('alice', self.step - 2))
+        self.assertFalse(self.guard.claim('alice', self.step - 3))
+        self.assertFalse(self.guard.claim('alice', self.step + 1))
+
+        guard = ReplayGuard(look_ahead=1, clock=lambda: self.now)
+        self.assertTrue(guard.claim('alice', self.step + 1))
+
+    def test_steps_age_out(self):
+        self.guard.claim('alice', self.step)
+        self.guard.claim('bob', self.step)
+        self.now += 60
+        self.assertEqual(2, len(self.guard))
+        self.assertFalse(self.guard.claim('alice', self.step))
+        self.now += 30
+        self.assertEqual(0, len(self.guard))
+        self.assertFalse(self.guard.claim('alice', self.step))
+
+        # The bucket of the aged out step is reused.
+        self.now += 30
+        step = int(self.now) // 30
+        self.assertTrue(self.guard.claim('carol', step))
+        self.assertEqual(1, len(self.guard))
+
+    def test_step_rolls_over_during_claim(self):
+        step = self.step
+        calls = []
+
+        def clock():
+            if not calls:
+                calls.append(self.now)
+                # The clock moves on to the next step, whose claims take
+                # the slot of the oldest step, before this claim of the
+                # oldest step takes the lock.
+                self.now += 30
+                self.assertTrue(guard.claim('bob', step + 1))
+                return calls[0]
+            return self.now
+
+        guard = ReplayGuard(shards=1, clock=clock)
+        self.assertFalse(guard.claim('alice', step - 2))
+        self.assertFalse(guard.claim('bob', step + 1))
+
+    def test_concurrent_claims(self):
+        claimed = []
+
+        def claim():
+            for i in range(200):
+                if self.guard.claim('user%d' % i, self.step):
+                    claimed.append(i)
+
+        threads = [threading.Thread(target=claim) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(range(200), sorted(claimed))
+
+    def test_backend(self):
+        store = LocalStore(clock=lambda: self.now)
+        first = ReplayGuard(backend=store, clock=lambda: self.now)
+        second = ReplayGuard(backend=store, clock=lambda: self.now)
+        self.assertTrue(first.claim('alice', self.step))
+        self.assertFalse(second.claim('alice', self.step))
+        self.assertTrue(second.claim('bob', self.step))
+        self.assertEqual(2, len(store))
+
+    def test_backend_error(self):
+        store = LocalStore(clock=lambda: self.now)
+        backend = MagicMock(name='backend')
+        backend.add.side_effect = IOError('connection refused')
+        guard = ReplayGuard(backend=backend, clock=lambda: self.now)
+        for claimed, uid in enumerate(['alice', u'\xe9lodie']):
+            self.assertRaises(IOError, guard.claim, uid, self.step)
+            # The failed claim is forgotten, so the token can be used once
+            # the backend is back.
+            self.assertEqual(claimed, len(guard))
+            backend.add.side_effect = store.add
+            self.assertTrue(guard.claim(uid, self.step))
+            self.assertFalse(guard.claim(uid, self.step))
+            backend.add.side_effect = IOError('connection refused')
+
+
+class TestLocalStore(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.store = LocalStore(clock=lambda: self.now)
+
+    def test_add(self):
+        self.assertTrue(self.store.add('key', 10))
+        self.assertFalse(self.store.add('key', 10))
+        self.now += 10
+        self.assertTrue(self.store.add('key', 10))
+
+    def test_expired_keys_are_swept(self):
+        for i in range(1000):
+            self.store.add(i, 10)
+        self.now += 10
+        for i in range(1000, 1100):
+            self.store.add(i, 10)
+        self.assertEqual(100, len(self.store))
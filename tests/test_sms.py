@@ -0,0 +1,422 @@
+import errno
+import socket
+import sys
+import threading
+import time
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from mock import MagicMock
+from twilio import TwilioRestException
+
+import sms
+from replay import LocalStore
+from sms import Coalescer, FakeTransport, HttpTransport, Outbox
+from sms import TwilioTransport
+from sms_standin import StandInServer
+
+
+def blocked_transport(release):
+    """A transport which sends once ``release`` is set."""
+    transport = FakeTransport()
+
+    def send(to, from_, body):
+        release.wait()
+        return sms.SENT
+    transport.send = send
+    return transport
+
+
+class TestOutbox(unittest.TestCase):
+
+    def test_send_in_background(self):
+        transport = FakeTransport()
+        outbox = Outbox(transport, workers=2)
+        messages = [outbox.send('+1415555%04d' % i, '+14155551212', 'hi')
+                    for i in range(10)]
+        for message in messages:
+            self.assertTrue(message.done.wait(5))
+            self.assertEqual(sms.SENT, outbox.status(message.id)['status'])
+        self.assertEqual(10, len(transport.sent))
+        outbox.close()
+
+    def test_send_returns_immediately(self):
+        release = threading.Event()
+        transport = blocked_transport(release)
+        outbox = Outbox(transport, workers=1)
+        message = outbox.send('+14155550000', '+14155551212', 'hi')
+        self.assertIn(message.status, (sms.QUEUED, sms.SENDING))
+        release.set()
+        self.assertTrue(message.done.wait(5))
+        self.assertEqual(sms.SENT, message.status)
+        outbox.close()
+
+    def test_retry(self):
+        transport = FakeTransport(failures=2)
+        outbox = Outbox(transport, workers=0, backoff=0)
+        message = outbox.send('+14155550000', '+14155551212', 'hi')
+        self.assertEqual(sms.SENT, message.status)
+        self.assertEqual(3, message.attempts)
+
+    def test_backoff(self):
+        delays = []
+        sms.time.sleep, sleep = delays.append, sms.time.sleep
+        try:
+            outbox = Outbox(FakeTransport(failures=10), workers=0,
+                            retries=5, backoff=0.5, max_backoff=4)
+            message = outbox.send('+14155550000', '+14155551212', 'hi')
+        finally:
+            sms.time.sleep = sleep
+        self.assertEqual([0.5, 1, 2, 4, 4], delays)
+        self.assertEqual(sms.FAILED, message.status)
+        self.assertEqual(6, message.attempts)
+        self.assertEqual('fake transport failure', message.error)
+
+    def test_other_errors_not_retried(self):
+        transport = FakeTransport(failures=2, error=IOError)
+        outbox = Outbox(transport, workers=0, backoff=0)
+        message = outbox.send('+14155550000', '+14155551212', 'hi')
+        self.assertEqual(sms.FAILED, message.status)
+        self.assertEqual(1, message.attempts)
+        self.assertEqual('fake transport failure', message.error)
+
+    def test_refused(self):
+        transport = FakeTransport(invalid=['Fake'])
+        outbox = Outbox(transport, workers=0)
+        message = outbox.send('Fake', '+14155551212', 'hi')
+        self.assertEqual(sms.FAILED, message.status)
+        self.assertEqual(1, message.attempts)
+
+    def test_bounded_queue(self):
+        release = threading.Event()
+        transport = blocked_transport(release)
+        outbox = Outbox(transport, workers=1, max_queued=1)
+        messages = [outbox.send('+14155550000', '+14155551212', 'hi')
+                    for i in range(5)]
+        # One is being sent and one is queued, so at least three are
+        # refused.
+        failed = [message for message in messages
+                  if message.status == sms.FAILED]
+        self.assertTrue(len(failed) >= 3)
+        self.assertEqual('outbox full', failed[-1].error)
+        release.set()
+        outbox.close()
+
+    def test_status(self):
+        outbox = Outbox(FakeTransport(), workers=0, max_tracked=2)
+        messages = [outbox.send('+14155550000', '+14155551212', 'secret')
+                    for i in range(3)]
+        self.assertEqual(None, outbox.status(messages[0].id))
+        self.assertEqual(None, outbox.status('unknown'))
+        self.assertEqual({'id': messages[2].id, 'status': sms.SENT,
+                          'attempts': 1, 'error': None},
+                         outbox.status(messages[2].id))
+
+
+class TestTwilioTransport(unittest.TestCase):
+
+    def test_send(self):
+        client = MagicMock(name='mock_twilio')
+        transport = TwilioTransport(client)
+        self.assertEqual(sms.SENT, transport.send('+14155550000',
+                                                  '+14155551212', 'hi'))
+        client.sms.messages.create.assert_called_with(
+            to='+14155550000', from_='+14155551212', body='hi')
+
+        client.sms.messages.create.return_value.status = 'failed'
+        self.assertEqual(sms.FAILED, transport.send('+14155550000',
+                                                    '+14155551212', 'hi'))
+
+    def test_refused(self):
+        client = MagicMock(name='mock_twilio')
+        client.sms.messages.create.side_effect = TwilioRestException(
+            400, '/SMS/Messages.json', 'Invalid number', 21211)
+        outbox = Outbox(TwilioTransport(client), workers=0, backoff=0)
+        message = outbox.send('Fake', '+14155551212', 'hi')
+        self.assertEqual(sms.FAILED, message.status)
+        # A client error isn't retried.
+        self.assertEqual(1, message.attempts)
+
+    def test_server_error(self):
+        client = MagicMock(name='mock_twilio')
+        client.sms.messages.create.side_effect = TwilioRestException(
+            503, '/SMS/Messages.json', 'Service Unavailable')
+        outbox = Outbox(TwilioTransport(client), workers=0, retries=2,
+                        backoff=0)
+        message = outbox.send('+14155550000', '+14155551212', 'hi')
+        self.assertEqual(sms.FAILED, message.status)
+        self.assertEqual(3, message.attempts)
+        self.assertTrue('503' in message.error)
+
+    def test_connection_refused(self):
+        client = MagicMock(name='mock_twilio')
+        client.sms.messages.create.side_effect = socket.error(
+            errno.ECONNREFUSED, 'Connection refused')
+        outbox = Outbox(TwilioTransport(client), workers=0, retries=2,
+                        backoff=0)
+        message = outbox.send('+14155550000', '+14155551212', 'hi')
+        self.assertEqual(3, message.attempts)
+
+    def test_timeout(self):
+        # Twilio may have taken the message before the read timed out.
+        client = MagicMock(name='mock_twilio')
+        client.sms.messages.create.side_effect = socket.timeout('timed out')
+        outbox = Outbox(TwilioTransport(client), workers=0, backoff=0)
+        message = outbox.send('+14155550000', '+14155551212', 'hi')
+        self.assertEqual(sms.FAILED, message.status)
+        self.assertEqual(1, message.attempts)
+
+
+class TestCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.transport = FakeTransport(invalid=['Fake'])
+        self.coalescer = Coalescer(Outbox(self.transport, workers=0),
+                                   clock=lambda: self.now)
+
+    def send(self, coalescer, key, to='+14155550000'):
+        return coalescer.send(key, to, '+14155551212', 'hi')
+
+    def test_duplicates_are_suppressed(self):
+        first = self.send(self.coalescer, ('alice', '+14155550000', 33))
+        second = self.send(self.coalescer, ('alice', '+14155550000', 33))
+        self.assertTrue(first is second)
+        self.send(self.coalescer, ('alice', '+14155550000', 34))
+        self.send(self.coalescer, ('bob', '+14155550000', 33))
+        self.assertEqual(3, len(self.transport.sent))
+        self.assertEqual(1, self.coalescer.suppressed)
+
+    def test_expiry(self):
+        self.send(self.coalescer, 'key')
+        self.now += 60
+        self.send(self.coalescer, 'key')
+        self.assertEqual(2, len(self.transport.sent))
+        self.assertEqual(0, self.coalescer.suppressed)
+
+    def test_failed_sends_are_retried(self):
+        first = self.send(self.coalescer, 'key', to='Fake')
+        self.assertEqual(sms.FAILED, first.status)
+        second = self.send(self.coalescer, 'key', to='Fake')
+        self.assertFalse(first is second)
+        self.assertEqual(2, self.transport.calls)
+        self.assertEqual(0, self.coalescer.suppressed)
+
+    def test_expired_keys_are_swept(self):
+        for i in range(1000):
+            self.send(self.coalescer, i)
+        self.now += 60
+        for i in range(1000, 1100):
+            self.send(self.coalescer, i)
+        self.assertEqual(100, len(self.coalescer))
+
+    def test_backend(self):
+        store = LocalStore(clock=lambda: self.now)
+        first = Coalescer(Outbox(self.transport, workers=0), backend=store,
+                          clock=lambda: self.now)
+        second = Coalescer(Outbox(self.transport, workers=0), backend=store,
+                           clock=lambda: self.now)
+        key = (u'alice', '+14155550000', 33)
+        self.assertEqual(sms.SENT, self.send(first, key).status)
+        message = self.send(second, key)
+        self.assertEqual(sms.COALESCED, message.status)
+        self.assertTrue(message is self.send(second, key))
+        self.assertEqual(1, len(self.transport.sent))
+        self.assertEqual(2, second.suppressed)
+
+    def test_failed_send_releases_backend_key(self):
+        store = LocalStore(clock=lambda: self.now)
+        first = Coalescer(Outbox(FakeTransport(invalid=['Fake']), workers=0),
+                          backend=store, clock=lambda: self.now)
+        second = Coalescer(Outbox(self.transport, workers=0), backend=store,
+                           clock=lambda: self.now)
+        key = ('alice', '+14155550000', 33)
+        self.assertEqual(sms.FAILED, self.send(first, key, to='Fake').status)
+        self.assertEqual(sms.SENT, self.send(second, key).status)
+        self.assertEqual(sms.COALESCED, self.send(first, key).status)
+
+    def test_backend_error(self):
+        backend = MagicMock()
+        backend.add.side_effect = IOError("store unreachable")
+        coalescer = Coalescer(Outbox(self.transport, workers=0),
+                              backend=backend, clock=lambda: self.now)
+        self.assertRaises(IOError, self.send, coalescer, 'key')
+        self.assertEqual(0, len(coalescer))
+        backend.add.side_effect = None
+        backend.add.return_value = True
+        self.assertEqual(sms.SENT, self.send(coalescer, 'key').status)
+
+    def test_sends_outside_the_lock(self):
+        entered = threading.Event()
+        release = threading.Event()
+        transport = FakeTransport()
+
+        def send(to, from_, body):
+            if to == '+14155550001':
+                entered.set()
+                release.wait()
+            return sms.SENT
+        transport.send = send
+        coalescer = Coalescer(Outbox(transport, workers=0))
+        thread = threading.Thread(target=self.send, args=(
+            coalescer, 'a', '+14155550001'))
+        thread.start()
+        try:
+            self.assertTrue(entered.wait(5))
+            # Other sends go through while the first one is blocked, and
+            # the same key gets the message in progress.
+            self.assertEqual(sms.SENT, self.send(coalescer, 'b').status)
+            self.assertEqual(sms.SENDING, self.send(
+                coalescer, 'a', '+14155550001').status)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(1, coalescer.suppressed)
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def transport(self, **pool_options):
+        transport = HttpTransport('AC123', 'secret',
+                                  base_url=self.server.url, **pool_options)
+        self.addCleanup(transport.pool.close)
+        return transport
+
+    def test_send(self):
+        transport = self.transport()
+        self.assertEqual(sms.SENT, transport.send(
+            '+14155550000', '+14155551212', u'code: 123456 \u2713'))
+        path, form = self.server.messages[0]
+        self.assertEqual('/2010-04-01/Accounts/AC123/SMS/Messages.json', path)
+        self.assertEqual({'To': '+14155550000', 'From': '+14155551212',
+                          'Body': 'code: 123456 \xe2\x9c\x93'}, form)
+
+    def test_keep_alive(self):
+        transport = self.transport()
+        for i in range(5):
+            transport.send('+14155550000', '+14155551212', 'hi')
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(1, transport.pool.created)
+
+    def test_unpooled(self):
+        transport = self.transport(size=0)
+        for i in range(3):
+            transport.send('+14155550000', '+14155551212', 'hi')
+        self.assertEqual(3, transport.pool.created)
+
+    def test_concurrent_sends(self):
+        transport = self.transport(size=4)
+        results = []
+
+        def send():
+            for i in range(10):
+                results.append(transport.send('+14155550000',
+                                              '+14155551212', 'hi'))
+
+        threads = [threading.Thread(target=send) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([sms.SENT] * 40, results)
+        self.assertEqual(40, len(self.server.messages))
+        self.assertTrue(transport.pool.created <= 4)
+
+    def test_errors(self):
+        transport = self.transport()
+        self.server.responses = [(201, 'failed'), (400, 'failed'),
+                                 (503, 'failed')]
+        self.assertEqual(sms.FAILED, transport.send('+1', '+2', 'hi'))
+        self.assertEqual(sms.FAILED, transport.send('Fake', '+2', 'hi'))
+        self.assertRaises(sms.TransportError, transport.send, '+1', '+2',
+                          'hi')
+
+    def test_closed_idle_connection(self):
+        self.server.idle_timeout = 0.05
+        transport = self.transport()
+        transport.send('+14155550000', '+14155551212', 'hi')
+        time.sleep(0.2)
+        self.assertEqual(sms.SENT, transport.send('+14155550000',
+                                                  '+14155551212', 'hi'))
+        self.assertEqual(2, transport.pool.created)
+        self.assertEqual(2, len(self.server.messages))
+
+    def test_response_cut_off(self):
+        transport = self.transport()
+        transport.send('+14155550000', '+14155551212', 'hi')
+        self.server.responses = [(None, None)]
+        # The message was taken, so it isn't sent again on a new
+        # connection.
+        self.assertRaises(sms.OutcomeUnknown, transport.send,
+                          '+14155550000', '+14155551212', 'hi')
+        self.assertEqual(2, len(self.server.messages))
+        self.assertEqual(1, transport.pool.created)
+
+    def test_not_json(self):
+        transport = self.transport()
+        self.server.responses = [(201, None)]
+        self.assertEqual(sms.SENT, transport.send('+14155550000',
+                                                  '+14155551212', 'hi'))
+
+    def test_read_timeout(self):
+        self.server.latency = 0.5
+        transport = self.transport(read_timeout=0.05)
+        self.assertRaises(sms.OutcomeUnknown, transport.send, '+1', '+2',
+                          'hi')
+
+    def test_connection_refused(self):
+        # Nothing listens on the port once the server is stopped.
+        transport = self.transport()
+        self.server.stop()
+        self.server = StandInServer().start()
+        self.assertRaises(sms.TransportError, transport.send, '+1', '+2',
+                          'hi')
+
+
+class TestOutboxOverHttp(unittest.TestCase):
+    """An Outbox sending through an HttpTransport sends a message once,
+    whatever happens to the response."""
+
+    def setUp(self):
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def send(self, **pool_options):
+        transport = HttpTransport('AC123', 'secret',
+                                  base_url=self.server.url, **pool_options)
+        self.addCleanup(transport.pool.close)
+        outbox = Outbox(transport, workers=0, retries=3, backoff=0)
+        return outbox.send('+14155550000', '+14155551212', 'hi')
+
+    def test_read_timeout(self):
+        self.server.latency = 0.3
+        message = self.send(read_timeout=0.1)
+        self.assertEqual(sms.FAILED, message.status)
+        self.assertEqual(1, message.attempts)
+        self.assertTrue(message.error.startswith('outcome unknown'))
+        # The server takes the message once it is done waiting.
+        time.sleep(0.5)
+        self.assertEqual(1, len(self.server.messages))
+
+    def test_response_cut_off(self):
+        self.server.responses = [(None, None)]
+        message = self.send()
+        self.assertEqual(sms.FAILED, message.status)
+        self.assertEqual(1, message.attempts)
+        self.assertEqual(1, len(self.server.messages))
+
+    def test_server_error_retried(self):
+        self.server.responses = [(503, 'failed')]
+        message = self.send()
+        self.assertEqual(sms.SENT, message.status)
+        self.assertEqual(2, message.attempts)
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from konfig import Konfig
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Seconds a new worker may take to import the app, unless configured with
+# COLD_START_BUDGET.
+DEFAULT_BUDGET = 1.0
+
+
+def run_python(code):
+    """Run code in a fresh interpreter from the repository root."""
+    return subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+
+
+class TestColdStart(unittest.TestCase):
+
+    def test_import_budget(self):
+        budget = float(Konfig().cold_start_budget or DEFAULT_BUDGET)
+        code = ("import time\n"
+                "start = time.time()\n"
+                "import app\n"
+                "print(time.time() - start)\n")
+        # The best of a few runs, so a busy machine doesn't fail the test.
+        elapsed = min(float(run_python(code).split()[-1]) for i in range(3))
+        self.assertTrue(elapsed < budget,
+                        "importing app took %.3fs, the budget is %.3fs" %
+                        (elapsed, budget))
+
+    def test_heavy_modules_are_lazy(self):
+        code = ("import sys\n"
+                "import app\n"
+                "for name in ('twilio', 'PIL', 'Image', 'numpy',\n"
+                "             'xml.etree.ElementTree', 'multiprocessing'):\n"
+                "    if sys.modules.get(name) is not None:\n"
+                "        print(name)\n")
+        self.assertEqual('', run_python(code).strip())
+
+    def test_import_profile(self):
+        output = run_python("import importprofile\n"
+                            "importprofile.profile('qrcode').report()\n")
+        self.assertTrue('qrcode.main' in output)
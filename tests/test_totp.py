@@ -1,3 +1,4 @@
+import imp
 import sys
 import StringIO
 import datetime
@@ -8,7 +9,8 @@ else:
 
 import Image
 
-from totp_auth import TotpAuth
+import otp
+from totp_auth import MAX_SECRETS, TokenCache, TotpAuth
 
 
 class TestTOTPAuth(unittest.TestCase):
@@ -72,3 +74,155 @@ class TestTOTPAuth(unittest.TestCase):
         past = datetime.datetime.fromtimestamp(past_unixtime)
         token = auth.totp.at(past)
         self.assertFalse(auth.valid(token))
+
+    def test_matches_example_code(self):
+        example = imp.load_source('totp_all_code',
+                                  'example/totp-all-code.py')
+        reference = example.TOTP(self.test_token)
+        auth = TotpAuth(self.test_token)
+        for step in range(0, 100000000, 7654321):
+            self.assertEqual(reference.generate_otp(step),
+                             auth.token_at_step(step))
+
+    def test_verify_returns_step(self):
+        auth = TotpAuth(self.test_token)
+        now = auth.timecode()
+        self.assertEqual(now, auth.verify(auth.token_at_step(now)))
+        self.assertEqual(now - 1, auth.verify(auth.token_at_step(now - 1)))
+        self.assertEqual(None, auth.verify(auth.token_at_step(now + 1)))
+        self.assertEqual(None, auth.verify(auth.token_at_step(now - 2)))
+
+    def test_verify_for_time(self):
+        auth = TotpAuth(self.test_token)
+        known_time = datetime.datetime.fromtimestamp(872835282)
+        step = auth.timecode(known_time)
+        self.assertEqual(872835282 // 30, step)
+        self.assertEqual(step, auth.verify(auth.totp.at(known_time),
+                                           for_time=known_time))
+
+    def test_window(self):
+        auth = TotpAuth(self.test_token, look_behind=0, look_ahead=2)
+        now = auth.timecode()
+        self.assertEqual(None, auth.verify(auth.token_at_step(now - 1)))
+        self.assertEqual(now + 2, auth.verify(auth.token_at_step(now + 2)))
+
+    def test_zero_padded_tokens(self):
+        auth = TotpAuth(self.test_token)
+        step = 0
+        while auth.token_at_step(step) >= 100000:
+            step += 1
+        for_time = datetime.datetime.fromtimestamp(step * 30)
+        token = '%06d' % auth.token_at_step(step)
+        self.assertEqual(step, auth.verify(token, for_time=for_time))
+
+    def test_invalid_tokens(self):
+        auth = TotpAuth(self.test_token)
+        for token in ('', 'abcdef', None, '12 34'):
+            self.assertFalse(auth.valid(token))
+
+
+class CountingTOTP(otp.TOTP):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingTOTP, self).__init__(*args, **kwargs)
+        self.generated = 0
+
+    def generate_otp(self, counter):
+        self.generated += 1
+        return super(CountingTOTP, self).generate_otp(counter)
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1234567890.0
+        self.cache = TokenCache(max_secrets=2, clock=lambda: self.now)
+        self.auth = TotpAuth('AAAAAAAAAAAAAAAA', cache=self.cache)
+        self.auth.totp = CountingTOTP('AAAAAAAAAAAAAAAA')
+
+    def test_send_then_verify(self):
+        for_time = datetime.datetime.fromtimestamp(self.now)
+        step = self.auth.timecode(for_time)
+        token = self.auth.window(for_time)[0][1]
+        self.assertEqual(2, self.auth.totp.generated)
+        self.assertEqual(step, self.auth.verify(token, for_time))
+        self.assertEqual(step, self.auth.verify(token, for_time))
+        self.assertEqual(None, self.auth.verify('000000', for_time))
+        self.assertEqual(2, self.auth.totp.generated)
+        self.assertEqual((1, 3), (self.cache.misses, self.cache.hits))
+
+    def test_tokens(self):
+        steps = [100, 99, 101]
+        expected = [self.auth.token_at_step(step) for step in steps]
+        generated = self.auth.totp.generated
+        self.assertEqual(expected, self.cache.tokens(self.auth.totp, steps))
+        self.assertEqual(generated + 3, self.auth.totp.generated)
+
+    def test_rollover(self):
+        totp = self.auth.totp
+        self.cache.tokens(totp, [100, 99])
+        # Only the step that entered the window is computed.
+        tokens = self.cache.tokens(totp, [101, 100])
+        self.assertEqual(3, totp.generated)
+        reference = otp.TOTP(totp.secret)
+        self.assertEqual([reference.generate_otp(101),
+                          reference.generate_otp(100)], tokens)
+        # And the one that left it is dropped.
+        self.cache.tokens(totp, [99])
+        self.assertEqual(4, totp.generated)
+
+    def test_expiry(self):
+        totp = self.auth.totp
+        self.cache.tokens(totp, [100])
+        self.now += 30
+        self.cache.tokens(totp, [100])
+        self.assertEqual(1, totp.generated)
+        self.now += 60
+        self.cache.tokens(totp, [100])
+        self.assertEqual(2, totp.generated)
+
+    def test_expired_entries_are_dropped(self):
+        self.cache.tokens(otp.TOTP('AAAAAAAAAAAAAAAA'), [100])
+        self.now += 60
+        self.cache.tokens(otp.TOTP('BBBBBBBBBBBBBBBB'), [100])
+        self.assertEqual(1, len(self.cache))
+
+    def test_eviction(self):
+        for secret in ('AAAAAAAAAAAAAAAA', 'BBBBBBBBBBBBBBBB',
+                       'CCCCCCCCCCCCCCCC'):
+            self.cache.tokens(otp.TOTP(secret), [100])
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(1, self.cache.evictions)
+
+    def test_keyed_by_parameters(self):
+        self.cache.tokens(otp.TOTP('AAAAAAAAAAAAAAAA'), [100])
+        eight = otp.TOTP('AAAAAAAAAAAAAAAA', digits=8)
+        self.assertEqual([eight.generate_otp(100)],
+                         self.cache.tokens(eight, [100]))
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+    def test_full_size(self):
+        cache = TokenCache(clock=lambda: self.now)
+        secrets = [otp.random_base32() for i in range(MAX_SECRETS)]
+        for secret in secrets:
+            cache.tokens(otp.TOTP(secret), [100, 99])
+        self.assertEqual(MAX_SECRETS, len(cache))
+
+        # Hits read the cached tokens.
+        totp = CountingTOTP(secrets[0])
+        self.assertEqual([otp.TOTP(secrets[0]).generate_otp(100),
+                          otp.TOTP(secrets[0]).generate_otp(99)],
+                         cache.tokens(totp, [100, 99]))
+        self.assertEqual(0, totp.generated)
+        self.assertEqual(1, cache.hits)
+
+        # Entries used in a later step outlive the others.
+        self.now += 30
+        for secret in secrets[MAX_SECRETS // 2:]:
+            cache.tokens(otp.TOTP(secret), [100, 99])
+        self.assertEqual(MAX_SECRETS // 2 + 1, cache.hits)
+        self.now += 30
+        cache.tokens(otp.TOTP(secrets[-1]), [100, 99])
+        self.assertEqual(MAX_SECRETS // 2, len(cache))
+        self.assertEqual(0, cache.evictions)
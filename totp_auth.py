@@ -1,30 +1,172 @@
-import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 
-import pyotp
+import otp
 import qrcode
 
+# The default number of secrets whose tokens TokenCache keeps.
+MAX_SECRETS = 10000
+
+
+def secret_key(totp):
+    """Return the TokenCache key of a TOTP: a hash of its parameters."""
+    parts = [totp.secret, str(totp.digits), totp.digest().name,
+             str(totp.interval)]
+    return hashlib.sha256('\0'.join(parts)).digest()
+
+
+class TokenCache(object):
+    """
+    A thread-safe LRU cache of the tokens of each secret's verification
+    window.
+
+    Only the steps last asked for are kept for a secret, so when the clock
+    moves on to the next step the tokens that left the window are dropped
+    and those still in it are reused. Secrets unused for a whole step
+    expire, and the least recently used are evicted beyond ``max_secrets``
+    (recency is only tracked to the step, so a hit within the step of the
+    previous one just reads the entry). Entries are keyed by a hash of the
+    secret, never the secret itself.
+    """
+
+    def __init__(self, max_secrets=MAX_SECRETS, clock=time.time):
+        self.max_secrets = max_secrets
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (expiry time, steps, tokens), least recently used first
+        self._windows = OrderedDict()
+        # No entry expires before this time.
+        self._next_expiry = float('inf')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._windows)
+
+    def tokens(self, totp, steps, key=None):
+        """
+        Return the tokens of ``totp`` for ``steps``, computing only those
+        not already cached.
+        """
+        if key is None:
+            key = secret_key(totp)
+        steps = tuple(steps)
+        now = self.clock()
+        # The window lasts until the end of the step after this one.
+        expires = (int(now) // totp.interval + 2) * totp.interval
+        with self._lock:
+            if now >= self._next_expiry:
+                self._expire(now)
+            entry = self._windows.get(key)
+            if entry is not None and entry[1] == steps:
+                self.hits += 1
+                if entry[0] != expires:
+                    # Moved to the back once per step rather than on every
+                    # hit, which is enough to expire and evict by step.
+                    del self._windows[key]
+                    self._windows[key] = (expires, steps, entry[2])
+                return list(entry[2])
+            self.misses += 1
+
+        cached = dict(zip(entry[1], entry[2])) if entry is not None else {}
+        tokens = tuple([cached[step] if step in cached
+                        else totp.generate_otp(step) for step in steps])
+
+        with self._lock:
+            self._windows.pop(key, None)
+            self._windows[key] = (expires, steps, tokens)
+            self._next_expiry = min(self._next_expiry, expires)
+            while len(self._windows) > self.max_secrets:
+                self._windows.popitem(last=False)
+                self.evictions += 1
+        return list(tokens)
+
+    def _expire(self, now):
+        # Least recently used first, so the expired entries are at the front
+        # and only those are looked at.
+        windows = self._windows
+        while windows:
+            key = next(iter(windows))
+            expires = windows[key][0]
+            if expires > now:
+                self._next_expiry = expires
+                return
+            del windows[key]
+        self._next_expiry = float('inf')
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+            self._next_expiry = float('inf')
+
+
+# The tokens of every secret verified by this process.
+token_cache = TokenCache()
+
 
 class TotpAuth:
-    def __init__(self, secret=None):
+    """Time-based one-time passwords for a secret.
+
+    Checking a token costs a single HMAC per time step in the verification
+    window: ``look_behind`` steps before the current one (to allow for
+    tokens typed in just before they expire) and ``look_ahead`` steps after
+    it (for clocks running fast).
+
+    The tokens of the window are kept in ``cache`` (by default the process
+    wide ``token_cache``), so sending a token and verifying it, retries and
+    double submits within a step don't compute any of them again.
+    """
+
+    def __init__(self, secret=None, look_behind=1, look_ahead=0, cache=None):
         if secret is None:
-            secret = pyotp.random_base32()
+            secret = otp.random_base32()
         self.secret = secret
-        self.totp = pyotp.TOTP(secret)
+        self.totp = otp.TOTP(secret)
+        self.look_behind = look_behind
+        self.look_ahead = look_ahead
+        self.cache = token_cache if cache is None else cache
+        self._cache_key = secret_key(self.totp)
+        # The offsets of the window's steps, nearest first.
+        self._offsets = tuple(sorted(range(-look_behind, look_ahead + 1),
+                                     key=abs))
+
+    def timecode(self, for_time=None):
+        """Return the time step of a datetime (by default, now)."""
+        return self.totp.timecode(for_time)
+
+    def token_at_step(self, step):
+        return self.totp.generate_otp(step)
+
+    def window(self, for_time=None):
+        """
+        Return the ``(step, token)`` pairs of the verification window of
+        ``for_time`` (by default, now), nearest step first.
+        """
+        step = self.timecode(for_time)
+        steps = tuple([step + offset for offset in self._offsets])
+        return zip(steps, self.cache.tokens(self.totp, steps,
+                                            self._cache_key))
 
     def generate_token(self):
-        return self.totp.now()
+        return self.window()[0][1]
+
+    def verify(self, token, for_time=None):
+        """Return the time step ``token`` is valid for, or None.
+
+        Every step of the window is checked, the nearest to ``for_time``
+        (by default, now) winning if the token matches several of them.
+        """
+        return self.totp.match_tokens(token, self.window(for_time))
 
     def valid(self, token):
-        token = int(token)
-        now = datetime.datetime.now()
-        time30secsago = now + datetime.timedelta(seconds=-30)
-        try:
-            valid_now = self.totp.verify(token)
-            valid_past = self.totp.verify(token, for_time=time30secsago)
-            return valid_now or valid_past
-        except:
-            return False
-
-    def qrcode(self, username):
-        uri = self.totp.provisioning_uri(username)
-        return qrcode.make(uri)
+        return self.verify(token) is not None
+
+    def provisioning_uri(self, username):
+        return self.totp.provisioning_uri(username)
+
+    def qrcode(self, username, image_factory=None):
+        uri = self.provisioning_uri(username)
+        return qrcode.make(uri, image_factory=image_factory)